@@ -5,9 +5,11 @@
 #include <stdlib.h>
 #include <string.h>
 
-#define MAX_QUESTIONS 100
+#include "qbank.h"
+
 #define MAX_STR_LEN 256
 #define DATA_FILE "questions.txt"
+#define QBANK_FILE "questions.qbk"
 
 // ANSI Color Codes
 #define ANSI_COLOR_RED     "\x1b[31m"
@@ -26,18 +28,28 @@
 // 题目结构体
 typedef struct {
     int id;
-    char content[MAX_STR_LEN];     // 题目
-    char correct_answer[MAX_STR_LEN]; // 标准答案
+    const char* content;           // 题目（指向题库映射区或 QuestionSet 自有内存，无长度限制）
+    const char* correct_answer;    // 标准答案
     int score;                     // 分值
     // 以下字段用于考后分析
     char user_answer[MAX_STR_LEN]; // 用户填写的答案
     int obtained_score;            // 用户该题得分
 } Question;
 
+// 题目集合：数量不设上限，按实际题数动态分配
+typedef struct {
+    Question* items;
+    int count;
+    QBank* bank;                   // 非 NULL 表示由二进制题库加载，字符串指向映射区
+} QuestionSet;
+
 // --- 函数声明 ---
 
 // get_data.c
-int load_questions(const char* filename, Question* q_array);
+int load_questions(const char* filename, QuestionSet* set);
+int load_questions_from_bank(const char* filename, QuestionSet* set);
+int load_question_set(QuestionSet* set); // 优先 QBANK_FILE，回退 DATA_FILE
+void free_question_set(QuestionSet* set);
 
 // add_questions.c (新增)
 void append_question_to_file(const char* filename);
@@ -51,6 +63,7 @@ void get_user_input(char* buffer, int size);
 
 // grading.c
 int calculate_score(const char* user_ans, const char* correct_ans, int full_score);
+int calculate_score_batch(const char** user_answers, int count, const char* correct_ans, int full_score, int* out_scores);
 
 // main.c (CLI 入口)
 void start_exam();
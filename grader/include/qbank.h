@@ -0,0 +1,83 @@
+#ifndef QBANK_H
+#define QBANK_H
+
+#include <stdint.h>
+#include <stddef.h>
+
+// 二进制题库 (questions.qbk)，由 web/utils/question_bank.py 生成
+// 文件以 mmap 方式只读映射，字符串直接指向映射区（UTF-8，'\0' 结尾），无需拷贝
+#define QBANK_MAGIC "QBNK"
+#define QBANK_VERSION 2
+#define QBANK_HEADER_SIZE 64
+
+typedef struct {
+    char magic[4];
+    uint32_t version;
+    uint32_t header_size;
+    uint32_t question_count;
+    uint32_t category_count;
+    uint32_t id_slots;
+    uint32_t cat_slots;
+    uint32_t records_off;
+    uint32_t id_index_off;
+    uint32_t categories_off;
+    uint32_t cat_index_off;
+    uint32_t members_off;
+    uint32_t strings_off;
+    uint32_t strings_size;
+    uint32_t file_size;
+} QBankHeader;
+
+typedef struct {
+    int32_t id;
+    int32_t score;
+    int32_t version;  // 题目评分版本（Question.version），成绩按此记录 question_version
+    uint32_t category_index;
+    uint32_t content_off;
+    uint32_t content_len;
+    uint32_t answer_off;
+    uint32_t answer_len;
+    uint32_t image_off;
+    uint32_t image_len;
+} QBankRecord;
+
+typedef struct {
+    uint32_t name_off;
+    uint32_t name_len;
+    uint32_t members_start;
+    uint32_t members_count;
+} QBankCategory;
+
+typedef struct QBank QBank;
+
+// 题目视图：所有指针均指向映射区，生命周期与 QBank 相同
+typedef struct {
+    int id;
+    int score;
+    int version;
+    const char* content;
+    const char* correct_answer;
+    const char* image;
+    const char* category;
+} QBankQuestion;
+
+// 打开/关闭题库，失败返回 NULL
+QBank* qbank_open(const char* path);
+void qbank_close(QBank* bank);
+
+uint32_t qbank_count(const QBank* bank);
+uint32_t qbank_category_count(const QBank* bank);
+
+// 按记录下标读取题目，下标越界返回 0
+int qbank_get(const QBank* bank, uint32_t index, QBankQuestion* out);
+
+// 按题目 id 查找（哈希表，O(1)），找到返回 1
+int qbank_find_by_id(const QBank* bank, int id, QBankQuestion* out);
+
+// 按类别名查找（哈希表，O(1)），返回该类别的记录下标数组（指向映射区）及数量
+const uint32_t* qbank_find_category(const QBank* bank, const char* category, uint32_t* count);
+
+// 第 index 个类别的名称
+const char* qbank_category_name(const QBank* bank, uint32_t index);
+
+#endif
@@ -10,19 +10,16 @@ void draw_box_bottom(int width);
 
 void start_exam() {
     clear_screen();
-    Question *questions = (Question*)malloc(MAX_QUESTIONS * sizeof(Question));
-    if (!questions) {
-        LOG_ERROR("Memory allocation failed for questions array");
-        pause_console();
-        return;
-    }
-    int count = load_questions(DATA_FILE, questions);
+    // 优先使用二进制题库（mmap，秒级加载且无题数上限），不存在时回退到 questions.txt
+    QuestionSet set;
+    int count = load_question_set(&set);
     if (count == 0) {
         printf(ANSI_COLOR_RED "题库为空，请先在主菜单添加题目！\n" ANSI_COLOR_RESET);
-        free(questions);
+        free_question_set(&set);
         pause_console();
         return;
     }
+    Question *questions = set.items;
     shuffle_questions(questions, count);
     int total_score = 0;
     int max_score = 0;
@@ -62,6 +59,6 @@ void start_exam() {
     else                       printf("│  评价: " ANSI_COLOR_RED "不及格 (Fail)   " ANSI_COLOR_RESET "             \n");
     draw_box_bottom(40);
     display_wrong_questions(questions, count);
-    free(questions);
+    free_question_set(&set);
     pause_console();
 }
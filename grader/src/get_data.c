@@ -1,10 +1,53 @@
 #include "grader_common.h"
 
-int load_questions(const char* filename, Question* q_array) {
-    if (!filename || !q_array) {
+// 读取任意长度的一行（去掉换行符），返回堆内存，EOF 返回 NULL
+static char* read_line(FILE* file) {
+    size_t cap = MAX_STR_LEN, len = 0;
+    char* buf = (char*)malloc(cap);
+    if (!buf) return NULL;
+    int c;
+    while ((c = fgetc(file)) != EOF && c != '\n') {
+        if (len + 1 >= cap) {
+            char* grown = (char*)realloc(buf, cap * 2);
+            if (!grown) {
+                free(buf);
+                return NULL;
+            }
+            buf = grown;
+            cap *= 2;
+        }
+        buf[len++] = (char)c;
+    }
+    if (c == EOF && len == 0) {
+        free(buf);
+        return NULL;
+    }
+    if (len > 0 && buf[len - 1] == '\r') len--;
+    buf[len] = '\0';
+    return buf;
+}
+
+static int push_question(QuestionSet* set, int* cap, Question q) {
+    if (set->count >= *cap) {
+        int new_cap = *cap ? *cap * 2 : 64;
+        Question* grown = (Question*)realloc(set->items, new_cap * sizeof(Question));
+        if (!grown) {
+            LOG_ERROR("Memory allocation failed for questions array");
+            return 0;
+        }
+        set->items = grown;
+        *cap = new_cap;
+    }
+    set->items[set->count++] = q;
+    return 1;
+}
+
+int load_questions(const char* filename, QuestionSet* set) {
+    if (!filename || !set) {
         LOG_ERROR("Invalid arguments passed to load_questions");
         return 0;
     }
+    memset(set, 0, sizeof(*set));
 
     FILE* file = fopen(filename, "r");
     if (!file) {
@@ -13,70 +56,57 @@ int load_questions(const char* filename, Question* q_array) {
         return 0;
     }
 
-    char line[MAX_STR_LEN * 3];
-    int count = 0;
-
-    while (count < MAX_QUESTIONS && fgets(line, sizeof(line), file)) {
-        // 安全改进：检查行是否过长
-        size_t len = strlen(line);
-        if (len > 0 && line[len-1] != '\n' && !feof(file)) {
-            LOG_ERROR("Line too long in data file, skipping.");
-            // 消耗掉剩余的行内容
-            int c;
-            while ((c = fgetc(file)) != '\n' && c != EOF);
+    int cap = 0;
+    char* line;
+    while ((line = read_line(file)) != NULL) {
+        // 跳过空行
+        if (strlen(line) < 1) {
+            free(line);
             continue;
         }
 
-        // 跳过空行
-        if (len < 2) continue;
-
-        line[strcspn(line, "\n")] = 0;
-
         // 安全改进：使用手动解析代替 strtok
-        char *current = line;
-        char *next_token;
-        
+        // 各字段就地切分，content 指向行首，释放时 free(content) 即释放整行
+        Question q;
+        memset(&q, 0, sizeof(q));
+        q.id = set->count + 1;
+
         // 1. Content
-        next_token = strchr(current, '|');
+        char* next_token = strchr(line, '|');
         if (!next_token) {
             LOG_ERROR("Malformed line (missing separator 1): %s", line);
+            free(line);
             continue;
         }
         *next_token = '\0'; // 分割字符串
-        
-        q_array[count].id = count + 1;
-        strncpy(q_array[count].content, current, MAX_STR_LEN - 1);
-        q_array[count].content[MAX_STR_LEN - 1] = '\0';
-        
-        current = next_token + 1;
+        q.content = line;
+        char* current = next_token + 1;
 
         // 2. Answer
         next_token = strchr(current, '|');
         if (!next_token) {
-            LOG_ERROR("Malformed line (missing separator 2) for question ID %d", q_array[count].id);
+            LOG_ERROR("Malformed line (missing separator 2) for question ID %d", q.id);
+            free(line);
             continue;
         }
         *next_token = '\0';
-
-        strncpy(q_array[count].correct_answer, current, MAX_STR_LEN - 1);
-        q_array[count].correct_answer[MAX_STR_LEN - 1] = '\0';
-
+        q.correct_answer = current;
         current = next_token + 1;
 
         // 3. Score (安全改进：使用 strtol)
-        char *endptr;
+        char* endptr;
         long val = strtol(current, &endptr, 10);
         if (current == endptr) {
-             LOG_ERROR("Invalid score format for question ID %d", q_array[count].id);
-             continue;
+            LOG_ERROR("Invalid score format for question ID %d", q.id);
+            free(line);
+            continue;
         }
-        q_array[count].score = (int)val;
+        q.score = (int)val;
 
-        // 初始化考试状态字段
-        q_array[count].obtained_score = 0;
-        memset(q_array[count].user_answer, 0, MAX_STR_LEN);
-
-        count++;
+        if (!push_question(set, &cap, q)) {
+            free(line);
+            break;
+        }
     }
 
     if (ferror(file)) {
@@ -84,6 +114,58 @@ int load_questions(const char* filename, Question* q_array) {
     }
 
     fclose(file);
-    LOG_INFO("Loaded %d questions from %s", count, filename);
-    return count;
-}
\ No newline at end of file
+    LOG_INFO("Loaded %d questions from %s", set->count, filename);
+    return set->count;
+}
+
+int load_questions_from_bank(const char* filename, QuestionSet* set) {
+    if (!filename || !set) {
+        LOG_ERROR("Invalid arguments passed to load_questions_from_bank");
+        return 0;
+    }
+    memset(set, 0, sizeof(*set));
+
+    QBank* bank = qbank_open(filename);
+    if (!bank) return 0;
+
+    uint32_t count = qbank_count(bank);
+    set->items = (Question*)calloc(count ? count : 1, sizeof(Question));
+    if (!set->items) {
+        LOG_ERROR("Memory allocation failed for questions array");
+        qbank_close(bank);
+        return 0;
+    }
+    set->bank = bank;
+
+    QBankQuestion view;
+    for (uint32_t i = 0; i < count; i++) {
+        if (!qbank_get(bank, i, &view)) continue;
+        Question* q = &set->items[set->count++];
+        q->id = view.id;
+        q->content = view.content;
+        q->correct_answer = view.correct_answer;
+        q->score = view.score;
+    }
+    return set->count;
+}
+
+int load_question_set(QuestionSet* set) {
+    if (load_questions_from_bank(QBANK_FILE, set) > 0) {
+        return set->count;
+    }
+    free_question_set(set);
+    return load_questions(DATA_FILE, set);
+}
+
+void free_question_set(QuestionSet* set) {
+    if (!set) return;
+    if (set->bank) {
+        qbank_close(set->bank);
+    } else {
+        for (int i = 0; i < set->count; i++) {
+            free((char*)set->items[i].content);
+        }
+    }
+    free(set->items);
+    memset(set, 0, sizeof(*set));
+}
@@ -72,18 +72,12 @@ int levenshtein_distance(const char *s1, const char *s2) {
     return v0[len2];
 }
 
-int calculate_score(const char* user_ans, const char* correct_ans, int full_score) {
-    if (!user_ans || !correct_ans) {
-        LOG_ERROR("Invalid arguments to calculate_score");
-        return 0;
-    }
-
+// 内部辅助：用户答案与已标准化的标准答案比较
+static int score_normalized(const char* user_ans, const char* c_norm, int full_score) {
     char u_norm[MAX_STR_LEN + 1]; // +1 for safety
-    char c_norm[MAX_STR_LEN + 1];
 
     // 1. 预处理：标准化 (转小写、去首尾空格、合并中间空格)
     normalize_string(u_norm, user_ans, sizeof(u_norm));
-    normalize_string(c_norm, correct_ans, sizeof(c_norm));
 
     // 2. 精确匹配 (标准化后)
     if (strcmp(u_norm, c_norm) == 0) {
@@ -118,4 +112,30 @@ int calculate_score(const char* user_ans, const char* correct_ans, int full_scor
     }
 
     return 0;
-}
\ No newline at end of file
+}
+
+int calculate_score(const char* user_ans, const char* correct_ans, int full_score) {
+    if (!user_ans || !correct_ans) {
+        LOG_ERROR("Invalid arguments to calculate_score");
+        return 0;
+    }
+
+    char c_norm[MAX_STR_LEN + 1];
+    normalize_string(c_norm, correct_ans, sizeof(c_norm));
+    return score_normalized(user_ans, c_norm, full_score);
+}
+
+int calculate_score_batch(const char** user_answers, int count, const char* correct_ans, int full_score, int* out_scores) {
+    if (!user_answers || !correct_ans || !out_scores || count < 0) {
+        LOG_ERROR("Invalid arguments to calculate_score_batch");
+        return 0;
+    }
+
+    // 同一道题批量评分（重新阅卷），标准答案只需标准化一次
+    char c_norm[MAX_STR_LEN + 1];
+    normalize_string(c_norm, correct_ans, sizeof(c_norm));
+    for (int i = 0; i < count; i++) {
+        out_scores[i] = user_answers[i] ? score_normalized(user_answers[i], c_norm, full_score) : 0;
+    }
+    return count;
+}
@@ -0,0 +1,242 @@
+#include "qbank.h"
+#include "grader_common.h"
+
+#ifdef _WIN32
+#include <windows.h>
+#else
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
+#endif
+
+struct QBank {
+    const unsigned char* base;
+    size_t size;
+    const QBankHeader* header;
+    const QBankRecord* records;
+    const uint32_t* id_index;
+    const QBankCategory* categories;
+    const uint32_t* cat_index;
+    const uint32_t* members;
+    const char* strings;
+#ifdef _WIN32
+    HANDLE file;
+    HANDLE mapping;
+#endif
+};
+
+// 哈希函数需与 web/utils/question_bank.py 保持一致
+static uint32_t id_hash(int id) {
+    return (uint32_t)id * 2654435761u;
+}
+
+static uint32_t name_hash(const char* name) {
+    uint32_t h = 2166136261u;
+    for (const unsigned char* p = (const unsigned char*)name; *p; p++) {
+        h ^= *p;
+        h *= 16777619u;
+    }
+    return h;
+}
+
+static int section_ok(const QBank* bank, uint32_t off, uint64_t len) {
+    return (uint64_t)off + len <= bank->size;
+}
+
+// 字符串 [off, off+len] 须落在字符串区内（含结尾 '\0'）
+static int string_ok(const QBankHeader* h, uint32_t off, uint32_t len) {
+    return (uint64_t)off + len < h->strings_size;
+}
+
+static int validate(QBank* bank) {
+    if (bank->size < QBANK_HEADER_SIZE) return 0;
+    const QBankHeader* h = (const QBankHeader*)bank->base;
+    if (memcmp(h->magic, QBANK_MAGIC, 4) != 0 || h->version != QBANK_VERSION) return 0;
+    if (h->file_size != bank->size) return 0;
+    if (h->id_slots == 0 || (h->id_slots & (h->id_slots - 1)) != 0) return 0;
+    if (h->cat_slots == 0 || (h->cat_slots & (h->cat_slots - 1)) != 0) return 0;
+    if (!section_ok(bank, h->records_off, (uint64_t)h->question_count * sizeof(QBankRecord))) return 0;
+    if (!section_ok(bank, h->id_index_off, (uint64_t)h->id_slots * 4)) return 0;
+    if (!section_ok(bank, h->categories_off, (uint64_t)h->category_count * sizeof(QBankCategory))) return 0;
+    if (!section_ok(bank, h->cat_index_off, (uint64_t)h->cat_slots * 4)) return 0;
+    if (!section_ok(bank, h->members_off, (uint64_t)h->question_count * 4)) return 0;
+    if (!section_ok(bank, h->strings_off, h->strings_size)) return 0;
+    if ((h->records_off | h->id_index_off | h->categories_off | h->cat_index_off | h->members_off) & 3) return 0;
+
+    bank->header = h;
+    bank->records = (const QBankRecord*)(bank->base + h->records_off);
+    bank->id_index = (const uint32_t*)(bank->base + h->id_index_off);
+    bank->categories = (const QBankCategory*)(bank->base + h->categories_off);
+    bank->cat_index = (const uint32_t*)(bank->base + h->cat_index_off);
+    bank->members = (const uint32_t*)(bank->base + h->members_off);
+    bank->strings = (const char*)(bank->base + h->strings_off);
+
+    // 逐条校验记录与索引，截断或被改动的文件不能导致越界读取
+    if (h->strings_size == 0) {
+        if (h->question_count != 0 || h->category_count != 0) return 0;
+    } else if (bank->strings[h->strings_size - 1] != '\0') {
+        return 0;
+    }
+    for (uint32_t i = 0; i < h->question_count; i++) {
+        const QBankRecord* r = &bank->records[i];
+        if (r->category_index >= h->category_count) return 0;
+        if (!string_ok(h, r->content_off, r->content_len) ||
+            !string_ok(h, r->answer_off, r->answer_len) ||
+            !string_ok(h, r->image_off, r->image_len)) return 0;
+        if (bank->members[i] >= h->question_count) return 0;
+    }
+    for (uint32_t i = 0; i < h->category_count; i++) {
+        const QBankCategory* c = &bank->categories[i];
+        if (!string_ok(h, c->name_off, c->name_len)) return 0;
+        if ((uint64_t)c->members_start + c->members_count > h->question_count) return 0;
+    }
+    for (uint32_t i = 0; i < h->id_slots; i++) {
+        if (bank->id_index[i] > h->question_count) return 0;
+    }
+    for (uint32_t i = 0; i < h->cat_slots; i++) {
+        if (bank->cat_index[i] > h->category_count) return 0;
+    }
+    return 1;
+}
+
+QBank* qbank_open(const char* path) {
+    if (!path) {
+        LOG_ERROR("Invalid path passed to qbank_open");
+        return NULL;
+    }
+    QBank* bank = (QBank*)calloc(1, sizeof(QBank));
+    if (!bank) {
+        LOG_ERROR("Memory allocation failed for question bank");
+        return NULL;
+    }
+
+#ifdef _WIN32
+    bank->file = CreateFileA(path, GENERIC_READ, FILE_SHARE_READ | FILE_SHARE_DELETE, NULL,
+                             OPEN_EXISTING, FILE_ATTRIBUTE_NORMAL, NULL);
+    if (bank->file == INVALID_HANDLE_VALUE) {
+        free(bank);
+        return NULL;
+    }
+    LARGE_INTEGER file_size;
+    if (!GetFileSizeEx(bank->file, &file_size) || file_size.QuadPart == 0) {
+        CloseHandle(bank->file);
+        free(bank);
+        return NULL;
+    }
+    bank->size = (size_t)file_size.QuadPart;
+    bank->mapping = CreateFileMappingA(bank->file, NULL, PAGE_READONLY, 0, 0, NULL);
+    if (!bank->mapping) {
+        CloseHandle(bank->file);
+        free(bank);
+        return NULL;
+    }
+    bank->base = (const unsigned char*)MapViewOfFile(bank->mapping, FILE_MAP_READ, 0, 0, 0);
+    if (!bank->base) {
+        CloseHandle(bank->mapping);
+        CloseHandle(bank->file);
+        free(bank);
+        return NULL;
+    }
+#else
+    int fd = open(path, O_RDONLY);
+    if (fd < 0) {
+        free(bank);
+        return NULL;
+    }
+    struct stat st;
+    if (fstat(fd, &st) != 0 || st.st_size == 0) {
+        close(fd);
+        free(bank);
+        return NULL;
+    }
+    bank->size = (size_t)st.st_size;
+    void* addr = mmap(NULL, bank->size, PROT_READ, MAP_SHARED, fd, 0);
+    close(fd); // 映射建立后即可关闭描述符
+    if (addr == MAP_FAILED) {
+        free(bank);
+        return NULL;
+    }
+    bank->base = (const unsigned char*)addr;
+#endif
+
+    if (!validate(bank)) {
+        LOG_ERROR("Invalid question bank file: %s", path);
+        qbank_close(bank);
+        return NULL;
+    }
+    LOG_INFO("Mapped %u questions (%u categories) from %s",
+             bank->header->question_count, bank->header->category_count, path);
+    return bank;
+}
+
+void qbank_close(QBank* bank) {
+    if (!bank) return;
+#ifdef _WIN32
+    if (bank->base) UnmapViewOfFile(bank->base);
+    if (bank->mapping) CloseHandle(bank->mapping);
+    if (bank->file && bank->file != INVALID_HANDLE_VALUE) CloseHandle(bank->file);
+#else
+    if (bank->base) munmap((void*)bank->base, bank->size);
+#endif
+    free(bank);
+}
+
+uint32_t qbank_count(const QBank* bank) {
+    return bank ? bank->header->question_count : 0;
+}
+
+uint32_t qbank_category_count(const QBank* bank) {
+    return bank ? bank->header->category_count : 0;
+}
+
+const char* qbank_category_name(const QBank* bank, uint32_t index) {
+    if (!bank || index >= bank->header->category_count) return NULL;
+    return bank->strings + bank->categories[index].name_off;
+}
+
+int qbank_get(const QBank* bank, uint32_t index, QBankQuestion* out) {
+    if (!bank || !out || index >= bank->header->question_count) return 0;
+    const QBankRecord* r = &bank->records[index];
+    out->id = r->id;
+    out->score = r->score;
+    out->version = r->version;
+    out->content = bank->strings + r->content_off;
+    out->correct_answer = bank->strings + r->answer_off;
+    out->image = bank->strings + r->image_off;
+    out->category = qbank_category_name(bank, r->category_index);
+    return 1;
+}
+
+int qbank_find_by_id(const QBank* bank, int id, QBankQuestion* out) {
+    if (!bank) return 0;
+    uint32_t mask = bank->header->id_slots - 1;
+    uint32_t slot = id_hash(id) & mask;
+    for (uint32_t probe = 0; probe < bank->header->id_slots; probe++) {
+        uint32_t entry = bank->id_index[slot];
+        if (entry == 0) return 0;
+        if (bank->records[entry - 1].id == id) {
+            return qbank_get(bank, entry - 1, out);
+        }
+        slot = (slot + 1) & mask;
+    }
+    return 0;
+}
+
+const uint32_t* qbank_find_category(const QBank* bank, const char* category, uint32_t* count) {
+    if (count) *count = 0;
+    if (!bank || !category) return NULL;
+    uint32_t mask = bank->header->cat_slots - 1;
+    uint32_t slot = name_hash(category) & mask;
+    for (uint32_t probe = 0; probe < bank->header->cat_slots; probe++) {
+        uint32_t entry = bank->cat_index[slot];
+        if (entry == 0) return NULL;
+        const QBankCategory* c = &bank->categories[entry - 1];
+        if (strcmp(bank->strings + c->name_off, category) == 0) {
+            if (count) *count = c->members_count;
+            return bank->members + c->members_start;
+        }
+        slot = (slot + 1) & mask;
+    }
+    return NULL;
+}
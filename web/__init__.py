@@ -100,6 +100,10 @@ def create_app(config_class=Config):
     from web.uploads_config import init_uploads
     app.dropzone = init_uploads(app)
 
+    # --- 运维命令 (flask CLI) ---
+    from web.commands import init_commands
+    init_commands(app)
+
     # Register Blueprints
     app.register_blueprint(auth_bp)
     app.register_blueprint(main_bp)
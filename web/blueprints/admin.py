@@ -7,9 +7,10 @@ import uuid
 import mimetypes
 from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app
 from flask_login import login_required, current_user
-from web.extensions import db
+from web.extensions import db, cache_redis
 from flask import current_app
 from web.models import User, SystemSetting, UserCategoryStat
+from web.utils.render_utils import render_cached, normalize_mode
 
 admin_bp = Blueprint('admin_bp', __name__)
 
@@ -37,14 +38,10 @@ def validate_and_save_image(file):
     if not is_valid:
         return None, f"不支持的文件格式 '{file.filename}'"
     
-    unique_filename = str(uuid.uuid4()) + ext
-    # 分类存储到 uploads/images
-    base_upload_dir = current_app.config['UPLOAD_FOLDER']
-    save_dir = os.path.join(base_upload_dir, 'images')
-    os.makedirs(save_dir, exist_ok=True)
+    # 按内容哈希存入 uploads/images，缩放 / 转码由后台任务完成
+    from web.services.images import ImageService
     try:
-        file.save(os.path.join(save_dir, unique_filename))
-        return unique_filename, None
+        return ImageService(current_app.config['UPLOAD_FOLDER']).save_upload(file, ext), None
     except Exception as e:
         return None, f"保存文件失败: {str(e)}"
 
@@ -111,13 +108,9 @@ def user_detail(user_id):
 
     user = User.query.get_or_404(user_id)
     data_manager = getattr(current_app, 'data_manager', None)
-    leaderboard = data_manager.get_leaderboard_data() if data_manager else {'global': [], 'categories': {}}
-    rank = '未上榜'
-    for i, user_stat in enumerate(leaderboard['global']):
-        if user_stat['username'] == user.username:
-            rank = i + 1
-            break
-            
+    rank_info = data_manager.get_user_rank(user.id) if data_manager else None
+    rank = rank_info['rank'] if rank_info else '未上榜'
+
     permissions = [p.category for p in user.permissions]
     
     stats_query = UserCategoryStat.query.filter_by(user_id=user.id).all()
@@ -135,9 +128,21 @@ def user_detail(user_id):
     return render_template('admin_user_detail.html', 
                          user=user, 
                          rank=rank, 
+                         rank_info=rank_info,
                          permissions=permissions, 
                          overall_stats=overall_stats)
 
+@admin_bp.route('/admin/analytics')
+@login_required
+def analytics():
+    if not current_user.is_admin:
+        flash('您没有权限访问此页面', 'danger')
+        return redirect(url_for('main.index'))
+    from web.services.rollup import RollupService
+    days = min(max(request.args.get('days', 30, type=int), 1), 365)
+    dashboard = RollupService().get_dashboard(days=days)
+    return render_template('admin_analytics.html', dashboard=dashboard, days=days)
+
 @admin_bp.route('/admin/guide/update', methods=['POST'])
 @login_required
 def update_guide():
@@ -170,6 +175,7 @@ def update_announcement():
         return redirect(url_for('main.index'))
         
     content = request.form.get('content')
+    mode = normalize_mode(request.form.get('mode'))
     try:
         announcement_setting = SystemSetting.query.filter_by(key='announcement').first()
     except:
@@ -177,10 +183,12 @@ def update_announcement():
         announcement_setting = None
 
     if not announcement_setting:
-        announcement_setting = SystemSetting(key='announcement', value=content)
+        announcement_setting = SystemSetting(key='announcement', value=content, mode=mode)
         db.session.add(announcement_setting)
     else:
         announcement_setting.value = content
+        announcement_setting.mode = mode
+    render_cached(announcement_setting, content, mode)
         
     db.session.commit()
     flash('系统公告已更新', 'success')
@@ -195,18 +203,31 @@ def manage():
     data_manager = getattr(current_app, 'data_manager', None)
     from web.models import Question
     # 管理员：所有题目，普通用户：仅个人题目
-    if current_user.is_admin:
-        query = Question.query
-    else:
-        query = Question.query.filter_by(type='personal', owner_id=current_user.id)
+    filters = [] if current_user.is_admin else [Question.type == 'personal', Question.owner_id == current_user.id]
     if category:
-        query = query.filter_by(category=category)
+        filters.append(Question.category == category)
+    query = Question.query.filter(*filters)
+    order = [Question.id.desc()]
     if search:
-        query = query.filter(Question.content.ilike(f'%{search}%'))
-    pagination = query.order_by(Question.id.desc()).paginate(page=page, per_page=10, error_out=False)
+        from web.services.search import SearchService
+        # 过滤条件传入检索子查询，先过滤再截取最相关的结果
+        ranked = SearchService().ranked(SearchService.QUESTION, search, filters)
+        if ranked is None:
+            query = query.filter(db.false())
+        else:
+            query = query.join(ranked, ranked.c.doc_id == Question.id)
+            order.insert(0, ranked.c.score.desc())
+    pagination = query.order_by(*order).paginate(page=page, per_page=10, error_out=False)
     categories = data_manager.get_categories() if data_manager else []
+    from web.models import QuestionStat
+    page_ids = [q.id for q in pagination.items]
+    question_stats = {s.question_id: s for s in QuestionStat.query.filter(QuestionStat.question_id.in_(page_ids)).all()} if page_ids else {}
+    from web.services.regrade import RegradeService
+    regrade_progress = RegradeService(None).get_progress_many(page_ids)
     return render_template('manage.html', 
                          questions=pagination.items, 
+                         question_stats=question_stats,
+                         regrade_progress=regrade_progress,
                          pagination=pagination,
                          search=search,
                          current_category=category,
@@ -251,6 +272,101 @@ def add():
     data_manager = getattr(current_app, 'data_manager', None)
     return render_template('add.html', categories=data_manager.get_categories() if data_manager else [])
 
+@admin_bp.route('/admin/import', methods=['GET', 'POST'])
+@login_required
+def import_questions():
+    # 管理员导入公共题目，普通用户导入个人题目
+    from web.services.question_import import QuestionImportService
+    data_manager = getattr(current_app, 'data_manager', None)
+    categories = data_manager.get_categories() if data_manager else []
+    if request.method == 'POST':
+        file = request.files.get('file')
+        fmt = QuestionImportService.detect_format(file.filename) if file and file.filename else None
+        if not fmt:
+            flash('请上传 .csv、.jsonl 或 questions.txt 格式的题目文件', 'danger')
+            return redirect(url_for('admin_bp.import_questions'))
+        # 临时文件放在上传目录下，web 与 worker 共享该目录
+        work_dir = os.path.join(current_app.config['UPLOAD_FOLDER'], 'imports', uuid.uuid4().hex)
+        os.makedirs(work_dir, exist_ok=True)
+        path = os.path.join(work_dir, 'questions.' + fmt)
+        file.save(path)
+        zip_path = None
+        images = request.files.get('images')
+        if images and images.filename:
+            zip_path = os.path.join(work_dir, 'images.zip')
+            images.save(zip_path)
+        owner_id = None if current_user.is_admin else current_user.id
+        default_category = request.form.get('category', '').strip() or None
+        try:
+            from web.tasks import import_questions_task
+            task = import_questions_task.delay(path, fmt, zip_path, owner_id, default_category)
+            _remember_import_owner(task.id)
+            return redirect(url_for('admin_bp.import_questions', task_id=task.id))
+        except Exception as e:
+            # Celery 不可用时在当前请求内同步导入
+            print(f"[Import] Failed to dispatch import task, importing inline: {e}")
+            import shutil
+            try:
+                report = QuestionImportService(data_manager, current_app.config['UPLOAD_FOLDER']).run(
+                    path, fmt, zip_path=zip_path, owner_id=owner_id, default_category=default_category)
+            finally:
+                shutil.rmtree(work_dir, ignore_errors=True)
+            flash(f"导入完成：新增 {report['imported']} 题，重复 {report['duplicates']} 题，失败 {report['failed']} 行", 'success')
+            return render_template('admin_import.html', categories=categories, report=report, task_id=None)
+    return render_template('admin_import.html', categories=categories, report=None,
+                           task_id=request.args.get('task_id'))
+
+IMPORT_OWNER_PREFIX = 'import_task:'
+IMPORT_OWNER_TTL = 7 * 86400
+
+def _remember_import_owner(task_id):
+    """记录导入任务的发起人（Redis，带过期时间；Redis 不可用时存 SystemSetting），状态接口据此鉴权。"""
+    key = IMPORT_OWNER_PREFIX + task_id
+    if cache_redis:
+        try:
+            cache_redis.setex(key, IMPORT_OWNER_TTL, current_user.id)
+            return
+        except Exception as e:
+            print(f"[Import] Redis unavailable, recording task owner in database: {e}")
+    db.session.merge(SystemSetting(key=key, value=str(current_user.id)))
+    db.session.commit()
+
+def _import_owner(task_id):
+    key = IMPORT_OWNER_PREFIX + task_id
+    if cache_redis:
+        try:
+            owner = cache_redis.get(key)
+            if owner is not None:
+                return int(owner)
+        except Exception as e:
+            print(f"[Import] Redis unavailable: {e}")
+    setting = db.session.get(SystemSetting, key)
+    return int(setting.value) if setting and setting.value else None
+
+@admin_bp.route('/admin/import/status')
+@login_required
+def import_status():
+    from flask import jsonify
+    from celery.result import AsyncResult
+    task_id = request.args.get('task_id')
+    if not task_id:
+        return jsonify({'status': 'error', 'msg': '缺少task_id'}), 400
+    # 导入报告只对发起导入的用户可见
+    if _import_owner(task_id) != current_user.id:
+        return jsonify({'status': 'error', 'msg': '无权查看该任务'}), 403
+    try:
+        result = AsyncResult(task_id, app=current_app.extensions['celery'])
+        state = result.state
+        if state == 'SUCCESS':
+            return jsonify({'status': 'done', 'report': result.result})
+        if state == 'FAILURE':
+            return jsonify({'status': 'error', 'msg': str(result.result)})
+        if state == 'PROGRESS':
+            return jsonify({'status': 'processing', 'report': result.info})
+    except Exception as e:
+        return jsonify({'status': 'error', 'msg': f'无法查询任务状态: {e}'}), 503
+    return jsonify({'status': 'pending'})
+
 @admin_bp.route('/delete/<int:id>', methods=['POST'])
 @login_required
 def delete_question(id):
@@ -274,12 +390,9 @@ def delete_question(id):
     db.session.delete(q)
     db.session.commit()
     if image_filename:
-        image_path = os.path.join(current_app.config['UPLOAD_FOLDER'], 'images', image_filename)
-        if os.path.exists(image_path):
-            try:
-                os.remove(image_path)
-            except:
-                pass
+        # 同内容图片可能被其他题目共用，无引用时才删除
+        from web.services.images import ImageService
+        ImageService(current_app.config['UPLOAD_FOLDER']).release(image_filename)
     return redirect(url_for('admin_bp.manage'))
 
 @admin_bp.route('/edit/<int:id>', methods=['GET', 'POST'])
@@ -308,12 +421,6 @@ def edit_question(id):
         if content and answer and score:
             # 删除图片
             if request.form.get('delete_image') == 'yes' and image_filename:
-                old_image_path = os.path.join(current_app.config['UPLOAD_FOLDER'], 'images', image_filename)
-                if os.path.exists(old_image_path):
-                    try:
-                        os.remove(old_image_path)
-                    except Exception:
-                        pass
                 image_filename = ''
             # 新图片上传
             file = request.files.get('image')
@@ -322,23 +429,42 @@ def edit_question(id):
                 flash(error, 'danger')
                 return redirect(url_for('admin_bp.edit_question', id=id))
             if new_filename:
-                if image_filename:
-                    old_image_path = os.path.join(current_app.config['UPLOAD_FOLDER'], 'images', image_filename)
-                    if os.path.exists(old_image_path):
-                        try:
-                            os.remove(old_image_path)
-                        except:
-                            pass
                 image_filename = new_filename
+            # 标准答案或分值变化时升级题目版本，历史成绩在后台按新版本重新评分
+            key_changed = q.answer != answer or q.score != int(score)
+            if key_changed:
+                from web.models import QuestionVersion
+                old_version = q.version or 1
+                if not QuestionVersion.query.filter_by(question_id=q.id, version=old_version).first():
+                    db.session.add(QuestionVersion(question_id=q.id, version=old_version, answer=q.answer, score=q.score))
+                q.version = old_version + 1
+                db.session.add(QuestionVersion(question_id=q.id, version=q.version, answer=answer,
+                                               score=int(score), created_by=current_user.id))
             q.content = content
             q.answer = answer
             q.score = int(score)
+            old_image = q.image
             q.image = image_filename
             q.category = request.form.get('category', '默认题集')
+            render_cached(q, q.content, q.mode)
             db.session.commit()
+            if old_image and old_image != image_filename:
+                # 旧图片在提交后释放（同内容图片可能被其他题目共用）
+                from web.services.images import ImageService
+                ImageService(current_app.config['UPLOAD_FOLDER']).release(old_image)
+            if key_changed:
+                try:
+                    from web.tasks import regrade_question_task
+                    regrade_question_task.delay(q.id, q.version)
+                    flash('标准答案已更新，历史成绩将在后台重新评分', 'info')
+                except Exception as e:
+                    print(f"[Regrade] Failed to dispatch regrade task for question {q.id}: {e}")
+                    flash(f'标准答案已更新，但重新评分任务提交失败，请执行 flask regrade-question {q.id}', 'warning')
             return redirect(url_for('admin_bp.manage'))
     # GET 或未通过校验时渲染页面
-    question_html = render_content(q.content, getattr(q, 'mode', 'html')) if q else ''
+    question_html = render_cached(q, q.content, q.mode) if q else ''
+    if db.session.dirty:
+        db.session.commit()
     return render_template('edit.html', question=q, question_html=question_html, id=id, categories=[]) # categories 可补全
 
 @admin_bp.route('/admin/queue')
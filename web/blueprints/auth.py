@@ -18,9 +18,13 @@ def delete_account():
         flash('用户不存在', 'danger')
         return redirect(url_for('main.index'))
     # 可扩展：删除用户相关的其他数据（如帖子、评论、成绩等）
+    user_id = user.id
     logout_user()
     db.session.delete(user)
     db.session.commit()
+    data_manager = getattr(current_app, 'data_manager', None)
+    if data_manager:
+        data_manager.leaderboard.remove_user(user_id)
     flash('您的账户已被永久删除', 'info')
     return redirect(url_for('auth.register'))
 
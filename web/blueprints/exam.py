@@ -1,4 +1,4 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session, current_app, Response
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, current_app, Response, stream_with_context
 from flask_login import login_required, current_user
 from web.extensions import db
 from web.models import User
@@ -24,11 +24,8 @@ def batch_delete_history():
     if not ids:
         flash('未选择任何记录', 'warning')
         return redirect(url_for('exam.history'))
-    deleted = 0
     data_manager = getattr(current_app, 'data_manager', None)
-    for rid in ids:
-        if data_manager and data_manager.delete_result(rid):
-            deleted += 1
+    deleted = data_manager.delete_results(ids) if data_manager else 0
     flash(f'已批量删除 {deleted} 条记录', 'success')
     return redirect(url_for('exam.history'))
 
@@ -130,10 +127,12 @@ def exam():
         for i, q_id in enumerate(ids):
              user_answers[str(i)] = request.form.get(f'q_{i}', '')
         
+        # 只随消息发送本场考试的题目，其余由 worker 端题库缓存兜底
+        id_set = set(ids)
         exam_data = {
             'ids': ids,
             'user_answers': user_answers,
-            'all_questions': all_questions,
+            'all_questions': [q for q in all_questions if q['id'] in id_set],
             'category': current_category
         }
         
@@ -166,23 +165,18 @@ def queue_status(task_id):
 @login_required
 def history():
     user_id = None if current_user.is_admin else current_user.id
-    data_manager = getattr(current_app, 'data_manager', None)
-    results = data_manager.load_results(user_id=user_id) if data_manager else []
-    results.sort(key=lambda x: x['timestamp'], reverse=True)
-    
     q = request.args.get('q', '').strip()
-    if q:
-        q_lower = q.lower()
-        results = [r for r in results if q_lower in str(r.get('username', '')).lower() or q_lower in str(r.get('timestamp', '')).lower()]
-        start_time = request.args.get('start_time', '').strip()
-        end_time = request.args.get('end_time', '').strip()
-        if start_time:
-            results = [r for r in results if r.get('timestamp', '') >= start_time]
-        if end_time:
-            results = [r for r in results if r.get('timestamp', '') <= end_time]
-        return render_template('history.html', results=results, search_query=q, start_time=start_time, end_time=end_time)
-        
-    return render_template('history.html', results=results, search_query=q)
+    start_time = request.args.get('start_time', '').strip()
+    end_time = request.args.get('end_time', '').strip()
+    cursor = request.args.get('cursor', '').strip() or None
+    data_manager = getattr(current_app, 'data_manager', None)
+    page = data_manager.query_results(
+        user_id=user_id, q=q or None, start_time=start_time or None,
+        end_time=end_time or None, cursor=cursor
+    ) if data_manager else {'items': [], 'next_cursor': None}
+    return render_template('history.html', results=page['items'], next_cursor=page['next_cursor'],
+                           is_first_page=cursor is None, search_query=q,
+                           start_time=start_time, end_time=end_time)
 
 @exam_bp.route('/history/view/<result_id>')
 @login_required
@@ -203,41 +197,48 @@ def view_history(result_id):
 @login_required
 def export_history():
     user_id = None if current_user.is_admin else current_user.id
-    results = data_manager.load_results(user_id=user_id)
-    results.sort(key=lambda x: x['timestamp'], reverse=True)
-    
-    output = io.StringIO()
-    writer = csv.writer(output)
-    
-    writer.writerow(['用户', '时间', '得分', '满分', '得分率'])
-    
-    for r in results:
-        score = r.get('total_score', 0)
-        max_s = r.get('max_score', 0)
-        percentage = f"{(score / max_s * 100):.1f}%" if max_s > 0 else "0.0%"
-        username = r.get('username', 'Unknown')
-        writer.writerow([username, r['timestamp'], score, max_s, percentage])
-        
-    output.seek(0)
-    
+    data_manager = getattr(current_app, 'data_manager', None)
+    if not data_manager:
+        flash('数据服务不可用', 'danger')
+        return redirect(url_for('exam.history'))
+    rows = data_manager.iter_export_rows(
+        user_id=user_id,
+        q=request.args.get('q', '').strip() or None,
+        start_time=request.args.get('start_time', '').strip() or None,
+        end_time=request.args.get('end_time', '').strip() or None,
+        per_question=request.args.get('questions') == '1'
+    )
+
+    def generate():
+        # 逐批写出，不在内存中拼接整个文件；BOM 便于 Excel 识别 UTF-8
+        output = io.StringIO()
+        writer = csv.writer(output)
+        yield '\ufeff'.encode('utf-8')
+        for i, row in enumerate(rows, 1):
+            writer.writerow(row)
+            if i % 500 == 0:
+                yield output.getvalue().encode('utf-8')
+                output.seek(0)
+                output.truncate(0)
+        yield output.getvalue().encode('utf-8')
+
+    filename = f"exam_history_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
     return Response(
-        output.getvalue().encode('utf-8-sig'),
+        stream_with_context(generate()),
         mimetype="text/csv",
-        headers={"Content-Disposition": "attachment;filename=exam_history.csv"}
+        headers={"Content-Disposition": f"attachment;filename={filename}"}
     )
 
 @exam_bp.route('/history/delete/<result_id>', methods=['POST'])
 @login_required
 def delete_history(result_id):
-    record = data_manager.get_result(result_id)
-    if not record:
-        flash('记录未找到', 'error')
-        return redirect(url_for('exam.history'))
-        
     if not current_user.is_admin:
         flash('只有管理员可以删除记录', 'danger')
         return redirect(url_for('exam.history'))
 
-    data_manager.delete_result(result_id)
+    data_manager = getattr(current_app, 'data_manager', None)
+    if not data_manager or not data_manager.delete_result(result_id):
+        flash('记录未找到', 'error')
+        return redirect(url_for('exam.history'))
     flash('记录已删除', 'success')
     return redirect(url_for('exam.history'))
@@ -1,65 +1,34 @@
-import os
-import uuid
 import mimetypes
 import json
 from datetime import datetime
 from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app, abort
 from flask_login import login_required, current_user
 from werkzeug.utils import secure_filename
-from web.extensions import db
-from web.models import Board, Topic, Post, TopicLike, PostLike, TopicView, SystemSetting
+from web.extensions import db, cache_redis
+from web.models import Board, Topic, Post, TopicLike, SystemSetting
+from web.services.hotness import HotnessService
+from web.services.thread import ThreadService
+from web.services.views import ViewCounterService
+from web.services.topic_list import TopicListService
+from web.services.reactions import ForumActionService
+from web.services.inbox import InboxService
+from web.services.search import SearchService
+from web.services.images import ImageService
+from web.utils.render_utils import render_cached, normalize_mode
 from config import Config
-import math
 from sqlalchemy import func
+from sqlalchemy.orm import joinedload
+from sqlalchemy.orm.attributes import flag_modified
 
 forum_bp = Blueprint('forum', __name__, url_prefix='/forum')
 
-# --- Hotness Algorithm ---
-def get_hotness_weights():
-    setting = SystemSetting.query.get('forum_hotness_weights')
-    if setting and setting.value:
-        return json.loads(setting.value)
-    return {'w1': 0.2, 'w2': 1.2, 'w3': 1.5, 'g': 1.5}
-
-def calculate_topic_hotness(topic, weights=None):
-    if not weights:
-        weights = get_hotness_weights()
-    
-    # 浏览数 + 1 (防止 log(0))
-    views = topic.views or 0
-    view_score = math.log10(views + 1) * weights['w1']
-    
-    # 点赞数
-    likes = TopicLike.query.filter_by(topic_id=topic.id).count()
-    like_score = likes * weights['w2']
-    
-    # 评论数 (Post count - 1 to exclude original post? Or just count posts)
-    # Assuming 'posts' relationship includes all replies. Usually topic has many posts.
-    comment_count = Post.query.filter_by(topic_id=topic.id).count()
-    comment_score = comment_count * weights['w3']
-    
-    # 时间差 (Hours)
-    now = datetime.utcnow()
-    diff = (now - topic.created_at).total_seconds() / 3600
-    time_factor = (diff + 2) ** weights['g'] # +2 to avoid near-zero division and stabilize new posts
-    
-    score = (view_score + like_score + comment_score) / time_factor
-    return score
-
 @forum_bp.route('/admin/update_hotness', methods=['POST'])
 @login_required
 def update_hotness_manually():
     if not current_user.is_admin:
         return {'status': 'error', 'message': 'Permission denied'}, 403
-        
-    topics = Topic.query.all()
-    weights = get_hotness_weights()
-    data_manager = getattr(current_app, 'data_manager', None)
-    count = 0
-    for t in topics:
-        t.hotness = calculate_topic_hotness(t, weights)
-        count += 1
-    db.session.commit()
+
+    count = HotnessService().refresh(force=True)
     return {'status': 'success', 'message': f'Updated {count} topics'}
 
 @forum_bp.route('/admin/config/hotness', methods=['POST'])
@@ -77,13 +46,15 @@ def update_hotness_config():
         
         weights = {'w1': w1, 'w2': w2, 'w3': w3, 'g': g}
         
-        setting = SystemSetting.query.get('forum_hotness_weights')
+        setting = SystemSetting.query.get(HotnessService.WEIGHTS_KEY)
         if not setting:
-            setting = SystemSetting(key='forum_hotness_weights')
+            setting = SystemSetting(key=HotnessService.WEIGHTS_KEY)
             db.session.add(setting)
         
         setting.value = json.dumps(weights)
         db.session.commit()
+        # 权重变化后全部主题都需重算
+        HotnessService().refresh(force=True)
         flash('热度算法参数已更新', 'success')
     except ValueError:
         flash('参数格式错误', 'danger')
@@ -93,14 +64,10 @@ def update_hotness_config():
 # --- API Routes ---
 @forum_bp.route('/api/latest')
 def latest_topics():
-    page = request.args.get('page', 1, type=int)
-    per_page = 10
-    pagination = Topic.query.filter_by(is_deleted=False)\
-        .order_by(Topic.created_at.desc())\
-        .paginate(page=page, per_page=per_page, error_out=False)
+    topics, next_cursor = TopicListService().latest_page(after=request.args.get('cursor'))
     
     topics_data = []
-    for t in pagination.items:
+    for t in topics:
         topics_data.append({
             'id': t.id,
             'title': t.title,
@@ -108,21 +75,21 @@ def latest_topics():
             'author': t.user.username if t.user else 'Unknown',
             'created_at': t.created_at.strftime('%Y-%m-%d %H:%M'),
             'views': t.views,
-            'replies': len(t.posts) - 1 if t.posts else 0, # Rough count
-            # 'replies': Post.query.filter_by(topic_id=t.id).count() - 1 # More accurate but slower
+            'replies': t.reply_count or 0,
         })
         
     return {
         'topics': topics_data,
-        'has_next': pagination.has_next,
-        'next_page': pagination.next_num
+        'has_next': next_cursor is not None,
+        'next_cursor': next_cursor
     }
 
 @forum_bp.route('/api/popular')
 def popular_topics():
-    # Should probably ensure scores are fresh-ish here or rely on periodic
-    # Simple strategy: Just query sorted by hotness
-    topics = Topic.query.filter_by(is_deleted=False)\
+    # 热度由事件即时更新 + beat 周期刷新；beat 未运行时在此兜底刷新
+    HotnessService().refresh_if_stale()
+    topics = Topic.query.options(joinedload(Topic.user), joinedload(Topic.board))\
+        .filter_by(is_deleted=False)\
         .order_by(Topic.hotness.desc())\
         .limit(10).all()
         
@@ -158,13 +125,8 @@ def validate_and_save_forum_image(file):
     if not is_valid:
         return None, f"不支持的文件类型"
         
-    unique_filename = str(uuid.uuid4()) + ext
-    # 分类存储到 uploads/images
-    images_dir = os.path.join(current_app.static_folder, 'uploads', 'images')
-    os.makedirs(images_dir, exist_ok=True)
-    path = os.path.join(images_dir, unique_filename)
-    file.save(path)
-    return unique_filename, None
+    # 按内容哈希存入 uploads/images，缩放 / 转码由后台任务完成
+    return ImageService(current_app.config['UPLOAD_FOLDER']).save_upload(file, ext), None
 
 # --- Context Processor ---
 @forum_bp.context_processor
@@ -235,22 +197,28 @@ def index():
     boards = Board.query.order_by(Board.order).all()
     q = request.args.get('q', '').strip()
     if q:
-        # Global search for topics
-        topics = Topic.query.filter(Topic.title.ilike(f'%{q}%'), Topic.is_deleted == False)\
-            .order_by(Topic.updated_at.desc()).all()
-        return render_template('forum/index.html', boards=boards, search_results=topics, search_query=q)
+        # 全文检索标题与正文，按相关度排序分页
+        page = request.args.get('page', 1, type=int)
+        ranked = SearchService().ranked(SearchService.TOPIC, q)
+        query = Topic.query.options(joinedload(Topic.user), joinedload(Topic.board)).filter(Topic.is_deleted == False)
+        if ranked is None:
+            query = query.filter(db.false()).order_by(Topic.id.desc())
+        else:
+            query = query.join(ranked, ranked.c.doc_id == Topic.id).order_by(ranked.c.score.desc(), Topic.id.desc())
+        pagination = query.paginate(page=page, per_page=20, error_out=False)
+        return render_template('forum/index.html', boards=boards, search_results=pagination.items,
+                               search_pagination=pagination, search_query=q,
+                               topic_counts=TopicListService.board_topic_counts())
     
-    return render_template('forum/index.html', boards=boards)
+    return render_template('forum/index.html', boards=boards, topic_counts=TopicListService.board_topic_counts())
 
 @forum_bp.route('/board/<int:board_id>')
 @login_required
 def view_board(board_id):
     board = Board.query.get_or_404(board_id)
-    page = request.args.get('page', 1, type=int)
-    topics = Topic.query.filter_by(board_id=board_id, is_deleted=False)\
-        .order_by(Topic.is_pinned.desc(), Topic.updated_at.desc())\
-        .paginate(page=page, per_page=20)
-    return render_template('forum/board.html', board=board, topics=topics)
+    listing = TopicListService().board_page(board_id, after=request.args.get('after'),
+                                            before=request.args.get('before'))
+    return render_template('forum/board.html', board=board, listing=listing)
 
 @forum_bp.route('/board/<int:board_id>/new', methods=['GET', 'POST'])
 @login_required
@@ -276,8 +244,10 @@ def new_topic(board_id):
             user_id=current_user.id,
             title=title,
             content=content,
-            images=image_filenames
+            images=image_filenames,
+            mode=normalize_mode(request.form.get('mode'))
         )
+        render_cached(topic, topic.content, topic.mode)
         db.session.add(topic)
         db.session.commit()
         flash('发布成功', 'success')
@@ -292,32 +262,20 @@ def view_topic(topic_id):
     if topic.is_deleted:
         abort(404)
         
-    # Unique view counting
-    if current_user.is_authenticated:
-        viewed = TopicView.query.filter_by(user_id=current_user.id, topic_id=topic.id).first()
-        if not viewed:
-            new_view = TopicView(user_id=current_user.id, topic_id=topic.id)
-            db.session.add(new_view)
-            topic.views += 1
-            db.session.commit()
+    # 浏览记录先写入 Redis，由 flush_views_task 批量落库
+    ViewCounterService(cache_redis).record(current_user.id, topic.id)
     
-    posts = Post.query.filter_by(topic_id=topic.id).order_by(Post.created_at).all()
-    user_liked = False
-    liked_posts = set()
-    if current_user.is_authenticated:
-        user_liked = TopicLike.query.filter_by(user_id=current_user.id, topic_id=topic.id).first() is not None
-        # Get liked posts
-        if posts:
-            user_post_likes = PostLike.query.filter(
-                PostLike.user_id == current_user.id,
-                PostLike.post_id.in_([p.id for p in posts])
-            ).all()
-            liked_posts = {pl.post_id for pl in user_post_likes}
-        
-    from web.utils.render_utils import render_content
-    topic_html = render_content(topic.content, getattr(topic, 'mode', 'html'))
-    posts_html = [render_content(p.content, getattr(p, 'mode', 'html')) for p in posts]
-    return render_template('forum/topic.html', topic=topic, topic_html=topic_html, posts=posts, posts_html=posts_html, user_liked=user_liked, liked_posts=liked_posts)
+    user_liked = TopicLike.query.filter_by(user_id=current_user.id, topic_id=topic.id).first() is not None
+    thread = ThreadService().page(topic.id, user_id=current_user.id,
+                                  after=request.args.get('after'), before=request.args.get('before'),
+                                  post_id=request.args.get('post', type=int))
+    # 读取写入时缓存的 HTML；渲染器升级或旧数据缺缓存时才重新渲染并写回
+    topic_html = render_cached(topic, topic.content, topic.mode)
+    if db.session.dirty:
+        if topic in db.session.dirty:
+            flag_modified(topic, 'updated_at')  # 回写渲染缓存不算主题活动，避免 onupdate 改写 updated_at
+        db.session.commit()
+    return render_template('forum/topic.html', topic=topic, topic_html=topic_html, thread=thread, user_liked=user_liked)
 
 @forum_bp.route('/topic/<int:topic_id>/reply', methods=['POST'])
 @login_required
@@ -339,7 +297,9 @@ def reply_topic(topic_id):
     # Optional Validation logic for parent_id existence could go here
 
     if content:
-        post = Post(topic_id=topic_id, user_id=current_user.id, content=content)
+        post = Post(topic_id=topic_id, user_id=current_user.id, content=content,
+                    mode=normalize_mode(request.form.get('mode')))
+        render_cached(post, post.content, post.mode)
         if parent_id:
             try:
                 post.parent_id = int(parent_id)
@@ -347,32 +307,98 @@ def reply_topic(topic_id):
             
         db.session.add(post)
         topic.updated_at = datetime.utcnow() # Bump topic
+        db.session.flush()
+        HotnessService().bump(topic.id)
         db.session.commit()
+        InboxService(cache_redis).dispatch(post.id, topic.reply_count or 0)
         flash('回复成功', 'success')
+        return redirect(url_for('forum.view_topic', topic_id=topic.id, post=post.id) + f'#post-{post.id}')
         
     return redirect(url_for('forum.view_topic', topic_id=topic.id))
 
+@forum_bp.route('/inbox')
+@login_required
+def inbox():
+    inbox_service = InboxService(cache_redis)
+    notifications, next_cursor = inbox_service.page(current_user.id, before=request.args.get('before'))
+    unread_ids = [n.id for n in notifications if not n.is_read]
+    # 渲染使用已加载的 is_read（本次仍高亮未读），随后把本页标记为已读
+    html = render_template('forum/inbox.html', notifications=notifications, next_cursor=next_cursor)
+    inbox_service.mark_read(current_user.id, unread_ids)
+    return html
+
+@forum_bp.route('/inbox/read', methods=['POST'])
+@login_required
+def inbox_read_all():
+    InboxService(cache_redis).mark_read(current_user.id)
+    flash('已全部标记为已读', 'info')
+    return redirect(request.referrer or url_for('forum.inbox'))
+
+def _desired_state():
+    """读取请求中的目标状态 liked=1/0，缺省为切换。"""
+    data = request.get_json(silent=True) or request.form
+    value = data.get('liked')
+    if value is None or value == '':
+        return None
+    return str(value).lower() in ('1', 'true', 'on', 'yes')
+
+def _broadcast(topic_id, payload):
+    """向正在浏览该主题的客户端推送计数变化，失败不影响请求。"""
+    try:
+        from web.extensions import socketio
+        socketio.emit('topic_update', dict(payload, topic_id=topic_id), room=f'topic_{topic_id}')
+    except Exception as e:
+        print(f"[Forum] Broadcast failed: {e}")
+
+def _live_topic_id(topic_id):
+    row = db.session.query(Topic.id).filter(Topic.id == topic_id, Topic.is_deleted == False).first()
+    if row is None:
+        abort(404)
+    return row.id
+
+@forum_bp.route('/api/topic/<int:topic_id>/like', methods=['POST'])
+@login_required
+def api_like_topic(topic_id):
+    result = ForumActionService().like_topic(current_user.id, _live_topic_id(topic_id), _desired_state())
+    _broadcast(topic_id, {'type': 'topic_like', 'count': result['count']})
+    return {'status': 'success', **result}
+
+@forum_bp.route('/api/post/<int:post_id>/like', methods=['POST'])
+@login_required
+def api_like_post(post_id):
+    row = db.session.query(Post.id, Post.topic_id).filter(Post.id == post_id).first()
+    if row is None:
+        abort(404)
+    result = ForumActionService().like_post(current_user.id, row.id, _desired_state())
+    _broadcast(row.topic_id, {'type': 'post_like', 'post_id': row.id, 'count': result['count']})
+    return {'status': 'success', **result}
+
+@forum_bp.route('/api/topic/<int:topic_id>/<any(pin, lock):action>', methods=['POST'])
+@login_required
+def api_topic_flag(topic_id, action):
+    if not current_user.is_admin:
+        return {'status': 'error', 'message': 'Permission denied'}, 403
+    flag = 'is_pinned' if action == 'pin' else 'is_locked'
+    value = ForumActionService().toggle_flag(_live_topic_id(topic_id), flag)
+    _broadcast(topic_id, {'type': action, 'value': value})
+    return {'status': 'success', action: value}
+
 @forum_bp.route('/topic/<int:topic_id>/action', methods=['POST'])
 @login_required
 def topic_action(topic_id):
+    """无 JS 时的表单回退，点赞 / 置顶 / 锁定与 JSON 接口共用 ForumActionService。"""
     topic = Topic.query.get_or_404(topic_id)
     action = request.form.get('action')
     
     if action == 'like':
-        existing = TopicLike.query.filter_by(user_id=current_user.id, topic_id=topic.id).first()
-        if existing:
-            db.session.delete(existing)
-        else:
-            like = TopicLike(user_id=current_user.id, topic_id=topic.id)
-            db.session.add(like)
-        db.session.commit()
+        ForumActionService().like_topic(current_user.id, topic.id)
     
     if action in ['pin', 'lock', 'delete'] and current_user.is_admin:
         if action == 'pin':
-            topic.is_pinned = not topic.is_pinned
+            ForumActionService().toggle_flag(topic.id, 'is_pinned')
             flash('置顶状态已更新', 'info')
         elif action == 'lock':
-            topic.is_locked = not topic.is_locked
+            ForumActionService().toggle_flag(topic.id, 'is_locked')
             flash('锁定状态已更新', 'info')
         elif action == 'delete':
             topic.is_deleted = True
@@ -380,7 +406,6 @@ def topic_action(topic_id):
             flash('主题已删除', 'success')
             return redirect(url_for('forum.view_board', board_id=topic.board_id))
             
-    db.session.commit()
     return redirect(url_for('forum.view_topic', topic_id=topic.id))
 
 @forum_bp.route('/post/<int:post_id>/action', methods=['POST'])
@@ -390,15 +415,9 @@ def post_action(post_id):
     action = request.form.get('action')
     
     if action == 'like':
-        existing = PostLike.query.filter_by(user_id=current_user.id, post_id=post.id).first()
-        if existing:
-            db.session.delete(existing)
-        else:
-            like = PostLike(user_id=current_user.id, post_id=post.id)
-            db.session.add(like)
-        db.session.commit()
+        ForumActionService().like_post(current_user.id, post.id)
         
-    return redirect(url_for('forum.view_topic', topic_id=post.topic_id) + f'#post-{post.id}')
+    return redirect(url_for('forum.view_topic', topic_id=post.topic_id, post=post.id) + f'#post-{post.id}')
 
 @forum_bp.route('/topic/<int:topic_id>/edit', methods=['GET', 'POST'])
 @login_required
@@ -415,6 +434,8 @@ def edit_topic(topic_id):
     if request.method == 'POST':
         topic.title = request.form.get('title')
         topic.content = request.form.get('content')
+        topic.mode = normalize_mode(request.form.get('mode'), topic.mode or 'html')
+        render_cached(topic, topic.content, topic.mode)
         
         images = request.files.getlist('images')
         current_imgs = topic.images
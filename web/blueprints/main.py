@@ -1,35 +1,56 @@
-import json
 from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app, send_from_directory, jsonify
 from flask_login import login_required, current_user
 from web.extensions import db, cache_redis
-from web.models import User, SystemSetting, UserCategoryStat, Topic, Post, TopicView
+from web.models import User, SystemSetting, UserCategoryStat, Topic, Post
+from web.utils.render_utils import render_cached
+from sqlalchemy.orm import joinedload
 import datetime
+import os
 
 main_bp = Blueprint('main', __name__)
 
-@main_bp.route('/')
-def index():
-    # Use Redis Cache for System Stats (High traffic optimization)
-    stats = None
-    if cache_redis:
+@main_bp.app_context_processor
+def inject_inbox_unread():
+    """导航栏未读回复数；以函数注入，只有模板实际调用时才读取（Redis 缓存命中时不查库）。"""
+    def inbox_unread():
+        if not current_user.is_authenticated:
+            return 0
+        from web.services.inbox import InboxService
         try:
-            cached_stats = cache_redis.get('system_stats')
-            if cached_stats:
-                stats = json.loads(cached_stats)
+            return InboxService(cache_redis).unread_count(current_user.id)
         except Exception as e:
-            print(f"Redis cache read error: {e}")
-    
+            print(f"[Inbox] Failed to load unread count: {e}")
+            return 0
+    return {'inbox_unread': inbox_unread}
 
-    if stats is None:
-        data_manager = getattr(current_app, 'data_manager', None)
-        if data_manager:
-            stats = data_manager.get_system_stats()
-            if cache_redis:
-                try:
-                    # Cache for 60 seconds
-                    cache_redis.setex('system_stats', 60, json.dumps(stats))
-                except Exception as e:
-                    print(f"Redis cache set error: {e}")
+def _upload_image_url(path):
+    """uploads/images 下文件的地址：位于静态目录内时走 /static（由 nginx 直接提供），否则走 uploaded_file。"""
+    images_dir = os.path.join(current_app.config['UPLOAD_FOLDER'], 'images')
+    static_folder = os.path.abspath(current_app.static_folder)
+    if os.path.abspath(images_dir).startswith(static_folder + os.sep):
+        relative = os.path.relpath(os.path.join(images_dir, path), static_folder).replace(os.sep, '/')
+        return url_for('static', filename=relative)
+    return url_for('main.uploaded_file', filename=path)
+
+@main_bp.app_template_global()
+def image_set(filename):
+    """模板用的图片地址集合 {'src', 'srcset', 'thumb', 'original', 'width', 'height'}，见 ImageService.image_set。"""
+    from web.services.images import ImageService
+    return ImageService(current_app.config['UPLOAD_FOLDER']).image_set(filename, _upload_image_url)
+
+@main_bp.route('/uploads/<path:filename>')
+def uploaded_file(filename):
+    """上传图片（uploads/images）；文件名按内容哈希生成，不会被覆盖，允许长期缓存。"""
+    images_dir = os.path.join(current_app.config['UPLOAD_FOLDER'], 'images')
+    return send_from_directory(images_dir, filename, max_age=31536000)
+
+@main_bp.route('/')
+def index():
+    # System stats come from running counters (O(1)), no cache needed
+    stats = None
+    data_manager = getattr(current_app, 'data_manager', None)
+    if data_manager:
+        stats = data_manager.get_system_stats()
 
     user_charts = None
     user_stats = None
@@ -37,22 +58,8 @@ def index():
         data_manager = getattr(current_app, 'data_manager', None)
         if data_manager:
             user_charts = data_manager.get_user_dashboard_stats(current_user.id)
-        
-        # Calculate Personal Stats for the cards
-        ug_stats_query = UserCategoryStat.query.filter_by(user_id=current_user.id).all()
-        ug_total_exams = sum(s.total_attempts for s in ug_stats_query)
-        ug_total_score = sum(s.total_score for s in ug_stats_query)
-        ug_total_max = sum(s.total_max_score for s in ug_stats_query)
-        
-        # Calculate accuracy
-        ug_accuracy = 0
-        if ug_total_max > 0:
-            ug_accuracy = round((ug_total_score / ug_total_max) * 100, 1)
-        
-        user_stats = {
-            'total_exams': ug_total_exams,
-            'avg_accuracy': ug_accuracy
-        }
+            # Personal stats for the cards come from the same pre-aggregated row
+            user_stats = user_charts['summary']
     
     # Get user guide and announcement
     try:
@@ -60,14 +67,23 @@ def index():
         user_guide = guide_setting.value if guide_setting else None
         
         announcement_setting = SystemSetting.query.filter_by(key='announcement').first()
-        announcement = announcement_setting.value if announcement_setting else None
+        announcement = None
+        announcement_raw = announcement_setting.value if announcement_setting else None
+        announcement_mode = (announcement_setting.mode or 'html') if announcement_setting else 'html'
+        if announcement_raw:
+            announcement = render_cached(announcement_setting, announcement_raw, announcement_mode)
+            if db.session.dirty:
+                db.session.commit()
     except:
+        db.session.rollback()
         user_guide = None
-        announcement = None
+        announcement = announcement_raw = None
+        announcement_mode = 'html'
         
     return render_template('index.html', stats=stats, user_charts=user_charts, 
                          user_stats=user_stats, 
-                         user_guide=user_guide, announcement=announcement)
+                         user_guide=user_guide, announcement=announcement,
+                         announcement_raw=announcement_raw, announcement_mode=announcement_mode)
 
 @main_bp.route('/profile', methods=['GET', 'POST'])
 @login_required
@@ -129,12 +145,9 @@ def profile():
 
     # GET request - Display Profile
     data_manager = getattr(current_app, 'data_manager', None)
-    leaderboard = data_manager.get_leaderboard_data() if data_manager else {'global': [], 'categories': {}}
-    rank = '未上榜'
-    for i, user_stat in enumerate(leaderboard['global']):
-        if user_stat['username'] == current_user.username:
-            rank = i + 1
-            break
+    rank_info = data_manager.get_user_rank(current_user.id) if data_manager else None
+    rank = rank_info['rank'] if rank_info else '未上榜'
+    category_ranks = data_manager.get_user_category_ranks(current_user.id) if data_manager else {}
     permissions = [p.category for p in current_user.permissions]
     stats_query = UserCategoryStat.query.filter_by(user_id=current_user.id).all()
     total_exams = sum(s.total_attempts for s in stats_query)
@@ -145,23 +158,25 @@ def profile():
         'total_exams': total_exams,
         'avg_accuracy': avg_accuracy
     }
-    my_topics = Topic.query.filter_by(user_id=current_user.id, is_deleted=False).order_by(Topic.created_at.desc()).limit(50).all()
-    my_posts = Post.query.filter_by(user_id=current_user.id).order_by(Post.created_at.desc()).limit(50).all()
-    replies_received = Post.query.join(Topic).filter(
-        Topic.user_id == current_user.id,
-        Post.user_id != current_user.id
-    ).order_by(Post.created_at.desc()).limit(20).all()
-    browsing_history = TopicView.query.join(Topic, TopicView.topic_id == Topic.id)\
-        .filter(TopicView.user_id == current_user.id)\
-        .order_by(TopicView.created_at.desc())\
-        .limit(50).all()
+    # 均为按 (user_id, created_at) / (user_id, id) 索引的单次查询，关联对象一并联表加载
+    my_topics = Topic.query.options(joinedload(Topic.board))\
+        .filter_by(user_id=current_user.id, is_deleted=False).order_by(Topic.created_at.desc()).limit(50).all()
+    my_posts = Post.query.options(joinedload(Post.topic))\
+        .filter_by(user_id=current_user.id).order_by(Post.created_at.desc()).limit(50).all()
+    from web.services.inbox import InboxService
+    replies_received, replies_more = InboxService(cache_redis).page(current_user.id)
+    from web.services.views import ViewCounterService
+    browsing_history = ViewCounterService(cache_redis).history(current_user.id)
     return render_template('profile.html', 
                          rank=rank, 
+                         rank_info=rank_info,
+                         category_ranks=category_ranks,
                          permissions=permissions, 
                          overall_stats=overall_stats,
                          my_topics=my_topics,
                          my_posts=my_posts,
                          replies_received=replies_received,
+                         replies_more=replies_more,
                          browsing_history=browsing_history)
 
 @main_bp.route('/user/<int:user_id>')
@@ -169,13 +184,10 @@ def profile():
 def user_profile(user_id):
     user = User.query.get_or_404(user_id)
     data_manager = getattr(current_app, 'data_manager', None)
+    rank_info = None
     if data_manager:
-        leaderboard = data_manager.get_leaderboard_data()
-        rank = '未上榜'
-        for i, user_stat in enumerate(leaderboard['global']):
-            if user_stat['username'] == user.username:
-                rank = i + 1
-                break
+        rank_info = data_manager.get_user_rank(user.id)
+        rank = rank_info['rank'] if rank_info else '未上榜'
         stats_query = UserCategoryStat.query.filter_by(user_id=user.id).all()
         total_exams = sum(s.total_attempts for s in stats_query)
         total_score = sum(s.total_score for s in stats_query)
@@ -189,7 +201,7 @@ def user_profile(user_id):
         rank = 'N/A'
         stats = {'total_exams': 0, 'avg_accuracy': 0}
     topics = Topic.query.filter_by(user_id=user.id, is_deleted=False).order_by(Topic.created_at.desc()).limit(20).all()
-    return render_template('user_profile.html', user=user, rank=rank, stats=stats, topics=topics)
+    return render_template('user_profile.html', user=user, rank=rank, rank_info=rank_info, stats=stats, topics=topics)
 
 @main_bp.route('/leaderboard')
 def leaderboard():
@@ -0,0 +1,142 @@
+import click
+
+
+def init_commands(app):
+    # 运维命令，使用方式：flask --app web.app <command>
+
+    @app.cli.command('upgrade-data')
+    def upgrade_data():
+        """执行尚未完成的一次性数据回填（升级部署后运行一次，进程启动时不再自动执行）。"""
+        try:
+            applied = app.data_manager.upgrade_data()
+        except Exception as e:
+            raise click.ClickException(f'数据回填失败：{e}')
+        click.echo(f"已执行 {len(applied)} 项数据回填：{', '.join(applied)}" if applied else '没有待执行的数据回填。')
+
+    @app.cli.command('rebuild-leaderboard')
+    def rebuild_leaderboard():
+        """从 UserCategoryStat 全量重建 Redis 排行榜（冷启动 / Redis 数据丢失后使用）。"""
+        data_manager = app.data_manager
+        if not data_manager.leaderboard.redis:
+            click.echo('Redis 不可用，排行榜将使用 SQL 聚合回退路径。')
+            return
+        data_manager.leaderboard.rebuild()
+        click.echo('排行榜已重建。')
+
+    @app.cli.command('reconcile-counters')
+    def reconcile_counters():
+        """按全表聚合校准首页使用的全站计数（SystemCounter）以及论坛主题 / 回复上的点赞、回复计数。"""
+        counters = app.data_manager.reconcile_system_counters()
+        for name, value in counters.items():
+            click.echo(f'{name}: {value}')
+        app.data_manager.backfill_forum_counters()
+        click.echo('论坛点赞 / 回复计数已校准。')
+
+    @app.cli.command('refresh-rollups')
+    @click.option('--rebuild', is_flag=True, help='清空已有汇总后从头回填')
+    def refresh_rollups(rebuild):
+        """增量刷新管理员分析汇总；首次运行时按小时分块回填全部历史。"""
+        from web.services.rollup import RollupService
+        service = RollupService()
+        if rebuild:
+            service.reset()
+        total = 0
+        while True:
+            processed = service.run()
+            total += processed
+            if processed == 0:
+                break
+        click.echo(f'已处理 {total} 个小时桶，水位线：{service.get_watermark()}')
+
+    @app.cli.command('analyze-items')
+    def analyze_items():
+        """重算题目项目分析（难度 / 区分度 / 常见错答），结果显示在题目管理页。"""
+        from web.services.item_analysis import ItemAnalysisService
+        count = ItemAnalysisService().run()
+        click.echo(f'已更新 {count} 道题目的作答分析。')
+
+    @app.cli.command('refresh-hotness')
+    def refresh_hotness():
+        """按当前权重重算全部论坛主题热度。"""
+        from web.services.hotness import HotnessService
+        count = HotnessService().refresh(force=True)
+        click.echo(f'已更新 {count} 个主题的热度。')
+
+    @app.cli.command('rebuild-search-index')
+    def rebuild_search_index():
+        """清空并重建题目与论坛主题的全文检索索引（更新分词词典后执行）。"""
+        from web.services.search import SearchService
+        SearchService.ensure_schema()
+        counts = SearchService().rebuild()
+        click.echo(f"已索引 {counts['question']} 道题目、{counts['topic']} 个主题。")
+
+    @app.cli.command('process-images')
+    def process_images():
+        """为尚未处理的上传图片生成 WebP 缩略图与响应式尺寸（worker 停机期间上传的图片）。"""
+        from web.services.images import ImageService
+        count = ImageService(app.config['UPLOAD_FOLDER']).process_all()
+        click.echo(f'已处理 {count} 张图片。')
+
+    @app.cli.command('regrade-question')
+    @click.argument('question_id', type=int)
+    def regrade_question(question_id):
+        """按题目当前的标准答案 / 分值重新评分历史作答（后台任务提交失败时手动执行，可重复运行）。"""
+        from web.models import db, Question
+        from web.services.grading import GradingService
+        from web.services.regrade import RegradeService
+        question = db.session.get(Question, question_id)
+        if question is None:
+            click.echo(f'题目 {question_id} 不存在。')
+            return
+        service = RegradeService(GradingService(app.config['DLL_PATH']), app.data_manager.leaderboard)
+        progress = service.run(question_id, question.version or 1,
+                               on_progress=lambda p: click.echo(f"{p['done']}/{p['total']}"))
+        click.echo(f"重新评分完成：{progress.get('done', 0)} 条作答，{progress.get('changed', 0)} 条分数变化。")
+
+    @app.cli.command('backup')
+    @click.option('--full', 'mode', flag_value='full', help='强制全量备份')
+    @click.option('--incremental', 'mode', flag_value='incremental', help='强制增量备份')
+    @click.option('--workers', default=4, show_default=True, help='并行导出的表数')
+    def backup(mode, workers):
+        """在线备份数据库与上传文件（默认距上次全量超过 7 天时全量，否则增量）。"""
+        from web.services.backup import BackupService
+        service = BackupService(app.config['BACKUP_DIR'], app.config['UPLOAD_FOLDER'], workers=workers)
+        full = {'full': True, 'incremental': False}.get(mode)
+        manifest = service.backup(full=full)
+        rows = sum(t['rows'] for t in manifest['tables'].values())
+        click.echo(f"{manifest['type']} 备份 {manifest['run_id']} 完成：{rows} 行，{len(manifest['files'])} 个文件，耗时 {manifest['duration']}s")
+
+    @app.cli.command('list-backups')
+    def list_backups():
+        """列出可用的备份及其类型。"""
+        from web.services.backup import BackupService
+        service = BackupService(app.config['BACKUP_DIR'])
+        for run_id in service.list_runs():
+            manifest = service.load_manifest(run_id)
+            rows = sum(t['rows'] for t in manifest['tables'].values())
+            click.echo(f"{run_id}  {manifest['type']:<11}  {rows} 行  基于 {manifest['base'] or '-'}")
+
+    @app.cli.command('restore')
+    @click.argument('run_id', required=False)
+    @click.option('--database-url', help='恢复到指定数据库（默认当前配置的数据库）')
+    @click.option('--force', is_flag=True, help='目标库非空时先清空')
+    @click.option('--skip-files', is_flag=True, help='不恢复上传文件')
+    @click.option('--workers', default=4, show_default=True, help='并行写入的分片数（SQLite 固定为 1）')
+    def restore(run_id, database_url, force, skip_files, workers):
+        """从备份恢复（默认最近一次），自动沿增量链回溯到全量备份。"""
+        from sqlalchemy import create_engine
+        from web.models import db
+        from web.services.backup import BackupService
+        service = BackupService(app.config['BACKUP_DIR'], app.config['UPLOAD_FOLDER'], workers=workers)
+        runs = service.list_runs()
+        if not runs:
+            click.echo('没有可用的备份。')
+            return
+        run_id = run_id or runs[-1]
+        engine = create_engine(database_url) if database_url else db.engine
+        try:
+            restored = service.restore(run_id, engine, force=force, restore_files=not skip_files)
+        except RuntimeError as e:
+            click.echo(str(e))
+            return
+        click.echo(f'已从 {run_id} 恢复 {sum(restored.values())} 行。')
@@ -2,6 +2,7 @@ import os
 import sys
 import platform
 import redis
+from celery.schedules import crontab
 
 class Config:
     # Flask-Mail 邮件配置（需根据实际邮箱服务调整）
@@ -18,6 +19,10 @@ class Config:
         os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
         'build', 'text_analyzer', LIBANALYZER_NAME
     )
+    # 分词词典目录（text_analyzer/dict，搜索索引与 C 分析器共用）
+    ANALYZER_DICT_DIR = os.environ.get('ANALYZER_DICT_DIR') or os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'text_analyzer', 'dict'
+    )
     # Grading Configuration
     # Auto-detect reasonable worker count: CPU count * 2, max 16, min 4
     try:
@@ -55,6 +60,7 @@ class Config:
 
         # Data files (writable) should be in BASE_DIR (next to exe)
         DATA_FILE = os.path.join(BASE_DIR, 'questions.txt')
+        QUESTION_BANK_FILE = os.path.join(BASE_DIR, 'questions.qbk')
         RESULTS_FILE = os.path.join(BASE_DIR, 'results.json')
 
         INSTANCE_PATH = os.path.join(BASE_DIR, 'instance')
@@ -76,6 +82,7 @@ class Config:
         # Data Paths
         DLL_PATH = os.path.join(BASE_DIR, 'build', 'grader', LIB_NAME)
         DATA_FILE = os.path.join(BASE_DIR, 'questions.txt')
+        QUESTION_BANK_FILE = os.path.join(BASE_DIR, 'questions.qbk')
         RESULTS_FILE = os.path.join(BASE_DIR, 'results.json')
 
         # Database config
@@ -154,5 +161,34 @@ class Config:
     # Celery Config
     CELERY_BROKER_URL = f'redis://{REDIS_HOST}:{REDIS_PORT}/0'
     CELERY_RESULT_BACKEND = f'redis://{REDIS_HOST}:{REDIS_PORT}/0'
+    # 备份目录（默认 instance/backups，建议挂载到独立磁盘）
+    BACKUP_DIR = os.environ.get('BACKUP_DIR') or os.path.join(INSTANCE_PATH, 'backups')
+    # 周期任务（需启动 celery beat）
+    CELERYBEAT_SCHEDULE = {
+        'reconcile-system-counters': {
+            'task': 'web.tasks.reconcile_counters_task',
+            'schedule': 3600.0,
+        },
+        'refresh-usage-rollups': {
+            'task': 'web.tasks.refresh_rollups_task',
+            'schedule': 600.0,
+        },
+        'item-analysis': {
+            'task': 'web.tasks.item_analysis_task',
+            'schedule': 86400.0,
+        },
+        'refresh-forum-hotness': {
+            'task': 'web.tasks.refresh_hotness_task',
+            'schedule': 300.0,
+        },
+        'flush-topic-views': {
+            'task': 'web.tasks.flush_views_task',
+            'schedule': 60.0,
+        },
+        'nightly-backup': {
+            'task': 'web.tasks.backup_task',
+            'schedule': crontab(hour=3, minute=0),
+        },
+    }
 
 
@@ -4,7 +4,10 @@ from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
 import json
-from sqlalchemy import event
+from sqlalchemy import event, inspect, func, case
+from sqlalchemy.orm import Session, validates
+import hashlib
+import math
 from sqlalchemy.engine import Engine
 
 class WorkshopDraft(db.Model):
@@ -24,13 +27,20 @@ class Post(db.Model):
     topic_id = db.Column(db.Integer, db.ForeignKey('topic.id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     content = db.Column(db.Text, nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     parent_id = db.Column(db.Integer, db.ForeignKey('post.id'), nullable=True)
     topic = db.relationship('Topic', backref=db.backref('posts', lazy=True, cascade="all, delete-orphan"))
     user = db.relationship('User', backref=db.backref('posts', lazy=True))
     replies = db.relationship('Post', backref=db.backref('parent', remote_side=[id]), lazy=True)
     likes = db.relationship('PostLike', backref='post', lazy=True, cascade="all, delete-orphan")
     mode = db.Column(db.String(20), default='html')
+    like_count = db.Column(db.Integer, default=0)  # 由 track_forum_counters 维护
+    content_html = db.Column(db.Text)  # markdown 渲染缓存，见 utils.render_utils.render_cached
+    content_html_key = db.Column(db.String(64))
+    __table_args__ = (
+        db.Index('ix_post_topic_created', 'topic_id', 'created_at', 'id'),
+        db.Index('ix_post_user_created', 'user_id', 'created_at'),
+    )
 
 # Enable Write-Ahead Logging (WAL) mode for SQLite
 # This significantly improves concurrency by allowing simultaneous readers and writers
@@ -45,6 +55,12 @@ def set_sqlite_pragma(dbapi_connection, connection_record):
         cursor.close()
     except:
         pass
+    # 未启用 SQLITE_ENABLE_MATH_FUNCTIONS 的构建缺少 log10 / power（论坛热度计算使用）
+    try:
+        dbapi_connection.execute("SELECT log10(1), power(1, 1)")
+    except Exception:
+        dbapi_connection.create_function('log10', 1, lambda x: math.log10(x) if x and x > 0 else None, deterministic=True)
+        dbapi_connection.create_function('power', 2, lambda x, y: math.pow(x, y) if x is not None and y is not None else None, deterministic=True)
 
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -82,7 +98,7 @@ class StardustHistory(db.Model):
     category = db.Column(db.String(100), nullable=False)
     amount = db.Column(db.Integer, nullable=False)
     reason = db.Column(db.String(50))
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     user = db.relationship('User', backref=db.backref('stardust_history', lazy=True))
 
 class Question(db.Model):
@@ -96,12 +112,28 @@ class Question(db.Model):
     type = db.Column(db.String(20), default='public', index=True)  # public/personal
     owner_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True, index=True)  # 个人题目所属用户
     owner = db.relationship('User', backref=db.backref('personal_questions', lazy=True))
+    version = db.Column(db.Integer, default=1)  # 标准答案 / 分值每修改一次加 1
+    content_hash = db.Column(db.String(64), nullable=True, index=True)  # 规范化题干的 SHA-256，导入去重用
+    content_html = db.Column(db.Text)  # markdown 渲染缓存，见 utils.render_utils.render_cached
+    content_html_key = db.Column(db.String(64))
+
+    @staticmethod
+    def hash_content(content):
+        # 合并空白后取摘要，仅排版不同的题干视为重复
+        return hashlib.sha256(' '.join(str(content or '').split()).encode('utf-8')).hexdigest()
+
+    @validates('content')
+    def _update_content_hash(self, key, value):
+        self.content_hash = self.hash_content(value)
+        return value
+
     def to_dict(self):
         return {
             'id': self.id,
             'content': self.content,
             'answer': self.answer,
             'score': self.score,
+            'version': self.version or 1,
             'image': self.image,
             'category': self.category,
             'mode': self.mode,
@@ -109,7 +141,25 @@ class Question(db.Model):
             'owner_id': self.owner_id
         }
 
+class QuestionVersion(db.Model):
+    """题目评分依据的历史版本，成绩中的每道题记录其评分时使用的版本号。"""
+    __tablename__ = 'question_version'
+    __table_args__ = (
+        db.UniqueConstraint('question_id', 'version', name='uq_question_version'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    question_id = db.Column(db.Integer, nullable=False, index=True)
+    version = db.Column(db.Integer, nullable=False)
+    answer = db.Column(db.String(500), nullable=False)
+    score = db.Column(db.Integer, default=10)
+    created_by = db.Column(db.Integer, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
 class ExamResult(db.Model):
+    __table_args__ = (
+        db.Index('ix_exam_result_timestamp_id', 'timestamp', 'id'),
+        db.Index('ix_exam_result_user_timestamp', 'user_id', 'timestamp'),
+    )
     id = db.Column(db.String(36), primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
     user = db.relationship('User', backref=db.backref('results', lazy=True))
@@ -124,7 +174,8 @@ class ExamResult(db.Model):
     @details.setter
     def details(self, value):
         self.details_json = json.dumps(value, ensure_ascii=False)
-    def to_dict(self):
+    def to_summary_dict(self):
+        # 列表页使用的摘要投影，不触碰 details_json
         return {
             'id': self.id,
             'user_id': self.user_id,
@@ -133,11 +184,86 @@ class ExamResult(db.Model):
             'timestamp': self.timestamp,
             'total_score': self.total_score,
             'max_score': self.max_score,
-            'details': self.details,
             'category': self.category or '默认题集'
         }
+    def to_dict(self):
+        data = self.to_summary_dict()
+        data['details'] = self.details
+        return data
+
+class ExamAnswer(db.Model):
+    """
+    每道题的作答记录（由 ExamResult.details 规范化而来），评分时批量写入，
+    按题目 / 用户 / 类别建索引，统计分析无需再逐条解析 details_json。
+    """
+    __tablename__ = 'exam_answer'
+    __table_args__ = (
+        db.Index('ix_exam_answer_result', 'result_id'),
+        db.Index('ix_exam_answer_question', 'question_id'),
+        db.Index('ix_exam_answer_user_question', 'user_id', 'question_id'),
+        db.Index('ix_exam_answer_category', 'category'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    result_id = db.Column(db.String(36), db.ForeignKey('exam_result.id', ondelete='CASCADE'), nullable=False)
+    user_id = db.Column(db.Integer, nullable=True)
+    question_id = db.Column(db.Integer, nullable=True)  # 旧记录可能缺少题目 id
+    position = db.Column(db.Integer, default=0)
+    category = db.Column(db.String(100), default='默认题集')
+    score = db.Column(db.Integer, default=0)
+    full_score = db.Column(db.Integer, default=0)
+    answer = db.Column(db.String(500), default='')  # 规范化后的作答
+    question_version = db.Column(db.Integer, nullable=True)  # 评分时的题目版本，旧记录为空
+    result = db.relationship('ExamResult', backref=db.backref('answers', lazy=True, cascade="all, delete-orphan"))
+
+    @staticmethod
+    def normalize_answer(ans):
+        # 与评分回退逻辑一致：去首尾空白、小写，并合并连续空白
+        return ' '.join(str(ans or '').split()).lower()[:500]
+
+    @classmethod
+    def rows_from_details(cls, result_id, user_id, details, default_category='默认题集'):
+        """把 details 列表转换为可直接批量 INSERT 的字典列表。"""
+        rows = []
+        for pos, d in enumerate(details or []):
+            if not isinstance(d, dict):
+                continue
+            qid = d.get('id')
+            try:
+                qid = int(qid) if qid is not None else None
+            except (TypeError, ValueError):
+                qid = None
+            rows.append({
+                'result_id': result_id,
+                'user_id': user_id,
+                'question_id': qid,
+                'position': pos,
+                'category': d.get('category') or default_category,
+                'score': int(d.get('score') or 0),
+                'full_score': int(d.get('full_score') or 0),
+                'answer': cls.normalize_answer(d.get('user_ans')),
+                'question_version': d.get('version')
+            })
+        return rows
+
+class QuestionStat(db.Model):
+    """题目项目分析结果，由 ItemAnalysisService 批量重算后整表替换。"""
+    __tablename__ = 'question_stat'
+    question_id = db.Column(db.Integer, primary_key=True)
+    attempts = db.Column(db.Integer, default=0)
+    difficulty = db.Column(db.Float, nullable=True)      # 平均得分率 p，越高越容易
+    correct_rate = db.Column(db.Float, nullable=True)    # 满分作答占比
+    discrimination = db.Column(db.Float, nullable=True)  # 区分度 D（高分组 p - 低分组 p）
+    distractors_json = db.Column(db.Text, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    @property
+    def distractors(self):
+        return json.loads(self.distractors_json) if self.distractors_json else []
 
 class UserCategoryStat(db.Model):
+    __table_args__ = (
+        db.Index('ix_user_category_stat_user_category', 'user_id', 'category'),
+        db.Index('ix_user_category_stat_category', 'category'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     category = db.Column(db.String(100), nullable=False)
@@ -146,6 +272,35 @@ class UserCategoryStat(db.Model):
     total_max_score = db.Column(db.Integer, default=0)
     user = db.relationship('User', backref=db.backref('category_stats', lazy=True))
 
+class UserDashboard(db.Model):
+    """
+    学生首页看板的预聚合数据，每个用户一行，评分时增量更新：
+      trend_json   最近 7 次考试的得分（环形缓冲）
+      errors_json  按题目 id 计数的错题统计 {qid: {label, wrong, total}}
+    total_* 与 UserCategoryStat 各类别之和保持一致。
+    """
+    __tablename__ = 'user_dashboard'
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    total_attempts = db.Column(db.Integer, default=0)
+    total_score = db.Column(db.Integer, default=0)
+    total_max_score = db.Column(db.Integer, default=0)
+    trend_json = db.Column(db.Text, nullable=True)
+    errors_json = db.Column(db.Text, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    user = db.relationship('User', backref=db.backref('dashboard', uselist=False, cascade="all, delete-orphan"))
+    @property
+    def trend(self):
+        return json.loads(self.trend_json) if self.trend_json else []
+    @trend.setter
+    def trend(self, value):
+        self.trend_json = json.dumps(value, ensure_ascii=False)
+    @property
+    def errors(self):
+        return json.loads(self.errors_json) if self.errors_json else {}
+    @errors.setter
+    def errors(self, value):
+        self.errors_json = json.dumps(value, ensure_ascii=False)
+
 class UserPermission(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -156,6 +311,51 @@ class SystemSetting(db.Model):
     key = db.Column(db.String(50), primary_key=True)
     value = db.Column(db.Text, nullable=True)
     mode = db.Column(db.String(20), default='html')  # 公告/指南编辑模式（html/markdown）
+    content_html = db.Column(db.Text)  # markdown 渲染缓存，见 utils.render_utils.render_cached
+    content_html_key = db.Column(db.String(64))
+
+class SystemCounter(db.Model):
+    """
+    全站运行计数（题目数、成绩数、得分与满分总和），由下方 after_flush 钩子
+    在插入/删除 Question、ExamResult 的同一事务内增减，定期任务负责校准。
+    """
+    __tablename__ = 'system_counter'
+    QUESTIONS = 'questions'
+    EXAM_RESULTS = 'exam_results'
+    EXAM_SCORE_SUM = 'exam_score_sum'
+    EXAM_MAX_SCORE_SUM = 'exam_max_score_sum'
+    NAMES = (QUESTIONS, EXAM_RESULTS, EXAM_SCORE_SUM, EXAM_MAX_SCORE_SUM)
+    name = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.BigInteger, default=0, nullable=False)
+
+    @classmethod
+    def apply(cls, connection, deltas):
+        """在给定连接（即当前事务）上原子地累加计数：UPDATE ... SET value = value + :delta。"""
+        table = cls.__table__
+        for name, delta in deltas.items():
+            if delta:
+                connection.execute(table.update().where(table.c.name == name).values(value=table.c.value + delta))
+
+class UsageRollup(db.Model):
+    """
+    按小时 / 按天预聚合的使用统计，由 RollupService 按水位线增量维护，
+    管理员分析页只读取本表。category 为空字符串的行是全站汇总。
+    """
+    __tablename__ = 'usage_rollup'
+    granularity = db.Column(db.String(8), primary_key=True)  # hour/day
+    bucket_start = db.Column(db.DateTime, primary_key=True)
+    category = db.Column(db.String(100), primary_key=True, default='')
+    exams = db.Column(db.Integer, default=0)
+    score_sum = db.Column(db.BigInteger, default=0)
+    max_score_sum = db.Column(db.BigInteger, default=0)
+    active_users = db.Column(db.Integer, default=0)
+    new_topics = db.Column(db.Integer, default=0)
+    new_posts = db.Column(db.Integer, default=0)
+    views = db.Column(db.Integer, default=0)
+    stardust = db.Column(db.Integer, default=0)
+    @property
+    def accuracy(self):
+        return round(self.score_sum / self.max_score_sum * 100, 1) if self.max_score_sum else 0
 
 class Board(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -171,13 +371,24 @@ class Topic(db.Model):
     title = db.Column(db.String(200), nullable=False)
     content = db.Column(db.Text, nullable=False)
     images_json = db.Column(db.Text, default='[]')
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     views = db.Column(db.Integer, default=0)
     hotness = db.Column(db.Float, default=0.0, index=True)
     is_pinned = db.Column(db.Boolean, default=False)
     is_locked = db.Column(db.Boolean, default=False)
     is_deleted = db.Column(db.Boolean, default=False)
+    # 冗余计数，由 track_forum_counters 在写入时原子更新
+    reply_count = db.Column(db.Integer, default=0)
+    like_count = db.Column(db.Integer, default=0)
+    last_post_at = db.Column(db.DateTime)
+    content_html = db.Column(db.Text)  # markdown 渲染缓存，见 utils.render_utils.render_cached
+    content_html_key = db.Column(db.String(64))
+    __table_args__ = (
+        db.Index('ix_topic_board_listing', 'board_id', 'is_deleted', 'is_pinned', 'updated_at'),
+        db.Index('ix_topic_latest', 'is_deleted', 'created_at'),
+        db.Index('ix_topic_user_created', 'user_id', 'created_at'),
+    )
     board = db.relationship('Board', backref=db.backref('topics', lazy=True, cascade="all, delete-orphan"))
     user = db.relationship('User', backref=db.backref('topics', lazy=True))
     likes = db.relationship('TopicLike', backref='topic', lazy=True, cascade="all, delete-orphan")
@@ -195,6 +406,9 @@ class TopicLike(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
     topic_id = db.Column(db.Integer, db.ForeignKey('topic.id'), primary_key=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    __table_args__ = (
+        db.Index('ix_topic_like_topic', 'topic_id'),
+    )
 
 class PostLike(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
@@ -204,5 +418,130 @@ class PostLike(db.Model):
 class TopicView(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
     topic_id = db.Column(db.Integer, db.ForeignKey('topic.id'), primary_key=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+class SearchDocument(db.Model):
+    """
+    题目 / 主题的分词结果（空格分隔），由 track_search_documents 随写入同步。
+    SQLite 下由触发器同步到 FTS5 表 search_fts，PostgreSQL 下建 tsvector GIN 表达式索引，
+    见 services.search.SearchService.ensure_schema。
+    """
+    __tablename__ = 'search_document'
+    id = db.Column(db.Integer, primary_key=True)
+    doc_type = db.Column(db.String(16), nullable=False)  # question / topic
+    doc_id = db.Column(db.Integer, nullable=False)
+    title_tokens = db.Column(db.Text, default='')
+    body_tokens = db.Column(db.Text, default='')
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    __table_args__ = (
+        db.UniqueConstraint('doc_type', 'doc_id', name='uq_search_document_doc'),
+    )
+
+class ForumNotification(db.Model):
+    """回复通知收件箱，回复发布时写入（见 services.inbox.InboxService.fan_out）。"""
+    __tablename__ = 'forum_notification'
+    KIND_REPLY = 'reply'    # 回复了你的评论
+    KIND_TOPIC = 'topic'    # 回复了你的主题
+    KIND_THREAD = 'thread'  # 你参与过的主题有新回复
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)  # 收件人
+    actor_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    topic_id = db.Column(db.Integer, db.ForeignKey('topic.id'), nullable=False)
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), nullable=False)
+    kind = db.Column(db.String(16), nullable=False)
+    is_read = db.Column(db.Boolean, default=False, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'post_id', name='uq_forum_notification_user_post'),
+        db.Index('ix_forum_notification_inbox', 'user_id', 'id'),
+        db.Index('ix_forum_notification_unread', 'user_id', 'is_read'),
+    )
+    actor = db.relationship('User', foreign_keys=[actor_id])
+    topic = db.relationship('Topic')
+    post = db.relationship('Post', backref=db.backref('notifications', lazy=True, cascade="all, delete-orphan"))
+
+
+@event.listens_for(Session, "after_flush")
+def track_system_counters(session, flush_context):
+    # after_flush 中 new/deleted 与属性历史仍为本次 flush 前的状态
+    deltas = {}
+    def add(name, delta):
+        deltas[name] = deltas.get(name, 0) + delta
+    for sign, objects in ((1, session.new), (-1, session.deleted)):
+        for obj in objects:
+            if isinstance(obj, Question):
+                add(SystemCounter.QUESTIONS, sign)
+            elif isinstance(obj, ExamResult):
+                add(SystemCounter.EXAM_RESULTS, sign)
+                add(SystemCounter.EXAM_SCORE_SUM, sign * (obj.total_score or 0))
+                add(SystemCounter.EXAM_MAX_SCORE_SUM, sign * (obj.max_score or 0))
+    for obj in session.dirty:
+        if not isinstance(obj, ExamResult):
+            continue
+        # 重新评分等修改分数的情况
+        state = inspect(obj)
+        for attr, name in (('total_score', SystemCounter.EXAM_SCORE_SUM), ('max_score', SystemCounter.EXAM_MAX_SCORE_SUM)):
+            history = state.attrs[attr].history
+            if history.has_changes():
+                add(name, sum(v or 0 for v in history.added) - sum(v or 0 for v in history.deleted))
+    if any(deltas.values()):
+        SystemCounter.apply(session.connection(), deltas)
+
+
+@event.listens_for(Session, "after_flush")
+def track_forum_counters(session, flush_context):
+    """新增 / 删除回复与点赞时，在同一事务内原子更新 Topic / Post 上的冗余计数。"""
+    topic_deltas = {}
+    post_deltas = {}
+    last_post = {}
+    for sign, objects in ((1, session.new), (-1, session.deleted)):
+        for obj in objects:
+            if isinstance(obj, Post) and obj.topic_id:
+                delta = topic_deltas.setdefault(obj.topic_id, {'reply_count': 0, 'like_count': 0})
+                delta['reply_count'] += sign
+                if sign > 0:
+                    created = obj.created_at or datetime.utcnow()
+                    last_post[obj.topic_id] = max(last_post.get(obj.topic_id, created), created)
+            elif isinstance(obj, TopicLike) and obj.topic_id:
+                topic_deltas.setdefault(obj.topic_id, {'reply_count': 0, 'like_count': 0})['like_count'] += sign
+            elif isinstance(obj, PostLike) and obj.post_id:
+                post_deltas[obj.post_id] = post_deltas.get(obj.post_id, 0) + sign
+    if not topic_deltas and not post_deltas:
+        return
+    connection = session.connection()
+    topics = Topic.__table__
+    for topic_id, delta in topic_deltas.items():
+        values = {name: func.coalesce(topics.c[name], 0) + value for name, value in delta.items() if value}
+        if topic_id in last_post:
+            created = last_post[topic_id]
+            values['last_post_at'] = case((topics.c.last_post_at > created, topics.c.last_post_at), else_=created)
+        if values:
+            # 保留 updated_at：点赞不算主题活动（回复时由视图自行更新）
+            connection.execute(topics.update().where(topics.c.id == topic_id).values(updated_at=topics.c.updated_at, **values))
+    posts = Post.__table__
+    for post_id, delta in post_deltas.items():
+        if delta:
+            connection.execute(posts.update().where(posts.c.id == post_id)
+                               .values(like_count=func.coalesce(posts.c.like_count, 0) + delta))
+
 
+@event.listens_for(Session, "after_flush")
+def track_search_documents(session, flush_context):
+    """题目与主题新增 / 修改 / 删除时，在同一事务内更新搜索索引（Core 批量写入需自行调用 SearchService）。"""
+    changed = []
+    removed = []
+    for obj in session.new:
+        if isinstance(obj, (Question, Topic)):
+            changed.append(obj)
+    for obj in session.dirty:
+        if isinstance(obj, (Question, Topic)):
+            state = inspect(obj)
+            fields = ('content', 'category') if isinstance(obj, Question) else ('title', 'content', 'is_deleted')
+            if any(state.attrs[name].history.has_changes() for name in fields):
+                changed.append(obj)
+    for obj in session.deleted:
+        if isinstance(obj, (Question, Topic)):
+            removed.append(obj)
+    if changed or removed:
+        from web.services.search import SearchService
+        SearchService.sync_objects(session.connection(), changed, removed)
@@ -0,0 +1,382 @@
+import os
+import gzip
+import json
+import shutil
+import hashlib
+from datetime import datetime, date, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import select, and_, or_, func, inspect, text, DateTime, Date
+from web.models import db
+
+
+class BackupService:
+    """
+    在线备份 / 恢复：
+      - 所有表在同一个一致性快照内导出，子表不会出现快照之后才提交的父行：
+        PostgreSQL 由协调连接 pg_export_snapshot()，各并行导出事务 SET TRANSACTION SNAPSHOT 导入；
+        其他数据库单连接单事务串行导出（SQLite 为 WAL 模式，读事务不阻塞写入）
+      - 每张表按主键分块（keyset）读取，每块写一个 gzip 压缩的 JSONL 分片
+      - 增量备份按水位线只导出新增 / 修改的行：有 updated_at 的表按 updated_at，
+        WATERMARKS 中登记的追加型大表按 id / 时间列，其余小表与 FULL_TABLES 每次全量
+      - 快照看不到进行中的事务，而它们的 id / 时间可能小于本次上界，因此下一次增量的下界
+        （floor）留有重叠：时间列回退 SAFETY_LAG，id 列沿用上一次备份的上界
+      - 上传目录按内容 SHA-256 去重存入 objects/，文件大小与修改时间未变时沿用上次的摘要，不重复读盘
+      - 恢复时沿 base 链先载入全量再依次套用增量（增量按主键先删后插），同一张表的分片并行写入
+
+    增量只记录新增和修改，不记录删除；定期的全量备份（默认间隔 FULL_INTERVAL_DAYS 天）负责收敛。
+    目录布局：
+        <root>/<run_id>/manifest.json
+        <root>/<run_id>/tables/<table>/part-00001.jsonl.gz
+        <root>/objects/<sha256 前两位>/<sha256>
+    """
+    # 追加为主的大表：按该列做增量（原地修改由全量备份兜底）
+    WATERMARKS = {
+        'exam_result': 'timestamp',
+        'exam_answer': 'id',
+        'question_version': 'id',
+        'stardust_history': 'id',
+        'post': 'id',
+        'topic_view': 'created_at',
+        'topic_like': 'created_at',
+        'post_like': 'created_at',
+    }
+    # 每次全量：topic 的置顶 / 锁定、点赞 / 回复 / 浏览计数与热度更新刻意不改 updated_at；
+    # search_document 按先删后插重写（主键会变），增量按主键覆盖不了旧行
+    FULL_TABLES = {'topic', 'search_document'}
+    SAFETY_LAG = timedelta(hours=1)  # 假定事务不会持续这么久
+    FULL_INTERVAL_DAYS = 7
+    RUN_FORMAT = '%Y%m%d-%H%M%S'
+    SKIP_UPLOAD_DIRS = {'imports'}  # 导入任务的临时目录
+
+    def __init__(self, root, upload_folder=None, workers=4, chunk_size=50000):
+        self.root = root
+        self.upload_folder = upload_folder
+        self.workers = workers
+        self.chunk_size = chunk_size
+
+    # ---- 通用 ----
+    @staticmethod
+    def _keyset_after(pk_columns, last_key):
+        clauses = []
+        for i, column in enumerate(pk_columns):
+            equal = [pk_columns[j] == last_key[j] for j in range(i)]
+            clauses.append(and_(*equal, column > last_key[i]))
+        return or_(*clauses)
+
+    @staticmethod
+    def _encode(value):
+        if isinstance(value, (datetime, date)):
+            return value.isoformat()
+        return value
+
+    @staticmethod
+    def _decode(column, value):
+        if value is None:
+            return None
+        if isinstance(column.type, DateTime):
+            return datetime.fromisoformat(value)
+        if isinstance(column.type, Date):
+            return date.fromisoformat(value)
+        return value
+
+    def list_runs(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(d for d in os.listdir(self.root)
+                      if os.path.exists(os.path.join(self.root, d, 'manifest.json')))
+
+    def load_manifest(self, run_id):
+        with open(os.path.join(self.root, run_id, 'manifest.json'), encoding='utf-8') as f:
+            return json.load(f)
+
+    def _watermark_column(self, table):
+        if table.name in self.FULL_TABLES:
+            return None
+        if 'updated_at' in table.c:
+            return table.c.updated_at
+        name = self.WATERMARKS.get(table.name)
+        return table.c[name] if name else None
+
+    # ---- 备份 ----
+    def needs_full(self, previous):
+        if previous is None:
+            return True
+        last_full = datetime.strptime(previous['full_run'], self.RUN_FORMAT)
+        return datetime.now() - last_full >= timedelta(days=self.FULL_INTERVAL_DAYS)
+
+    def backup(self, full=None):
+        """执行一次备份；full 为 None 时按全量间隔自动决定。返回 manifest。"""
+        engine = db.engine
+        runs = self.list_runs()
+        previous = self.load_manifest(runs[-1]) if runs else None
+        if full is None:
+            full = self.needs_full(previous)
+        if previous is None:
+            full = True
+        run_id = datetime.now().strftime(self.RUN_FORMAT)
+        run_dir = os.path.join(self.root, run_id)
+        os.makedirs(os.path.join(run_dir, 'tables'), exist_ok=True)
+
+        existing = set(inspect(engine).get_table_names())
+        tables = [t for t in db.metadata.sorted_tables if t.name in existing]
+        previous_tables = (previous or {}).get('tables', {})
+        started = datetime.now()
+
+        def export(conn, table):
+            return self._export_table(conn, table, run_dir, previous_tables.get(table.name), full)
+
+        if engine.dialect.name == 'postgresql':
+            table_info = self._export_parallel(engine, tables, export)
+        else:
+            table_info = self._export_serial(engine, tables, export)
+
+        manifest = {
+            'run_id': run_id,
+            'type': 'full' if full else 'incremental',
+            'base': None if full else previous['run_id'],
+            'full_run': run_id if full else previous['full_run'],
+            'created_at': started.isoformat(),
+            'duration': round((datetime.now() - started).total_seconds(), 2),
+            'tables': table_info,
+            'files': self._backup_files(previous.get('files') if previous else None),
+        }
+        # manifest 最后写入，中途失败的目录不会被当作有效备份
+        tmp = os.path.join(run_dir, 'manifest.json.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, os.path.join(run_dir, 'manifest.json'))
+        rows = sum(t['rows'] for t in table_info.values())
+        print(f"[Backup] {manifest['type']} backup {run_id}: {rows} rows, {len(manifest['files'])} files, {manifest['duration']}s")
+        return manifest
+
+    def _export_parallel(self, engine, tables, export):
+        """PostgreSQL：多张表并行导出，各事务导入协调连接导出的同一快照。"""
+        with engine.connect().execution_options(isolation_level='REPEATABLE READ') as coordinator:
+            with coordinator.begin():
+                # 协调事务保持打开，直到所有导出事务都已导入快照并完成
+                snapshot = coordinator.execute(text('SELECT pg_export_snapshot()')).scalar()
+
+                def run(table):
+                    with engine.connect().execution_options(isolation_level='REPEATABLE READ') as conn:
+                        with conn.begin():
+                            conn.execute(text(f"SET TRANSACTION SNAPSHOT '{snapshot}'"))
+                            return export(conn, table)
+
+                with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                    futures = {t.name: pool.submit(run, t) for t in tables}
+                    return {name: future.result() for name, future in futures.items()}
+
+    def _export_serial(self, engine, tables, export):
+        """其他数据库：单连接单事务依次导出。"""
+        with engine.connect() as conn:
+            if engine.dialect.name == 'sqlite':
+                with conn.begin():
+                    # pysqlite 不会为 SELECT 开启事务，显式 BEGIN 让所有读取共用一个快照；
+                    # 快照在第一次读取时建立，立即读一次 schema 把它固定在备份开始时
+                    conn.exec_driver_sql('BEGIN')
+                    conn.exec_driver_sql('SELECT count(*) FROM sqlite_master').scalar()
+                    return {t.name: export(conn, t) for t in tables}
+            conn = conn.execution_options(isolation_level='REPEATABLE READ')
+            with conn.begin():
+                return {t.name: export(conn, t) for t in tables}
+
+    def _floor(self, column, upper, previous_info):
+        """下一次增量的下界：快照时仍在进行中的事务可能写入小于 upper 的 id / 时间。"""
+        if upper is None:
+            return None
+        if isinstance(upper, str):
+            # exam_result.timestamp 为 'YYYY-MM-DD HH:MM:SS' 字符串
+            try:
+                return (datetime.fromisoformat(upper) - self.SAFETY_LAG).isoformat(sep=' ')
+            except ValueError:
+                pass
+        elif isinstance(upper, datetime):
+            return upper - self.SAFETY_LAG
+        # id：本次快照前已分配的 id 都不大于上一次的上界，从那里开始即可覆盖本次看不到的行
+        return self._decode(column, (previous_info or {}).get('watermark'))
+
+    def _export_table(self, conn, table, run_dir, previous_info, full):
+        pk = list(table.primary_key.columns)
+        wm_column = self._watermark_column(table)
+        incremental = not full and previous_info is not None and wm_column is not None
+        upper = conn.execute(select(func.max(wm_column))).scalar() if wm_column is not None else None
+        conditions = []
+        if incremental:
+            # 旧版 manifest 没有 floor，退回上一次的上界
+            lower = previous_info['floor'] if 'floor' in previous_info else previous_info.get('watermark')
+            lower = self._decode(wm_column, lower)
+            # 下界为空时整表导出；重复的行恢复时按主键覆盖
+            if lower is not None:
+                conditions.append(wm_column > lower if wm_column.name == 'id' else wm_column >= lower)
+
+        table_dir = os.path.join(run_dir, 'tables', table.name)
+        os.makedirs(table_dir, exist_ok=True)
+        parts = []
+        rows_total = 0
+        last_key = None
+        names = [c.name for c in table.columns]
+        pk_index = [names.index(c.name) for c in pk]
+        while True:
+            query = select(*table.columns).where(*conditions).order_by(*pk).limit(self.chunk_size)
+            if last_key is not None:
+                query = query.where(self._keyset_after(pk, last_key))
+            rows = conn.execute(query).all()
+            if not rows:
+                break
+            part = f'part-{len(parts) + 1:05d}.jsonl.gz'
+            with gzip.open(os.path.join(table_dir, part), 'wt', encoding='utf-8', compresslevel=6) as f:
+                for row in rows:
+                    f.write(json.dumps({n: self._encode(v) for n, v in zip(names, row)}, ensure_ascii=False))
+                    f.write('\n')
+            parts.append(part)
+            rows_total += len(rows)
+            last_key = [rows[-1][i] for i in pk_index]
+
+        return {
+            'mode': 'incremental' if incremental else 'full',
+            'watermark_column': wm_column.name if wm_column is not None else None,
+            'watermark': self._encode(upper),
+            'floor': self._encode(self._floor(wm_column, upper, previous_info)) if wm_column is not None else None,
+            'rows': rows_total,
+            'parts': parts,
+        }
+
+    def _object_path(self, digest):
+        return os.path.join(self.root, 'objects', digest[:2], digest)
+
+    def _backup_files(self, previous_files):
+        """上传目录按内容去重备份，返回 {相对路径: {'sha256', 'size', 'mtime'}}。"""
+        if not self.upload_folder or not os.path.isdir(self.upload_folder):
+            return {}
+        previous_files = previous_files or {}
+        files = {}
+        for dirpath, dirnames, filenames in os.walk(self.upload_folder):
+            if os.path.samefile(dirpath, self.upload_folder):
+                dirnames[:] = [d for d in dirnames if d not in self.SKIP_UPLOAD_DIRS]
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                rel = os.path.relpath(path, self.upload_folder).replace(os.sep, '/')
+                stat = os.stat(path)
+                known = previous_files.get(rel)
+                if known and known['size'] == stat.st_size and known['mtime'] == int(stat.st_mtime) \
+                        and os.path.exists(self._object_path(known['sha256'])):
+                    files[rel] = known
+                    continue
+                digest = hashlib.sha256()
+                with open(path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                        digest.update(chunk)
+                sha = digest.hexdigest()
+                target = self._object_path(sha)
+                if not os.path.exists(target):
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    shutil.copyfile(path, target + '.tmp')
+                    os.replace(target + '.tmp', target)
+                files[rel] = {'sha256': sha, 'size': stat.st_size, 'mtime': int(stat.st_mtime)}
+        return files
+
+    # ---- 恢复 ----
+    def chain(self, run_id):
+        """从全量备份到 run_id 的备份链（按时间先后）。"""
+        chain = []
+        current = run_id
+        while current:
+            manifest = self.load_manifest(current)
+            chain.append(manifest)
+            current = manifest.get('base')
+        return list(reversed(chain))
+
+    def restore(self, run_id, engine, force=False, restore_files=True):
+        """把 run_id 对应的数据恢复到 engine 指向的数据库（需为空库，force 时先清空）。"""
+        chain = self.chain(run_id)
+        db.metadata.create_all(engine)
+        existing = set(inspect(engine).get_table_names())
+        tables = [t for t in db.metadata.sorted_tables if t.name in existing]
+        with engine.connect() as conn:
+            non_empty = [t.name for t in tables if conn.execute(select(func.count()).select_from(t)).scalar()]
+        if non_empty:
+            if not force:
+                raise RuntimeError(f"目标数据库非空: {', '.join(non_empty)}（使用 force 覆盖）")
+            with engine.begin() as conn:
+                for table in reversed(tables):
+                    conn.execute(table.delete())
+
+        # SQLite 不支持并发写入
+        workers = 1 if engine.dialect.name == 'sqlite' else self.workers
+        restored = {}
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for table in tables:
+                # 自引用外键的表按分片顺序串行写入，保证父行先到
+                self_ref = any(fk.column.table is table for fk in table.foreign_keys)
+                total = 0
+                entries = [(m, m['tables'][table.name]) for m in chain if table.name in m['tables']]
+                # 无水位列的表在每次备份中都是全量，只需从最后一次全量开始
+                start = max((i for i, (_, info) in enumerate(entries) if info['mode'] == 'full'), default=0)
+                for manifest, info in entries[start:]:
+                    if not info['parts']:
+                        continue
+                    paths = [os.path.join(self.root, manifest['run_id'], 'tables', table.name, p) for p in info['parts']]
+                    upsert = info['mode'] == 'incremental'
+                    if self_ref or workers == 1:
+                        total += sum(self._load_part(engine, table, p, upsert) for p in paths)
+                    else:
+                        total += sum(pool.map(lambda p: self._load_part(engine, table, p, upsert), paths))
+                restored[table.name] = total
+                print(f"[Restore] {table.name}: {total} rows")
+
+        if engine.dialect.name == 'postgresql':
+            self._fix_sequences(engine, tables)
+        files = self._restore_files(chain[-1].get('files', {})) if restore_files else 0
+        print(f"[Restore] Restored {run_id}: {sum(restored.values())} rows, {files} files")
+        return restored
+
+    def _load_part(self, engine, table, path, upsert):
+        columns = list(table.columns)
+        pk = list(table.primary_key.columns)
+        rows = []
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                data = json.loads(line)
+                rows.append({c.name: self._decode(c, data.get(c.name)) for c in columns if c.name in data})
+        if not rows:
+            return 0
+        with engine.begin() as conn:
+            if upsert:
+                # 增量中的行可能已存在（被修改过），按主键先删后插
+                for i in range(0, len(rows), 500):
+                    keys = [tuple(r[c.name] for c in pk) for r in rows[i:i + 500]]
+                    if len(pk) == 1:
+                        conn.execute(table.delete().where(pk[0].in_([k[0] for k in keys])))
+                    else:
+                        conn.execute(table.delete().where(or_(*[and_(*[c == v for c, v in zip(pk, k)]) for k in keys])))
+            conn.execute(table.insert(), rows)
+        return len(rows)
+
+    def _fix_sequences(self, engine, tables):
+        from sqlalchemy import text
+        with engine.begin() as conn:
+            for table in tables:
+                pk = list(table.primary_key.columns)
+                if len(pk) != 1 or pk[0].type.python_type is not int:
+                    continue
+                seq = conn.execute(text("SELECT pg_get_serial_sequence(:t, :c)"),
+                                   {'t': f'"{table.name}"', 'c': pk[0].name}).scalar()
+                if seq:
+                    conn.execute(text(f'SELECT setval(:s, COALESCE(MAX("{pk[0].name}"), 1), MAX("{pk[0].name}") IS NOT NULL) '
+                                      f'FROM "{table.name}"'), {'s': seq})
+
+    def _restore_files(self, files):
+        if not self.upload_folder:
+            return 0
+        count = 0
+        for rel, info in files.items():
+            target = os.path.join(self.upload_folder, *rel.split('/'))
+            source = self._object_path(info['sha256'])
+            if not os.path.exists(source):
+                print(f"[Restore] Missing object for {rel}")
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copyfile(source, target)
+            count += 1
+        return count
+
@@ -14,6 +14,12 @@ class GradingService:
             # int calculate_score(const char* user_ans, const char* correct_ans, int full_score);
             self.lib.calculate_score.argtypes = [ctypes.c_char_p, ctypes.c_char_p, ctypes.c_int]
             self.lib.calculate_score.restype = ctypes.c_int
+            # int calculate_score_batch(const char** user_answers, int count, const char* correct_ans, int full_score, int* out_scores);
+            if hasattr(self.lib, 'calculate_score_batch'):
+                self.lib.calculate_score_batch.argtypes = [
+                    ctypes.POINTER(ctypes.c_char_p), ctypes.c_int, ctypes.c_char_p, ctypes.c_int, ctypes.POINTER(ctypes.c_int)
+                ]
+                self.lib.calculate_score_batch.restype = ctypes.c_int
             print(f"Successfully loaded DLL from {self.dll_path}")
         except Exception as e:
             print(f"Error loading DLL: {e}")
@@ -40,3 +46,59 @@ class GradingService:
 
     def is_available(self):
         return self.lib is not None
+
+    @staticmethod
+    def split_answers(answer):
+        """标准答案按中英文分号拆分为多个可接受答案（与在线阅卷一致）。"""
+        valid_answers = [ans.strip() for ans in answer.replace('；', ';').split(';') if ans.strip()]
+        return valid_answers or [answer]
+
+    def grade_batch(self, user_answers, correct_answer, full_score):
+        """
+        同一道题的一批作答评分，用于重新阅卷。
+        规则与在线阅卷相同：每个可接受答案分别评分取最高分，编码优先 GBK、失败回退 UTF-8。
+        """
+        scores = [0] * len(user_answers)
+        for correct in self.split_answers(correct_answer):
+            for i, score in enumerate(self._grade_against(user_answers, correct, full_score)):
+                if score > scores[i]:
+                    scores[i] = score
+        return scores
+
+    def _grade_against(self, user_answers, correct, full_score):
+        if not self.lib:
+            return [full_score if ans.strip().lower() == correct.strip().lower() else 0 for ans in user_answers]
+        try:
+            correct_gbk = correct.encode('gbk')
+        except UnicodeEncodeError:
+            correct_gbk = None
+        groups = {}
+        for i, ans in enumerate(user_answers):
+            encoded = None
+            if correct_gbk is not None:
+                try:
+                    encoded = ('gbk', ans.encode('gbk'))
+                except UnicodeEncodeError:
+                    pass
+            if encoded is None:
+                encoded = ('utf-8', ans.encode('utf-8'))
+            groups.setdefault(encoded[0], ([], []))
+            groups[encoded[0]][0].append(i)
+            groups[encoded[0]][1].append(encoded[1])
+
+        scores = [0] * len(user_answers)
+        for encoding, (indexes, encoded_answers) in groups.items():
+            b_correct = correct_gbk if encoding == 'gbk' else correct.encode('utf-8')
+            for i, score in zip(indexes, self._call_batch(encoded_answers, b_correct, full_score)):
+                scores[i] = score
+        return scores
+
+    def _call_batch(self, encoded_answers, b_correct, full_score):
+        count = len(encoded_answers)
+        if hasattr(self.lib, 'calculate_score_batch'):
+            answers = (ctypes.c_char_p * count)(*encoded_answers)
+            out = (ctypes.c_int * count)()
+            self.lib.calculate_score_batch(answers, count, b_correct, full_score, out)
+            return list(out)
+        # 旧版动态库没有批量接口时逐条调用
+        return [self.lib.calculate_score(ans, b_correct, full_score) for ans in encoded_answers]
@@ -0,0 +1,83 @@
+import json
+from datetime import datetime, timedelta
+from sqlalchemy import func, update, case, literal, extract
+from web.models import db, Topic, SystemSetting
+
+
+class HotnessService:
+    """
+    论坛主题热度：
+        hotness = (log10(views + 1) * w1 + likes * w2 + posts * w3) / (age_hours + 2) ** g
+    - refresh()：一条 UPDATE 对全部未删除主题重算，只改写变化超过阈值的行（由 celery beat 周期调度，体现时间衰减）
+    - bump(topic_id)：点赞 / 回复 / 浏览后只重算单个主题，与触发事件在同一事务内提交
+    点赞数与回复数读取 Topic 上的冗余计数（like_count / reply_count）。
+    权重保存在 SystemSetting 'forum_hotness_weights'，上次全量刷新时间保存在 'forum_hotness:refreshed_at'。
+    """
+    WEIGHTS_KEY = 'forum_hotness_weights'
+    REFRESHED_KEY = 'forum_hotness:refreshed_at'
+    DEFAULT_WEIGHTS = {'w1': 0.2, 'w2': 1.2, 'w3': 1.5, 'g': 1.5}
+    MIN_DELTA = 0.001      # 绝对变化小于该值且
+    MIN_RATIO = 0.01       # 相对变化小于 1% 的主题不改写
+    STALE_AFTER = timedelta(minutes=20)  # beat 未运行时，热门接口自行刷新的间隔
+    TS_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+    @classmethod
+    def get_weights(cls):
+        setting = db.session.get(SystemSetting, cls.WEIGHTS_KEY)
+        weights = dict(cls.DEFAULT_WEIGHTS)
+        if setting and setting.value:
+            weights.update(json.loads(setting.value))
+        return weights
+
+    def _age_hours(self, now):
+        if db.engine.dialect.name == 'sqlite':
+            hours = (func.julianday(now.strftime(self.TS_FORMAT)) - func.julianday(Topic.created_at)) * 24
+        else:
+            hours = extract('epoch', literal(now) - Topic.created_at) / 3600
+        return case((hours > 0, hours), else_=0)
+
+    def score_expression(self, weights, now):
+        raw = (func.log10(func.coalesce(Topic.views, 0) + 1) * weights['w1']
+               + func.coalesce(Topic.like_count, 0) * weights['w2']
+               + func.coalesce(Topic.reply_count, 0) * weights['w3'])
+        return raw / func.power(self._age_hours(now) + 2, weights['g'])
+
+    def refresh(self, now=None, force=False):
+        """全量重算，返回实际改写的主题数；force=True 时忽略阈值（例如权重刚修改）。"""
+        now = now or datetime.utcnow()
+        score = self.score_expression(self.get_weights(), now)
+        # updated_at 带 onupdate，热度刷新不应改变主题的最后活动时间
+        stmt = update(Topic).where(Topic.is_deleted == False).values(hotness=score, updated_at=Topic.updated_at)
+        if not force:
+            current = func.coalesce(Topic.hotness, 0)
+            stmt = stmt.where(func.abs(score - current) > self.MIN_DELTA + func.abs(current) * self.MIN_RATIO)
+        result = db.session.execute(stmt.execution_options(synchronize_session=False))
+        self._set_refreshed(now)
+        db.session.commit()
+        print(f"[Hotness] Refreshed {result.rowcount} topics")
+        return result.rowcount
+
+    def bump(self, topic_id, now=None):
+        """重算单个主题，不提交，由调用方随触发事件一起提交。"""
+        score = self.score_expression(self.get_weights(), now or datetime.utcnow())
+        db.session.execute(update(Topic).where(Topic.id == topic_id).values(hotness=score, updated_at=Topic.updated_at)
+                           .execution_options(synchronize_session=False))
+
+    def refresh_if_stale(self, now=None):
+        """beat 停止时的兜底：距上次全量刷新超过 STALE_AFTER 才刷新。"""
+        now = now or datetime.utcnow()
+        setting = db.session.get(SystemSetting, self.REFRESHED_KEY)
+        if setting and setting.value:
+            try:
+                if now - datetime.strptime(setting.value, self.TS_FORMAT) < self.STALE_AFTER:
+                    return 0
+            except ValueError:
+                pass
+        return self.refresh(now)
+
+    def _set_refreshed(self, now):
+        setting = db.session.get(SystemSetting, self.REFRESHED_KEY)
+        if setting is None:
+            setting = SystemSetting(key=self.REFRESHED_KEY)
+            db.session.add(setting)
+        setting.value = now.strftime(self.TS_FORMAT)
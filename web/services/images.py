@@ -0,0 +1,190 @@
+import hashlib
+import json
+import os
+import tempfile
+
+
+class ImageService:
+    """
+    上传图片的存储与后台处理：
+      - 原图按内容 SHA-256 命名存入 uploads/images（<hash>.<ext>），相同图片只保存一份，
+        文件名不变即内容不变，可长期缓存
+      - celery 任务 process_image_task 把原图按 EXIF 方向摆正后缩放为若干宽度的 WebP
+        （uploads/images/variants/<hash>_<宽度>.webp）并写入尺寸清单 <hash>.json，
+        最小的一档兼作缩略图；不放大小图
+      - 模板通过 image_set() 取得 src / srcset / 缩略图地址；变体尚未生成时回退到原图
+    """
+    WIDTHS = (320, 800, 1600)
+    WEBP_QUALITY = 80
+    VARIANT_DIR = 'variants'
+    RASTER_EXTENSIONS = {'png', 'jpg', 'jpeg', 'bmp', 'webp', 'tiff'}  # svg / gif（可能是动图）保留原图
+    CHUNK = 1024 * 1024
+    _manifests = {}  # filename -> 变体清单
+
+    def __init__(self, upload_folder):
+        self.image_dir = os.path.join(upload_folder, 'images')
+        self.variant_dir = os.path.join(self.image_dir, self.VARIANT_DIR)
+
+    # ---- 保存 ----
+    def save_stream(self, stream, ext):
+        """把文件流按内容哈希保存，返回文件名；已存在相同内容时直接复用。"""
+        os.makedirs(self.image_dir, exist_ok=True)
+        digest = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=self.image_dir, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as dst:
+                while True:
+                    chunk = stream.read(self.CHUNK)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    dst.write(chunk)
+            filename = f'{digest.hexdigest()}{ext.lower()}'
+            path = os.path.join(self.image_dir, filename)
+            if os.path.exists(path):
+                os.remove(tmp_path)
+            else:
+                os.replace(tmp_path, path)
+            return filename
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def save_upload(self, file, ext):
+        """保存表单上传的图片（ext 为已校验的扩展名，含点）并投递后台处理任务，返回文件名。"""
+        filename = self.save_stream(file.stream, ext)
+        self.enqueue(filename)
+        return filename
+
+    def enqueue(self, filename):
+        if not self._is_raster(filename) or self.has_variants(filename):
+            return
+        try:
+            from web.tasks import process_image_task
+            process_image_task.delay(filename)
+        except Exception as e:
+            print(f"[Images] Failed to dispatch processing task for {filename}: {e}")
+
+    def release(self, filename):
+        """
+        删除不再被引用的图片及其变体（在解除引用的事务提交后调用）；
+        相同内容的图片共用一个文件，仍有题目或论坛主题引用时保留，返回是否已删除。
+        """
+        from web.models import db, Question, Topic
+        if not filename or os.path.basename(filename) != filename:
+            return False
+        in_use = db.session.query(Question.id).filter(Question.image == filename).first() or \
+            db.session.query(Topic.id).filter(Topic.images_json.contains(f'"{filename}"')).first()
+        if in_use:
+            return False
+        stem = os.path.splitext(filename)[0]
+        paths = [os.path.join(self.image_dir, filename), self._manifest_path(filename)]
+        paths += [os.path.join(self.variant_dir, self._variant_name(filename, w)) for w in self.WIDTHS]
+        if os.path.isdir(self.variant_dir):
+            # 原图窄于最大档时还有一档原宽度变体
+            paths += [entry.path for entry in os.scandir(self.variant_dir) if entry.name.startswith(stem + '_')]
+        for path in set(paths):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"[Images] Failed to remove {path}: {e}")
+        self._manifests.pop(filename, None)
+        return True
+
+    # ---- 后台处理 ----
+    @classmethod
+    def _is_raster(cls, filename):
+        return filename.rsplit('.', 1)[-1].lower() in cls.RASTER_EXTENSIONS if '.' in filename else False
+
+    def _variant_name(self, filename, width):
+        return f'{os.path.splitext(filename)[0]}_{width}.webp'
+
+    def _manifest_path(self, filename):
+        return os.path.join(self.variant_dir, f'{os.path.splitext(filename)[0]}.json')
+
+    def process(self, filename):
+        """生成 WebP 变体并写入清单（已存在的跳过），返回清单 {'width', 'height', 'widths'}。"""
+        from PIL import Image, ImageOps
+        source = os.path.join(self.image_dir, filename)
+        if not self._is_raster(filename) or not os.path.exists(source):
+            return None
+        os.makedirs(self.variant_dir, exist_ok=True)
+        with Image.open(source) as image:
+            image = ImageOps.exif_transpose(image)
+            if image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'P') else 'RGB')
+            # 小于原图的各档，再加一档原图宽度（不超过最大档），不放大
+            widths = sorted({w for w in self.WIDTHS if w < image.width} | {min(image.width, self.WIDTHS[-1])})
+            for width in widths:
+                path = os.path.join(self.variant_dir, self._variant_name(filename, width))
+                if os.path.exists(path):
+                    continue
+                resized = image
+                if image.width > width:
+                    resized = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+                tmp_path = path + '.part'
+                resized.save(tmp_path, 'WEBP', quality=self.WEBP_QUALITY, method=4)
+                os.replace(tmp_path, path)
+            manifest = {'width': image.width, 'height': image.height, 'widths': widths}
+        # 清单最后写入，存在即表示全部变体可用
+        tmp_path = self._manifest_path(filename) + '.part'
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self._manifest_path(filename))
+        print(f"[Images] Processed {filename}: {widths}")
+        return manifest
+
+    def process_all(self):
+        """为已有的全部图片补生成变体（flask process-images），返回处理的图片数。"""
+        if not os.path.isdir(self.image_dir):
+            return 0
+        count = 0
+        for entry in os.scandir(self.image_dir):
+            if entry.is_file() and self._is_raster(entry.name) and not self.has_variants(entry.name):
+                try:
+                    self.process(entry.name)
+                    count += 1
+                except Exception as e:
+                    print(f"[Images] Failed to process {entry.name}: {e}")
+        return count
+
+    # ---- 模板 ----
+    def manifest(self, filename):
+        """读取变体清单；文件名即内容哈希，清单生成后不再变化，进程内缓存。"""
+        cached = self._manifests.get(filename)
+        if cached is not None:
+            return cached
+        try:
+            with open(self._manifest_path(filename)) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        self._manifests[filename] = manifest
+        return manifest
+
+    def has_variants(self, filename):
+        return self.manifest(filename) is not None
+
+    def image_set(self, filename, url_for):
+        """
+        返回 {'src', 'srcset', 'thumb', 'original', 'width', 'height'}；
+        url_for(path) 生成 uploads/images 下文件的地址。未处理完的图片只有原图地址。
+        """
+        original = url_for(filename)
+        manifest = self.manifest(filename) if self._is_raster(filename) else None
+        if not manifest:
+            return {'src': original, 'srcset': '', 'thumb': original, 'original': original,
+                    'width': None, 'height': None}
+        urls = {w: url_for(f'{self.VARIANT_DIR}/{self._variant_name(filename, w)}') for w in manifest['widths']}
+        widths = sorted(urls)
+        return {
+            'src': urls[widths[-1]],
+            'srcset': ', '.join(f'{urls[w]} {w}w' for w in widths),
+            'thumb': urls[widths[0]],
+            'original': original,
+            'width': manifest['width'],
+            'height': manifest['height'],
+        }
@@ -0,0 +1,117 @@
+from sqlalchemy.orm import joinedload
+from web.models import db, Topic, Post, ForumNotification
+
+
+class InboxService:
+    """
+    论坛回复通知收件箱（写时扩散）：
+      - 回复发布时为主题作者、被回复者和主题的其他参与者各写一行 ForumNotification，
+        读取时只按 (user_id, id) 索引翻页，不再扫描整张 Post 表
+      - 参与者较多的大主题交给 celery 扩散，失败或无 worker 时退回同步写入；
+        (user_id, post_id) 唯一，任务重复投递不会重复通知
+      - 未读数缓存在 Redis（forum:inbox:unread:<user_id>），通知写入或标记已读时失效，
+        下次读取按 (user_id, is_read) 索引重新计数
+    """
+    UNREAD_KEY_PREFIX = 'forum:inbox:unread:'
+    UNREAD_TTL = 86400
+    PER_PAGE = 20
+    INLINE_FANOUT_LIMIT = 50  # 回复数超过该值的主题改由 celery 扩散
+    INSERT_CHUNK = 1000
+
+    def __init__(self, redis_client=None):
+        self.redis = redis_client
+
+    # ---- 写入 ----
+    def dispatch(self, post_id, reply_count=0):
+        """回复提交后调用：小主题同步扩散，大主题投递 celery 任务。"""
+        if reply_count > self.INLINE_FANOUT_LIMIT:
+            try:
+                from web.tasks import fan_out_reply_task
+                fan_out_reply_task.delay(post_id)
+                return None
+            except Exception as e:
+                print(f"[Inbox] Failed to dispatch fan-out task for post {post_id}, running inline: {e}")
+        return self.fan_out(post_id)
+
+    def fan_out(self, post_id):
+        """为一条回复写入通知，返回新增行数；已存在的收件人跳过。"""
+        post = db.session.get(Post, post_id)
+        if post is None:
+            return 0
+        topic = db.session.get(Topic, post.topic_id)
+        # 参与者只取这条回复之前的发言者，任务延迟执行或重复投递时收件人不变
+        kinds = {user_id: ForumNotification.KIND_THREAD for (user_id,) in
+                 db.session.query(Post.user_id).filter(Post.topic_id == post.topic_id, Post.id < post.id).distinct()}
+        kinds[topic.user_id] = ForumNotification.KIND_TOPIC
+        if post.parent_id:
+            parent_user_id = db.session.query(Post.user_id).filter(Post.id == post.parent_id).scalar()
+            if parent_user_id:
+                kinds[parent_user_id] = ForumNotification.KIND_REPLY
+        kinds.pop(post.user_id, None)
+        existing = {user_id for (user_id,) in
+                    db.session.query(ForumNotification.user_id).filter(ForumNotification.post_id == post.id)}
+        rows = [{'user_id': user_id, 'actor_id': post.user_id, 'topic_id': post.topic_id, 'post_id': post.id,
+                 'kind': kind, 'is_read': False, 'created_at': post.created_at}
+                for user_id, kind in kinds.items() if user_id not in existing]
+        for i in range(0, len(rows), self.INSERT_CHUNK):
+            db.session.execute(ForumNotification.__table__.insert(), rows[i:i + self.INSERT_CHUNK])
+        db.session.commit()
+        self._invalidate([row['user_id'] for row in rows])
+        return len(rows)
+
+    def mark_read(self, user_id, ids=None):
+        """标记已读（ids 为空时全部），返回更新行数。"""
+        query = ForumNotification.query.filter(ForumNotification.user_id == user_id,
+                                               ForumNotification.is_read == False)
+        if ids is not None:
+            if not ids:
+                return 0
+            query = query.filter(ForumNotification.id.in_(ids))
+        count = query.update({ForumNotification.is_read: True}, synchronize_session=False)
+        db.session.commit()
+        if count:
+            self._invalidate([user_id])
+        return count
+
+    # ---- 读取 ----
+    def unread_count(self, user_id):
+        key = f'{self.UNREAD_KEY_PREFIX}{user_id}'
+        if self.redis:
+            try:
+                cached = self.redis.get(key)
+                if cached is not None:
+                    return int(cached)
+            except Exception as e:
+                print(f"[Inbox] Redis unavailable: {e}")
+        count = db.session.query(db.func.count(ForumNotification.id))\
+            .filter(ForumNotification.user_id == user_id, ForumNotification.is_read == False).scalar()
+        if self.redis:
+            try:
+                self.redis.setex(key, self.UNREAD_TTL, count)
+            except Exception:
+                pass
+        return count
+
+    def page(self, user_id, before=None, per_page=PER_PAGE):
+        """按 id 倒序的一页通知，返回 (通知列表, 下一页游标)；回复、主题与回复者一次联表加载。"""
+        query = ForumNotification.query.options(
+            joinedload(ForumNotification.actor), joinedload(ForumNotification.post),
+            joinedload(ForumNotification.topic)
+        ).join(Topic, ForumNotification.topic_id == Topic.id)\
+            .filter(ForumNotification.user_id == user_id, Topic.is_deleted == False)
+        if before:
+            try:
+                query = query.filter(ForumNotification.id < int(before))
+            except ValueError:
+                pass
+        rows = query.order_by(ForumNotification.id.desc()).limit(per_page + 1).all()
+        items = rows[:per_page]
+        return items, (items[-1].id if len(rows) > per_page else None)
+
+    def _invalidate(self, user_ids):
+        if not self.redis or not user_ids:
+            return
+        try:
+            self.redis.delete(*[f'{self.UNREAD_KEY_PREFIX}{user_id}' for user_id in user_ids])
+        except Exception as e:
+            print(f"[Inbox] Failed to invalidate unread counts: {e}")
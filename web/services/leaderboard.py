@@ -0,0 +1,207 @@
+from sqlalchemy import func
+from web.models import db, User, UserCategoryStat
+
+
+class LeaderboardService:
+    """
+    排行榜物化到 Redis 有序集合：
+      leaderboard:global          全站（按用户汇总所有类别）
+      leaderboard:cat:<类别>      单个类别
+    成员为 user_id，分值编码为 正确率(0.1%精度) * ATTEMPT_SPAN + 答题次数，
+    正确率相同时答题次数多者靠前。读取 Top K 为 O(log n + k)。
+    """
+    GLOBAL_KEY = 'leaderboard:global'
+    CATEGORY_KEY_PREFIX = 'leaderboard:cat:'
+    CATEGORIES_KEY = 'leaderboard:categories'
+    READY_KEY = 'leaderboard:ready'
+    REBUILD_LOCK_KEY = 'leaderboard:rebuild_lock'
+    ATTEMPT_SPAN = 10 ** 7
+
+    def __init__(self, redis_client):
+        self.redis = redis_client
+
+    @classmethod
+    def category_key(cls, category):
+        return cls.CATEGORY_KEY_PREFIX + category
+
+    @classmethod
+    def encode_score(cls, total_score, total_max, attempts):
+        accuracy = (total_score / total_max * 100) if total_max > 0 else 0
+        return int(round(accuracy, 1) * 10) * cls.ATTEMPT_SPAN + min(int(attempts or 0), cls.ATTEMPT_SPAN - 1)
+
+    @classmethod
+    def decode_score(cls, score):
+        score = int(score)
+        return score // cls.ATTEMPT_SPAN / 10, score % cls.ATTEMPT_SPAN
+
+    def is_ready(self):
+        if not self.redis:
+            return False
+        try:
+            return bool(self.redis.exists(self.READY_KEY))
+        except Exception as e:
+            print(f"[Leaderboard] Redis unavailable: {e}")
+            return False
+
+    def ensure_ready(self):
+        """冷启动：Redis 中尚无排行榜时重建一次（多进程下由锁保证只有一个进程执行）。"""
+        if not self.redis or self.is_ready():
+            return self.is_ready()
+        try:
+            if not self.redis.set(self.REBUILD_LOCK_KEY, 1, nx=True, ex=300):
+                return False
+            try:
+                self.rebuild()
+            finally:
+                self.redis.delete(self.REBUILD_LOCK_KEY)
+            return True
+        except Exception as e:
+            print(f"[Leaderboard] Rebuild failed: {e}")
+            return False
+
+    def rebuild(self):
+        """从 UserCategoryStat 全量重建所有排行榜，先写临时键再 RENAME，读者看不到半成品。"""
+        global_rows = db.session.query(
+            UserCategoryStat.user_id,
+            func.sum(UserCategoryStat.total_score),
+            func.sum(UserCategoryStat.total_max_score),
+            func.sum(UserCategoryStat.total_attempts)
+        ).group_by(UserCategoryStat.user_id).all()
+        category_rows = db.session.query(
+            UserCategoryStat.user_id,
+            UserCategoryStat.category,
+            UserCategoryStat.total_score,
+            UserCategoryStat.total_max_score,
+            UserCategoryStat.total_attempts
+        ).all()
+
+        staged = {}
+        staged[self.GLOBAL_KEY] = {
+            str(uid): self.encode_score(score or 0, total_max or 0, attempts)
+            for uid, score, total_max, attempts in global_rows if (total_max or 0) > 0
+        }
+        for uid, cat, score, total_max, attempts in category_rows:
+            if (total_max or 0) > 0:
+                staged.setdefault(self.category_key(cat), {})[str(uid)] = self.encode_score(score or 0, total_max, attempts)
+
+        old_keys = set(self.redis.smembers(self.CATEGORIES_KEY) or [])
+        pipe = self.redis.pipeline()
+        categories = []
+        for key, members in staged.items():
+            tmp_key = key + ':rebuild'
+            pipe.delete(tmp_key)
+            items = list(members.items())
+            for i in range(0, len(items), 1000):
+                pipe.zadd(tmp_key, dict(items[i:i + 1000]))
+            if members:
+                pipe.rename(tmp_key, key)
+            else:
+                pipe.delete(key)
+            if key != self.GLOBAL_KEY:
+                categories.append(key[len(self.CATEGORY_KEY_PREFIX):])
+        for cat in old_keys - set(categories):
+            pipe.delete(self.category_key(cat))
+        pipe.delete(self.CATEGORIES_KEY)
+        if categories:
+            pipe.sadd(self.CATEGORIES_KEY, *categories)
+        pipe.set(self.READY_KEY, 1)
+        pipe.execute()
+        print(f"[Leaderboard] Rebuilt {len(staged.get(self.GLOBAL_KEY, {}))} users, {len(categories)} categories")
+
+    def update_user(self, user_id, categories=None):
+        """
+        成绩入库后增量更新：只读取该用户自己的统计行（按用户索引，行数为类别数）。
+        categories 为本次涉及的类别，None 表示该用户的全部类别。
+        """
+        if not self.redis or not user_id:
+            return
+        try:
+            stats = UserCategoryStat.query.filter_by(user_id=user_id).all()
+            total_score = sum(s.total_score or 0 for s in stats)
+            total_max = sum(s.total_max_score or 0 for s in stats)
+            attempts = sum(s.total_attempts or 0 for s in stats)
+            member = str(user_id)
+            pipe = self.redis.pipeline()
+            if total_max > 0:
+                pipe.zadd(self.GLOBAL_KEY, {member: self.encode_score(total_score, total_max, attempts)})
+            else:
+                pipe.zrem(self.GLOBAL_KEY, member)
+            wanted = set(categories) if categories is not None else None
+            for s in stats:
+                if wanted is not None and s.category not in wanted:
+                    continue
+                key = self.category_key(s.category)
+                if (s.total_max_score or 0) > 0:
+                    pipe.zadd(key, {member: self.encode_score(s.total_score or 0, s.total_max_score, s.total_attempts)})
+                    pipe.sadd(self.CATEGORIES_KEY, s.category)
+                else:
+                    pipe.zrem(key, member)
+            pipe.execute()
+        except Exception as e:
+            print(f"[Leaderboard] Update failed for user {user_id}: {e}")
+
+    def remove_user(self, user_id):
+        if not self.redis:
+            return
+        try:
+            member = str(user_id)
+            pipe = self.redis.pipeline()
+            pipe.zrem(self.GLOBAL_KEY, member)
+            for cat in self.redis.smembers(self.CATEGORIES_KEY) or []:
+                pipe.zrem(self.category_key(cat), member)
+            pipe.execute()
+        except Exception as e:
+            print(f"[Leaderboard] Remove failed for user {user_id}: {e}")
+
+    def get_rank(self, user_id, category=None):
+        """
+        ZSCORE + ZCOUNT，O(log n)。未上榜返回 None。
+        排名为分数严格更高的人数 + 1，同分同名次，与 SQL 回退路径的 RANK() 一致。
+        """
+        key = self.category_key(category) if category else self.GLOBAL_KEY
+        pipe = self.redis.pipeline()
+        pipe.zscore(key, str(user_id))
+        pipe.zcard(key)
+        score, total = pipe.execute()
+        if score is None or not total:
+            return None
+        rank = self.redis.zcount(key, f'({int(score)}', '+inf') + 1
+        return {'rank': rank, 'total': total, 'percentile': round((total - rank) / total * 100, 1)}
+
+    def get_leaderboard_data(self, categories, global_limit=10, category_limit=50):
+        """读取 Top K，与 DataManager.get_leaderboard_data 返回结构一致。"""
+        pipe = self.redis.pipeline()
+        pipe.zrevrange(self.GLOBAL_KEY, 0, global_limit - 1, withscores=True)
+        for cat in categories:
+            pipe.zrevrange(self.category_key(cat), 0, category_limit - 1, withscores=True)
+        ranges = pipe.execute()
+
+        user_ids = {int(uid) for entries in ranges for uid, _ in entries}
+        users = {u.id: u for u in User.query.filter(User.id.in_(user_ids)).all()} if user_ids else {}
+
+        def build(entries, attempts_key):
+            rows = []
+            for uid, score in entries:
+                user = users.get(int(uid))
+                if not user:
+                    continue
+                accuracy, attempts = self.decode_score(score)
+                rows.append({
+                    'user_id': user.id,
+                    'username': user.username,
+                    'stardust': user.stardust,
+                    'level_info': user.level_info,
+                    'accuracy': accuracy,
+                    attempts_key: attempts
+                })
+            return rows
+
+        category_leaderboards = {}
+        for cat, entries in zip(categories, ranges[1:]):
+            rows = build(entries, 'attempts')
+            if rows:
+                category_leaderboards[cat] = rows
+        return {
+            'global': build(ranges[0], 'total_exams'),
+            'categories': category_leaderboards
+        }
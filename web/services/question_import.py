@@ -0,0 +1,236 @@
+import csv
+import json
+import os
+import zipfile
+from sqlalchemy import func
+from web.models import db, Question, SystemCounter
+from web.services.search import SearchService
+from web.services.images import ImageService
+from web.utils.question_bank import iter_questions_txt, DEFAULT_CATEGORY
+
+
+class QuestionImportService:
+    """
+    题目批量导入：
+      - 流式解析 CSV（表头 content/answer/score/image/category，或 题目/答案/分值/图片/类别）、
+        JSONL（每行一个对象，键同 CSV）以及旧版管道格式 questions.txt
+      - 逐行校验，错误按行号记录，不影响其余行
+      - 按规范化题干的 SHA-256 去重（对已有题目与文件内重复行都生效）
+      - 图片可随 zip 包上传，按文件名匹配（按内容哈希去重保存并投递缩放任务）；
+        未在 zip 中的图片名须已存在于 uploads/images
+      - 每 batch_size 行一次 Core 批量 INSERT 并提交；Core 插入绕过 after_flush 钩子，
+        SystemCounter 在同一事务内手动累加
+    questions.txt / 二进制题库只在全部导入完成后导出一次。
+    """
+    FORMATS = ('csv', 'jsonl', 'txt')
+    BATCH_SIZE = 500
+    MAX_ERRORS = 200  # 报告中保留的错误行数上限
+    IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp', 'svg', 'tiff'}
+    HEADER_ALIASES = {'题目': 'content', '答案': 'answer', '分值': 'score', '图片': 'image', '类别': 'category'}
+
+    def __init__(self, data_manager, upload_folder, batch_size=BATCH_SIZE):
+        self.data_manager = data_manager
+        self.images = ImageService(upload_folder)
+        self.image_dir = self.images.image_dir
+        self.batch_size = batch_size
+
+    @classmethod
+    def detect_format(cls, filename):
+        ext = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+        if ext in ('jsonl', 'ndjson'):
+            return 'jsonl'
+        if ext in cls.FORMATS:
+            return ext
+        return None
+
+    def _iter_csv(self, path):
+        with open(path, encoding='utf-8-sig', newline='') as f:
+            reader = csv.DictReader(f)
+            reader.fieldnames = [self.HEADER_ALIASES.get((h or '').strip(), (h or '').strip().lower())
+                                 for h in (reader.fieldnames or [])]
+            if 'content' not in reader.fieldnames or 'answer' not in reader.fieldnames:
+                yield 1, None, '表头缺少 content / answer 列'
+                return
+            for row in reader:
+                yield reader.line_num, row, None
+
+    def _iter_jsonl(self, path):
+        with open(path, encoding='utf-8-sig') as f:
+            for line_no, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError as e:
+                    yield line_no, None, f'JSON 格式错误: {e}'
+                    continue
+                if not isinstance(row, dict):
+                    yield line_no, None, '每行应为一个 JSON 对象'
+                    continue
+                yield line_no, row, None
+
+    def iter_rows(self, path, fmt):
+        if fmt == 'csv':
+            return self._iter_csv(path)
+        if fmt == 'jsonl':
+            return self._iter_jsonl(path)
+        return iter_questions_txt(path)
+
+    def _validate(self, row):
+        """返回 (规范化后的行, 错误信息)。"""
+        content = str(row.get('content') or '').strip()
+        answer = str(row.get('answer') or '').strip()
+        if not content:
+            return None, '题目内容为空'
+        if not answer:
+            return None, '答案为空'
+        if len(answer) > 500:
+            return None, '答案超过 500 个字符'
+        score = row.get('score')
+        try:
+            score = int(score) if score not in (None, '') else 10
+        except (TypeError, ValueError):
+            return None, f'分值格式错误: {score}'
+        if score <= 0:
+            return None, f'分值必须为正整数: {score}'
+        category = str(row.get('category') or '').strip() or DEFAULT_CATEGORY
+        if len(category) > 100:
+            return None, '类别名称超过 100 个字符'
+        image = str(row.get('image') or '').strip() or None
+        return {'content': content, 'answer': answer, 'score': score, 'category': category, 'image': image}, None
+
+    def _resolve_image(self, name, archive, saved):
+        """把行中的图片名解析为 uploads/images 下的文件名，返回 (文件名, 错误信息)。"""
+        if name in saved:
+            return saved[name], None
+        if archive is not None:
+            member = archive.get(os.path.basename(name).lower())
+            if member is not None:
+                ext = member.filename.rsplit('.', 1)[-1].lower() if '.' in member.filename else ''
+                if ext not in self.IMAGE_EXTENSIONS:
+                    return None, f'不支持的图片格式: {name}'
+                with archive.zip.open(member) as src:
+                    filename = self.images.save_stream(src, f'.{ext}')
+                self.images.enqueue(filename)
+                saved[name] = filename
+                return filename, None
+        if os.path.basename(name) == name and os.path.exists(os.path.join(self.image_dir, name)):
+            saved[name] = name
+            return name, None
+        return None, f'图片不存在: {name}'
+
+    def _flush(self, rows):
+        if not rows:
+            return
+        last_id = db.session.query(func.max(Question.id)).scalar() or 0
+        db.session.execute(Question.__table__.insert(), rows)
+        SystemCounter.apply(db.session.connection(), {SystemCounter.QUESTIONS: len(rows)})
+        # Core 插入不经过 track_search_documents，按 id 补写搜索索引
+        SearchService().index_range(SearchService.QUESTION, after_id=last_id)
+        db.session.commit()
+
+    def run(self, path, fmt, zip_path=None, owner_id=None, default_category=None, on_progress=None):
+        """
+        导入题目文件；owner_id 为空时导入为公共题目，否则为该用户的个人题目。
+        返回 {'total', 'imported', 'duplicates', 'failed', 'errors': [{'line', 'error'}]}。
+        """
+        report = {'total': 0, 'imported': 0, 'duplicates': 0, 'failed': 0, 'errors': []}
+
+        def fail(line_no, error):
+            report['failed'] += 1
+            if len(report['errors']) < self.MAX_ERRORS:
+                report['errors'].append({'line': line_no, 'error': error})
+
+        archive = None
+        zf = None
+        if zip_path:
+            try:
+                zf = zipfile.ZipFile(zip_path)
+            except zipfile.BadZipFile:
+                fail(0, '图片压缩包无法读取，已忽略')
+            else:
+                archive = _ZipIndex(zf)
+
+        scope = Question.query.filter_by(type='personal', owner_id=owner_id) if owner_id else Question.query.filter_by(type='public')
+        seen = set()
+        saved_images = {}
+        pending = []
+        pending_hashes = {}
+
+        def flush():
+            # 批内题干一次 IN 查询比对已有题目
+            existing = {h for (h,) in scope.with_entities(Question.content_hash)
+                        .filter(Question.content_hash.in_(list(pending_hashes)))} if pending_hashes else set()
+            rows = []
+            for item in pending:
+                if item['content_hash'] in existing:
+                    report['duplicates'] += 1
+                    continue
+                image_name = item.pop('_image')
+                line_no = item.pop('_line')
+                if image_name:
+                    image, error = self._resolve_image(image_name, archive, saved_images)
+                    if error:
+                        fail(line_no, error)
+                        continue
+                    item['image'] = image
+                rows.append(item)
+            self._flush(rows)
+            report['imported'] += len(rows)
+            pending.clear()
+            pending_hashes.clear()
+            if on_progress:
+                on_progress(report)
+
+        try:
+            for line_no, row, error in self.iter_rows(path, fmt):
+                report['total'] += 1
+                if error:
+                    fail(line_no, error)
+                    continue
+                if not str(row.get('category') or '').strip():
+                    row['category'] = default_category or DEFAULT_CATEGORY
+                item, error = self._validate(row)
+                if error:
+                    fail(line_no, error)
+                    continue
+                content_hash = Question.hash_content(item['content'])
+                if content_hash in seen:
+                    report['duplicates'] += 1
+                    continue
+                seen.add(content_hash)
+                pending.append({
+                    'content': item['content'], 'answer': item['answer'], 'score': item['score'],
+                    'category': item['category'], 'image': None, 'mode': 'html',
+                    'type': 'personal' if owner_id else 'public', 'owner_id': owner_id,
+                    'version': 1, 'content_hash': content_hash,
+                    '_image': item['image'], '_line': line_no
+                })
+                pending_hashes[content_hash] = True
+                if len(pending) >= self.batch_size:
+                    flush()
+            flush()
+        except UnicodeDecodeError:
+            db.session.rollback()
+            fail(0, '文件编码不是 UTF-8，已停止导入')
+        finally:
+            if zf is not None:
+                zf.close()
+
+        if report['imported']:
+            self.data_manager.export_questions_to_txt()
+        print(f"[Import] {report['imported']} imported, {report['duplicates']} duplicates, {report['failed']} failed")
+        return report
+
+
+class _ZipIndex:
+    """按小写文件名（不含目录）索引 zip 成员。"""
+    def __init__(self, zf):
+        self.zip = zf
+        self.members = {}
+        for info in zf.infolist():
+            if not info.is_dir():
+                self.members.setdefault(os.path.basename(info.filename).lower(), info)
+
+    def get(self, name):
+        return self.members.get(name)
@@ -0,0 +1,73 @@
+from sqlalchemy import select, not_, func
+from sqlalchemy.exc import IntegrityError
+from web.models import db, Topic, Post, TopicLike, PostLike
+
+
+class ForumActionService:
+    """
+    论坛点赞 / 置顶 / 锁定的原子操作，供 JSON 接口与旧的表单接口共用：
+      - 点赞：INSERT ... ON CONFLICT DO NOTHING 或 DELETE，按实际影响的行数增减冗余计数，
+        重复点击、并发请求都不会把计数加错
+      - Core 语句绕过 track_forum_counters，计数在同一事务内手动更新
+      - 置顶 / 锁定：单条 UPDATE ... SET x = NOT x，不改动 updated_at
+    所有方法在返回前提交事务。
+    """
+
+    @staticmethod
+    def _insert_ignore(table, values):
+        """插入一行，主键冲突时忽略；返回是否实际插入。"""
+        dialect = db.engine.dialect.name
+        if dialect in ('sqlite', 'postgresql'):
+            if dialect == 'sqlite':
+                from sqlalchemy.dialects.sqlite import insert
+            else:
+                from sqlalchemy.dialects.postgresql import insert
+            return db.session.execute(insert(table).values(**values).on_conflict_do_nothing()).rowcount > 0
+        try:
+            with db.session.begin_nested():
+                db.session.execute(table.insert().values(**values))
+            return True
+        except IntegrityError:
+            return False
+
+    def _set_like(self, like_table, key, target_table, target_id, user_id, liked):
+        """liked 为 None 时切换；返回 (点赞后状态, 最新计数)。"""
+        where = [like_table.c.user_id == user_id, like_table.c[key] == target_id]
+        if liked is None:
+            liked = db.session.execute(select(like_table.c.user_id).where(*where)).first() is None
+        if liked:
+            changed = self._insert_ignore(like_table, {'user_id': user_id, key: target_id})
+            delta = 1 if changed else 0
+        else:
+            changed = db.session.execute(like_table.delete().where(*where)).rowcount > 0
+            delta = -1 if changed else 0
+        if delta:
+            values = {'like_count': func.coalesce(target_table.c.like_count, 0) + delta}
+            if 'updated_at' in target_table.c:
+                values['updated_at'] = target_table.c.updated_at
+            db.session.execute(target_table.update().where(target_table.c.id == target_id).values(**values))
+        count = db.session.execute(select(target_table.c.like_count).where(target_table.c.id == target_id)).scalar()
+        return liked, count or 0, bool(delta)
+
+    def like_topic(self, user_id, topic_id, liked=None):
+        liked, count, changed = self._set_like(TopicLike.__table__, 'topic_id', Topic.__table__, topic_id, user_id, liked)
+        if changed:
+            from web.services.hotness import HotnessService
+            HotnessService().bump(topic_id)
+        db.session.commit()
+        return {'liked': liked, 'count': count}
+
+    def like_post(self, user_id, post_id, liked=None):
+        liked, count, _ = self._set_like(PostLike.__table__, 'post_id', Post.__table__, post_id, user_id, liked)
+        db.session.commit()
+        return {'liked': liked, 'count': count}
+
+    def toggle_flag(self, topic_id, flag):
+        """切换 is_pinned / is_locked，返回新状态。"""
+        topics = Topic.__table__
+        column = topics.c[flag]
+        db.session.execute(topics.update().where(topics.c.id == topic_id)
+                           .values({column: not_(func.coalesce(column, False)), topics.c.updated_at: topics.c.updated_at}))
+        value = db.session.execute(select(column).where(topics.c.id == topic_id)).scalar()
+        db.session.commit()
+        return bool(value)
@@ -0,0 +1,166 @@
+import json
+from datetime import datetime
+from sqlalchemy import bindparam, or_
+from web.models import db, ExamAnswer, ExamResult, Question, SystemSetting, UserCategoryStat, UserDashboard
+
+
+class RegradeService:
+    """
+    修改标准答案 / 分值后的历史成绩重新阅卷：
+      - 只处理该题且评分版本低于当前版本的 exam_answer 行，按 id 分块
+      - 每块从 details 取出原始作答，调用 C 批量评分接口一次评完
+      - 分数差批量写回 exam_answer，并同步到 ExamResult 总分（SystemCounter 由 after_flush 钩子跟进）、
+        UserCategoryStat（按用户 + 类别聚合后 executemany UPDATE）、排行榜与看板
+    进度记录在 SystemSetting 'regrade:<题目 id>'，每块单独提交；已处理的行版本号已更新，
+    中断后重新运行会自然从断点继续。运行中题目再次被修改时本次任务放弃，由新版本的任务接手。
+    """
+    KEY_PREFIX = 'regrade:'
+    CHUNK_SIZE = 500
+
+    def __init__(self, grader, leaderboard=None, chunk_size=CHUNK_SIZE):
+        self.grader = grader
+        self.leaderboard = leaderboard
+        self.chunk_size = chunk_size
+
+    @classmethod
+    def progress_key(cls, question_id):
+        return f'{cls.KEY_PREFIX}{question_id}'
+
+    def get_progress(self, question_id):
+        setting = db.session.get(SystemSetting, self.progress_key(question_id))
+        return json.loads(setting.value) if setting and setting.value else None
+
+    def get_progress_many(self, question_ids):
+        """管理页展示用：{题目 id: 进度}。"""
+        keys = [self.progress_key(qid) for qid in question_ids]
+        if not keys:
+            return {}
+        settings = SystemSetting.query.filter(SystemSetting.key.in_(keys)).all()
+        return {int(s.key[len(self.KEY_PREFIX):]): json.loads(s.value) for s in settings if s.value}
+
+    def _save_progress(self, question_id, progress):
+        key = self.progress_key(question_id)
+        setting = db.session.get(SystemSetting, key)
+        if setting is None:
+            setting = SystemSetting(key=key)
+            db.session.add(setting)
+        progress['updated_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        setting.value = json.dumps(progress)
+
+    def _pending(self, question_id, version):
+        return db.session.query(
+            ExamAnswer.id, ExamAnswer.result_id, ExamAnswer.position,
+            ExamAnswer.category, ExamAnswer.score, ExamAnswer.full_score, ExamAnswer.answer
+        ).filter(
+            ExamAnswer.question_id == question_id,
+            or_(ExamAnswer.question_version.is_(None), ExamAnswer.question_version < version)
+        )
+
+    def run(self, question_id, version, on_progress=None):
+        """重新评分 question_id 在 version 之前评分的全部作答，返回最终进度字典。"""
+        question = db.session.get(Question, question_id)
+        if question is None or (question.version or 1) != version:
+            print(f"[Regrade] Question {question_id} v{version} is missing or superseded, skipped")
+            return {'version': version, 'status': 'superseded'}
+
+        progress = self.get_progress(question_id)
+        if not progress or progress.get('version') != version:
+            progress = {'version': version, 'done': 0, 'changed': 0}
+        progress['status'] = 'running'
+        progress['total'] = progress['done'] + self._pending(question_id, version).count()
+        self._save_progress(question_id, progress)
+        db.session.commit()
+
+        last_id = 0
+        while True:
+            # 每块开始前确认题目没有再次被修改（commit 后属性已过期，会重新读取）
+            if (question.version or 1) != version:
+                progress['status'] = 'superseded'
+                break
+            rows = self._pending(question_id, version).filter(ExamAnswer.id > last_id)\
+                .order_by(ExamAnswer.id).limit(self.chunk_size).all()
+            if not rows:
+                progress['status'] = 'done'
+                break
+            changed, users = self._regrade_chunk(question, version, rows)
+            last_id = rows[-1].id
+            progress['done'] += len(rows)
+            progress['changed'] += changed
+            self._save_progress(question_id, progress)
+            db.session.commit()
+            if self.leaderboard:
+                for user_id in users:
+                    self.leaderboard.update_user(user_id)
+            if on_progress:
+                on_progress(progress)
+
+        self._save_progress(question_id, progress)
+        db.session.commit()
+        print(f"[Regrade] Question {question_id} v{version}: {progress['done']} answers, "
+              f"{progress['changed']} changed ({progress['status']})")
+        return progress
+
+    def _regrade_chunk(self, question, version, rows):
+        """评一块作答并写回分数差，返回 (分数变化的作答数, 受影响的用户集合)。"""
+        results = {r.id: r for r in ExamResult.query.filter(ExamResult.id.in_({row.result_id for row in rows})).all()}
+        details = {rid: r.details for rid, r in results.items()}
+
+        entries = []
+        for row in rows:
+            items = details.get(row.result_id) or []
+            entry = items[row.position] if 0 <= (row.position or 0) < len(items) else None
+            if not isinstance(entry, dict) or str(entry.get('id')) != str(question.id):
+                entry = None
+            # 缺少原始作答时退回 exam_answer 中规范化后的作答
+            entries.append((row, entry, str(entry.get('user_ans') or '') if entry else (row.answer or '')))
+
+        full_score = question.score or 0
+        scores = self.grader.grade_batch([ans for _, _, ans in entries], question.answer, full_score)
+
+        answer_updates = []
+        stat_deltas = {}
+        touched = set()
+        changed = 0
+        for (row, entry, _), score in zip(entries, scores):
+            score_delta = score - (row.score or 0)
+            full_delta = full_score - (row.full_score or 0)
+            answer_updates.append({'b_id': row.id, 'b_score': score, 'b_full': full_score, 'b_version': version})
+            if entry is not None:
+                entry.update({'score': score, 'full_score': full_score, 'correct_ans': question.answer, 'version': version})
+                touched.add(row.result_id)
+            if not score_delta and not full_delta:
+                continue
+            changed += 1
+            result = results.get(row.result_id)
+            if result is None:
+                continue
+            result.total_score = (result.total_score or 0) + score_delta
+            result.max_score = (result.max_score or 0) + full_delta
+            if result.user_id:
+                key = (result.user_id, row.category or '默认题集')
+                delta = stat_deltas.setdefault(key, [0, 0])
+                delta[0] += score_delta
+                delta[1] += full_delta
+
+        for rid in touched:
+            results[rid].details = details[rid]
+
+        answers = ExamAnswer.__table__
+        db.session.execute(
+            answers.update().where(answers.c.id == bindparam('b_id')).values(
+                score=bindparam('b_score'), full_score=bindparam('b_full'), question_version=bindparam('b_version')),
+            answer_updates
+        )
+        if stat_deltas:
+            stats = UserCategoryStat.__table__
+            db.session.execute(
+                stats.update().where(stats.c.user_id == bindparam('b_user'), stats.c.category == bindparam('b_category'))
+                .values(total_score=stats.c.total_score + bindparam('b_score'),
+                        total_max_score=stats.c.total_max_score + bindparam('b_max')),
+                [{'b_user': u, 'b_category': c, 'b_score': s, 'b_max': m} for (u, c), (s, m) in stat_deltas.items()]
+            )
+        users = {u for u, _ in stat_deltas}
+        if users:
+            # 看板的趋势与错题由下次读取时重建
+            UserDashboard.query.filter(UserDashboard.user_id.in_(users)).delete(synchronize_session=False)
+        return changed, users
@@ -0,0 +1,238 @@
+from datetime import datetime, timedelta
+from sqlalchemy import func, select, union
+from web.models import db, ExamResult, Post, Topic, TopicView, StardustHistory, SystemSetting, UsageRollup
+
+
+class RollupService:
+    """
+    管理员分析用的时间分桶汇总：
+      hour  每小时一行（category 为 '' 的全站行 + 每个类别一行）
+      day   每天一行，可加和指标由小时行汇总，活跃用户数按天从原始表去重
+    水位线（SystemSetting 'rollup:watermark'）记录已处理到的小时，
+    每个小时桶单独提交，首次运行从最早的数据开始分块回填，中断后可继续。
+
+    注意：ExamResult.timestamp 为本地时间字符串，论坛等表为 utcnow，
+    容器内时区为 UTC 时两者一致。
+    """
+    WATERMARK_KEY = 'rollup:watermark'
+    HOUR = 'hour'
+    DAY = 'day'
+    GLOBAL = ''
+    TS_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+    def get_watermark(self):
+        setting = db.session.get(SystemSetting, self.WATERMARK_KEY)
+        return datetime.strptime(setting.value, self.TS_FORMAT) if setting and setting.value else None
+
+    def _set_watermark(self, ts):
+        setting = db.session.get(SystemSetting, self.WATERMARK_KEY)
+        if setting is None:
+            setting = SystemSetting(key=self.WATERMARK_KEY)
+            db.session.add(setting)
+        setting.value = ts.strftime(self.TS_FORMAT)
+
+    def _parse_exam_ts(self, value):
+        try:
+            return datetime.strptime(value[:19], self.TS_FORMAT) if value else None
+        except ValueError:
+            return None
+
+    def _next_activity(self, after=None):
+        """各原始表中不早于 after 的最早时间（均走 created_at / timestamp 索引），无数据返回 None。"""
+        candidates = []
+        exam_query = db.session.query(func.min(ExamResult.timestamp))
+        if after:
+            exam_query = exam_query.filter(ExamResult.timestamp >= after.strftime(self.TS_FORMAT))
+        first_exam = self._parse_exam_ts(exam_query.scalar())
+        if first_exam:
+            candidates.append(first_exam)
+        for column in (Topic.created_at, Post.created_at, TopicView.created_at, StardustHistory.created_at):
+            query = db.session.query(func.min(column))
+            if after:
+                query = query.filter(column >= after)
+            value = query.scalar()
+            if value:
+                candidates.append(value)
+        return min(candidates) if candidates else None
+
+    def run(self, now=None, max_hours=24 * 7):
+        """
+        处理从水位线到最近一个完整小时之间的小时桶，单次最多 max_hours 个，
+        返回本次处理的桶数（等于 max_hours 说明还有待回填的历史）。
+        没有任何数据的时间段直接跳到下一条数据所在的小时，稀疏的历史也能快速回填。
+        """
+        end = (now or datetime.now()).replace(minute=0, second=0, microsecond=0)
+        bucket = self.get_watermark()
+        if bucket is None:
+            first = self._next_activity()
+            bucket = min(first.replace(hour=0, minute=0, second=0, microsecond=0), end) if first else end
+            self._set_watermark(bucket)
+            db.session.commit()
+
+        processed = 0
+        while bucket < end and processed < max_hours:
+            next_bucket = bucket + timedelta(hours=1)
+            if not self._rollup_hour(bucket):
+                upcoming = self._next_activity(next_bucket)
+                upcoming = upcoming.replace(minute=0, second=0, microsecond=0) if upcoming else end
+                next_bucket = max(next_bucket, min(upcoming, end))
+            day = bucket.replace(hour=0)
+            if next_bucket >= day + timedelta(days=1):
+                self._rollup_day(day)
+            bucket = next_bucket
+            processed += 1
+            self._set_watermark(bucket)
+            db.session.commit()
+
+        if processed and bucket.hour != 0:
+            # 当天尚未结束，先用已完成的小时刷新日汇总
+            self._rollup_day(bucket.replace(hour=0))
+            db.session.commit()
+        if processed:
+            print(f"[Rollup] Processed {processed} buckets, watermark {bucket}")
+        return processed
+
+    def reset(self):
+        """清空汇总与水位线，下次运行时从头回填。"""
+        UsageRollup.query.delete()
+        setting = db.session.get(SystemSetting, self.WATERMARK_KEY)
+        if setting:
+            db.session.delete(setting)
+        db.session.commit()
+
+    def _exam_filter(self, start, end):
+        return (ExamResult.timestamp >= start.strftime(self.TS_FORMAT),
+                ExamResult.timestamp < end.strftime(self.TS_FORMAT))
+
+    def _active_users(self, start, end):
+        """时间段内答题或发帖的去重用户数。"""
+        users = union(
+            select(ExamResult.user_id).where(*self._exam_filter(start, end), ExamResult.user_id.isnot(None)),
+            select(Topic.user_id).where(Topic.created_at >= start, Topic.created_at < end),
+            select(Post.user_id).where(Post.created_at >= start, Post.created_at < end)
+        ).subquery()
+        return db.session.execute(select(func.count()).select_from(users)).scalar() or 0
+
+    def _count(self, column, start, end):
+        return db.session.query(func.count()).filter(column >= start, column < end).scalar() or 0
+
+    def _write(self, granularity, bucket_start, rows):
+        UsageRollup.query.filter_by(granularity=granularity, bucket_start=bucket_start).delete()
+        for category, values in rows.items():
+            db.session.add(UsageRollup(granularity=granularity, bucket_start=bucket_start, category=category, **values))
+
+    def _rollup_hour(self, start):
+        end = start + timedelta(hours=1)
+        category = func.coalesce(ExamResult.category, '默认题集')
+        exam_rows = db.session.query(
+            category,
+            func.count(ExamResult.id),
+            func.sum(ExamResult.total_score),
+            func.sum(ExamResult.max_score),
+            func.count(func.distinct(ExamResult.user_id))
+        ).filter(*self._exam_filter(start, end)).group_by(category).all()
+
+        rows = {}
+        for cat, exams, score, max_score, users in exam_rows:
+            rows[cat or '默认题集'] = {'exams': exams, 'score_sum': score or 0,
+                                   'max_score_sum': max_score or 0, 'active_users': users}
+        rows[self.GLOBAL] = {
+            'exams': sum(r['exams'] for r in rows.values()),
+            'score_sum': sum(r['score_sum'] for r in rows.values()),
+            'max_score_sum': sum(r['max_score_sum'] for r in rows.values()),
+            'active_users': self._active_users(start, end),
+            'new_topics': self._count(Topic.created_at, start, end),
+            'new_posts': self._count(Post.created_at, start, end),
+            'views': self._count(TopicView.created_at, start, end),
+            'stardust': db.session.query(func.sum(StardustHistory.amount)).filter(
+                StardustHistory.created_at >= start, StardustHistory.created_at < end).scalar() or 0
+        }
+        has_activity = bool(exam_rows) or any(rows[self.GLOBAL].values())
+        self._write(self.HOUR, start, rows if has_activity else {})
+        return has_activity
+
+    def _rollup_day(self, start):
+        end = start + timedelta(days=1)
+        db.session.flush()
+        sums = db.session.query(
+            UsageRollup.category,
+            func.sum(UsageRollup.exams),
+            func.sum(UsageRollup.score_sum),
+            func.sum(UsageRollup.max_score_sum),
+            func.sum(UsageRollup.new_topics),
+            func.sum(UsageRollup.new_posts),
+            func.sum(UsageRollup.views),
+            func.sum(UsageRollup.stardust)
+        ).filter(UsageRollup.granularity == self.HOUR,
+                 UsageRollup.bucket_start >= start,
+                 UsageRollup.bucket_start < end).group_by(UsageRollup.category).all()
+
+        # 活跃用户数不可加和，按天从原始表去重
+        category = func.coalesce(ExamResult.category, '默认题集')
+        users_by_category = dict(db.session.query(category, func.count(func.distinct(ExamResult.user_id)))
+                                 .filter(*self._exam_filter(start, end)).group_by(category).all())
+
+        rows = {}
+        for cat, exams, score, max_score, topics, posts, views, stardust in sums:
+            rows[cat] = {
+                'exams': exams or 0, 'score_sum': score or 0, 'max_score_sum': max_score or 0,
+                'new_topics': topics or 0, 'new_posts': posts or 0, 'views': views or 0, 'stardust': stardust or 0,
+                'active_users': self._active_users(start, end) if cat == self.GLOBAL else users_by_category.get(cat, 0)
+            }
+        self._write(self.DAY, start, rows)
+
+    def get_dashboard(self, days=30, hours=48):
+        """分析页数据，只读汇总表。"""
+        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        since_day = today - timedelta(days=days - 1)
+        daily = UsageRollup.query.filter(
+            UsageRollup.granularity == self.DAY,
+            UsageRollup.category == self.GLOBAL,
+            UsageRollup.bucket_start >= since_day
+        ).order_by(UsageRollup.bucket_start).all()
+
+        since_hour = datetime.now().replace(minute=0, second=0, microsecond=0) - timedelta(hours=hours)
+        hourly = UsageRollup.query.filter(
+            UsageRollup.granularity == self.HOUR,
+            UsageRollup.category == self.GLOBAL,
+            UsageRollup.bucket_start >= since_hour
+        ).order_by(UsageRollup.bucket_start).all()
+
+        category_rows = db.session.query(
+            UsageRollup.category,
+            func.sum(UsageRollup.exams),
+            func.sum(UsageRollup.score_sum),
+            func.sum(UsageRollup.max_score_sum)
+        ).filter(
+            UsageRollup.granularity == self.DAY,
+            UsageRollup.category != self.GLOBAL,
+            UsageRollup.bucket_start >= since_day
+        ).group_by(UsageRollup.category).all()
+        categories = sorted((
+            {'category': cat, 'exams': exams or 0,
+             'accuracy': round((score or 0) / max_score * 100, 1) if max_score else 0}
+            for cat, exams, score, max_score in category_rows
+        ), key=lambda c: c['exams'], reverse=True)
+
+        # 没有数据的日期不写汇总行，这里补零得到连续序列
+        by_day = {r.bucket_start: r for r in daily}
+        daily_series = []
+        for i in range(days):
+            day = since_day + timedelta(days=i)
+            r = by_day.get(day) or UsageRollup(exams=0, score_sum=0, max_score_sum=0, active_users=0,
+                                                new_topics=0, new_posts=0, views=0, stardust=0)
+            daily_series.append({
+                'label': day.strftime('%m-%d'),
+                'exams': r.exams, 'accuracy': r.accuracy, 'active_users': r.active_users,
+                'new_topics': r.new_topics, 'new_posts': r.new_posts, 'views': r.views, 'stardust': r.stardust
+            })
+
+        return {
+            'daily': daily_series,
+            'hourly': [{
+                'label': r.bucket_start.strftime('%d日 %H:00'),
+                'exams': r.exams, 'active_users': r.active_users
+            } for r in hourly],
+            'categories': categories,
+            'watermark': self.get_watermark()
+        }
@@ -0,0 +1,184 @@
+from datetime import datetime
+from sqlalchemy import select, func, text, literal, literal_column, and_, inspect as sa_inspect
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.sql import table, column
+from web.models import db, Question, Topic, SearchDocument
+from web.utils.segmenter import Segmenter
+
+
+class SearchService:
+    """
+    题目与论坛主题的全文检索：
+      - 文档按 text_analyzer 词典分词后以空格拼接写入 search_document（写入时由
+        track_search_documents 增量同步，Core 批量导入调用 index_range）
+      - SQLite：FTS5 外部内容表 search_fts + 触发器，bm25 排序
+      - PostgreSQL：to_tsvector('simple') GIN 表达式索引，ts_rank 排序
+      - 其他数据库或 SQLite 未编译 FTS5 时退回对分词列的 LIKE 匹配（无相关度排序）
+    ranked() 返回 (doc_id, score) 子查询，由调用方连接到自己的查询上分页；类别 / 所有者等过滤须经
+    filters 传入，在截取 MAX_RESULTS 之前生效。
+    """
+    QUESTION = 'question'
+    TOPIC = 'topic'
+    TITLE_WEIGHT = 2.0  # 标题 / 分类命中的权重（正文为 1）
+    MAX_BODY_CHARS = 20000
+    MAX_RESULTS = 1000
+    CHUNK = 500
+
+    FTS_TABLE = 'search_fts'
+    _fts = table(FTS_TABLE, column('rowid'))
+    _fts_ready = {}  # engine url -> search_fts 是否可用
+
+    # ---- 结构 ----
+    @classmethod
+    def ensure_schema(cls):
+        """创建数据库相关的全文索引结构（幂等，启动时调用）。"""
+        engine = db.engine
+        if engine.dialect.name == 'sqlite':
+            created = cls.FTS_TABLE not in sa_inspect(engine).get_table_names()
+            try:
+                with engine.begin() as conn:
+                    conn.execute(text(
+                        f"CREATE VIRTUAL TABLE IF NOT EXISTS {cls.FTS_TABLE} USING fts5("
+                        "title_tokens, body_tokens, content='search_document', content_rowid='id')"))
+                    conn.execute(text(
+                        f"CREATE TRIGGER IF NOT EXISTS search_document_ai AFTER INSERT ON search_document BEGIN "
+                        f"INSERT INTO {cls.FTS_TABLE}(rowid, title_tokens, body_tokens) "
+                        "VALUES (new.id, new.title_tokens, new.body_tokens); END"))
+                    conn.execute(text(
+                        f"CREATE TRIGGER IF NOT EXISTS search_document_ad AFTER DELETE ON search_document BEGIN "
+                        f"INSERT INTO {cls.FTS_TABLE}({cls.FTS_TABLE}, rowid, title_tokens, body_tokens) "
+                        "VALUES ('delete', old.id, old.title_tokens, old.body_tokens); END"))
+                    conn.execute(text(
+                        f"CREATE TRIGGER IF NOT EXISTS search_document_au AFTER UPDATE ON search_document BEGIN "
+                        f"INSERT INTO {cls.FTS_TABLE}({cls.FTS_TABLE}, rowid, title_tokens, body_tokens) "
+                        "VALUES ('delete', old.id, old.title_tokens, old.body_tokens); "
+                        f"INSERT INTO {cls.FTS_TABLE}(rowid, title_tokens, body_tokens) "
+                        "VALUES (new.id, new.title_tokens, new.body_tokens); END"))
+                    if created:
+                        # 已有 search_document 数据时补建全文索引
+                        conn.execute(text(f"INSERT INTO {cls.FTS_TABLE}({cls.FTS_TABLE}) VALUES ('rebuild')"))
+                cls._fts_ready[str(engine.url)] = True
+            except OperationalError as e:
+                print(f"[Search] SQLite FTS5 unavailable, falling back to LIKE search: {e}")
+                cls._fts_ready[str(engine.url)] = False
+        elif engine.dialect.name == 'postgresql':
+            with engine.begin() as conn:
+                conn.execute(text(
+                    f"CREATE INDEX IF NOT EXISTS ix_search_document_tsv ON search_document USING gin (({cls._tsvector_sql()}))"))
+
+    @staticmethod
+    def _tsvector_sql():
+        return ("setweight(to_tsvector('simple', coalesce(title_tokens, '')), 'A') || "
+                "setweight(to_tsvector('simple', coalesce(body_tokens, '')), 'B')")
+
+    @classmethod
+    def _use_fts(cls):
+        engine = db.engine
+        key = str(engine.url)
+        if key not in cls._fts_ready:
+            cls._fts_ready[key] = cls.FTS_TABLE in sa_inspect(engine).get_table_names()
+        return cls._fts_ready[key]
+
+    # ---- 写入 ----
+    @classmethod
+    def _document(cls, doc_type, doc_id, title, body):
+        segmenter = Segmenter.get()
+        body = Segmenter.plain_text(body)[:cls.MAX_BODY_CHARS]
+        return {
+            'doc_type': doc_type, 'doc_id': doc_id,
+            'title_tokens': ' '.join(segmenter.index_tokens(title or '')),
+            'body_tokens': ' '.join(segmenter.index_tokens(body)),
+            'updated_at': datetime.utcnow(),
+        }
+
+    @classmethod
+    def _replace(cls, connection, doc_type, documents, removed_ids=()):
+        """先删后插（触发器同步 FTS），重复索引同一文档是安全的。"""
+        documents_table = SearchDocument.__table__
+        ids = [d['doc_id'] for d in documents] + list(removed_ids)
+        for i in range(0, len(ids), cls.CHUNK):
+            connection.execute(documents_table.delete().where(
+                documents_table.c.doc_type == doc_type, documents_table.c.doc_id.in_(ids[i:i + cls.CHUNK])))
+        for i in range(0, len(documents), cls.CHUNK):
+            connection.execute(documents_table.insert(), documents[i:i + cls.CHUNK])
+
+    @classmethod
+    def sync_objects(cls, connection, changed, removed):
+        """由 after_flush 监听器调用：按对象当前内容重建其索引行。"""
+        batches = {cls.QUESTION: ([], []), cls.TOPIC: ([], [])}
+        for obj in changed:
+            if isinstance(obj, Question):
+                batches[cls.QUESTION][0].append(cls._document(cls.QUESTION, obj.id, obj.category, obj.content))
+            elif obj.is_deleted:
+                batches[cls.TOPIC][1].append(obj.id)
+            else:
+                batches[cls.TOPIC][0].append(cls._document(cls.TOPIC, obj.id, obj.title, obj.content))
+        for obj in removed:
+            batches[cls.QUESTION if isinstance(obj, Question) else cls.TOPIC][1].append(obj.id)
+        for doc_type, (documents, removed_ids) in batches.items():
+            if documents or removed_ids:
+                cls._replace(connection, doc_type, documents, removed_ids)
+
+    def index_range(self, doc_type, after_id=0, commit=False):
+        """按 id 顺序索引 after_id 之后的全部文档（批量导入后与全量重建时使用），返回索引数。"""
+        if doc_type == self.QUESTION:
+            model, fields, filters = Question, (Question.category, Question.content), []
+        else:
+            model, fields, filters = Topic, (Topic.title, Topic.content), [Topic.is_deleted == False]
+        total = 0
+        while True:
+            rows = db.session.execute(select(model.id, *fields).where(model.id > after_id, *filters)
+                                      .order_by(model.id).limit(self.CHUNK)).all()
+            if not rows:
+                break
+            self._replace(db.session.connection(), doc_type,
+                          [self._document(doc_type, row[0], row[1], row[2]) for row in rows])
+            if commit:
+                db.session.commit()
+            total += len(rows)
+            after_id = rows[-1][0]
+        return total
+
+    def rebuild(self):
+        """清空并重建全部索引（首次升级与 flask rebuild-search-index 使用）。"""
+        db.session.execute(SearchDocument.__table__.delete())
+        counts = {doc_type: self.index_range(doc_type, commit=True) for doc_type in (self.QUESTION, self.TOPIC)}
+        db.session.commit()
+        print(f"[Search] Indexed {counts[self.QUESTION]} questions, {counts[self.TOPIC]} topics")
+        return counts
+
+    # ---- 查询 ----
+    def ranked(self, doc_type, q, filters=()):
+        """
+        返回列为 (doc_id, score) 的子查询，score 越大越相关；所有查询词都须命中，最多 MAX_RESULTS 条。
+        filters 为题目 / 主题表上的条件（如 Question.category == x），在子查询内连接原表过滤，
+        保证截取的是满足条件的最相关文档。查询分词后为空（全是停用词或标点）时返回 None。
+        """
+        tokens = Segmenter.get().query_tokens(q or '')
+        if not tokens:
+            return None
+        documents = SearchDocument.__table__
+        dialect = db.engine.dialect.name
+        if dialect == 'sqlite' and self._use_fts():
+            fts = literal_column(self.FTS_TABLE)
+            match = ' '.join('"' + token.replace('"', '""') + '"' for token in tokens)
+            query = select(documents.c.doc_id,
+                           (-func.bm25(fts, self.TITLE_WEIGHT, 1.0)).label('score'))\
+                .select_from(documents.join(self._fts, self._fts.c.rowid == documents.c.id))\
+                .where(fts.op('MATCH')(match), documents.c.doc_type == doc_type)
+        elif dialect == 'postgresql':
+            vector = literal_column(f'({self._tsvector_sql()})')
+            tsquery = func.plainto_tsquery(literal_column("'simple'"), ' '.join(tokens))
+            query = select(documents.c.doc_id, func.ts_rank(vector, tsquery).label('score'))\
+                .where(vector.op('@@')(tsquery), documents.c.doc_type == doc_type)
+        else:
+            padded = literal(' ') + documents.c.title_tokens + literal(' ') + documents.c.body_tokens + literal(' ')
+            query = select(documents.c.doc_id, literal(0.0).label('score'))\
+                .where(documents.c.doc_type == doc_type,
+                       and_(*[padded.like(f'% {token} %') for token in tokens]))
+        if filters:
+            model = Question if doc_type == self.QUESTION else Topic
+            query = query.join(model.__table__, model.id == documents.c.doc_id).where(*filters)
+        # 只取最相关的 MAX_RESULTS 条；带 LIMIT 的子查询也不会被 SQLite 展开到外层连接里，
+        # 保证由全文索引驱动（否则分页的 COUNT 会退化为逐行探测）
+        return query.order_by(literal_column('score').desc()).limit(self.MAX_RESULTS).subquery()
@@ -0,0 +1,102 @@
+from datetime import datetime
+from sqlalchemy import and_, or_, func
+from sqlalchemy.orm import joinedload
+from web.models import db, Post, PostLike
+from web.utils.render_utils import render_cached
+
+
+class ThreadService:
+    """
+    主题页回复的分页与楼中楼：
+      - 按 (created_at, id) keyset 分页，不用 OFFSET，页码再深单页代价也不变
+      - 游标为 "<created_at>_<id>_<楼层>"，楼层号随游标传递，无需 COUNT
+      - 当前页回复一次查询（联表加载作者），不在本页的父回复一次 IN 查询补齐，
+        点赞状态只查本页
+      - 回复树在 Python 中按时间顺序一次遍历构建：父回复在本页的挂到其下，
+        否则作为顶层节点并带上父回复引用
+    模板只使用返回的节点，不会再触发 Post.parent / Post.replies 的懒加载。
+    """
+    PER_PAGE = 30
+
+    def __init__(self, per_page=PER_PAGE):
+        self.per_page = per_page
+
+    @staticmethod
+    def encode_cursor(post, floor):
+        return f'{post.created_at.isoformat()}_{post.id}_{floor}'
+
+    @staticmethod
+    def decode_cursor(cursor):
+        try:
+            created_at, post_id, floor = cursor.rsplit('_', 2)
+            return datetime.fromisoformat(created_at), int(post_id), int(floor)
+        except (AttributeError, ValueError):
+            return None
+
+    @staticmethod
+    def _after(created_at, post_id):
+        return or_(Post.created_at > created_at, and_(Post.created_at == created_at, Post.id > post_id))
+
+    @staticmethod
+    def _before(created_at, post_id):
+        return or_(Post.created_at < created_at, and_(Post.created_at == created_at, Post.id < post_id))
+
+    def _base(self, topic_id):
+        return Post.query.options(joinedload(Post.user)).filter(Post.topic_id == topic_id)
+
+    def _load(self, topic_id, after=None, before=None, post_id=None):
+        """返回 (本页回复, 第一条的楼层, 是否有上一页, 是否有下一页)。"""
+        limit = self.per_page + 1
+        forward = self._base(topic_id).order_by(Post.created_at, Post.id)
+        if post_id:
+            target = db.session.get(Post, post_id)
+            if target is not None and target.topic_id == topic_id:
+                # 定位到指定回复所在位置（回复、点赞后跳转），楼层需要一次按索引的计数
+                first_floor = db.session.query(func.count(Post.id)).filter(
+                    Post.topic_id == topic_id, self._before(target.created_at, target.id)).scalar() + 1
+                rows = forward.filter(or_(Post.id == target.id, self._after(target.created_at, target.id))).limit(limit).all()
+                return rows[:self.per_page], first_floor, first_floor > 1, len(rows) > self.per_page
+        cursor = self.decode_cursor(before) if before else None
+        if cursor:
+            created_at, cursor_id, floor = cursor
+            rows = self._base(topic_id).filter(self._before(created_at, cursor_id))\
+                .order_by(Post.created_at.desc(), Post.id.desc()).limit(limit).all()
+            has_prev = len(rows) > self.per_page
+            rows = list(reversed(rows[:self.per_page]))
+            return rows, max(floor - len(rows), 1), has_prev, True
+        cursor = self.decode_cursor(after) if after else None
+        if cursor:
+            created_at, cursor_id, floor = cursor
+            rows = forward.filter(self._after(created_at, cursor_id)).limit(limit).all()
+            return rows[:self.per_page], floor + 1, True, len(rows) > self.per_page
+        rows = forward.limit(limit).all()
+        return rows[:self.per_page], 1, False, len(rows) > self.per_page
+
+    def page(self, topic_id, user_id=None, after=None, before=None, post_id=None):
+        posts, first_floor, has_prev, has_next = self._load(topic_id, after, before, post_id)
+        on_page = {p.id for p in posts}
+        missing = {p.parent_id for p in posts if p.parent_id and p.parent_id not in on_page}
+        parents = {p.id: p for p in Post.query.options(joinedload(Post.user)).filter(Post.id.in_(missing))} if missing else {}
+        liked = set()
+        if user_id and posts:
+            liked = {post_id for (post_id,) in db.session.query(PostLike.post_id).filter(
+                PostLike.user_id == user_id, PostLike.post_id.in_(on_page))}
+
+        nodes = {}
+        roots = []
+        for floor, post in enumerate(posts, first_floor):
+            node = {'post': post, 'floor': floor, 'html': render_cached(post, post.content, post.mode),
+                    'quote': None, 'children': []}
+            nodes[post.id] = node
+            if post.parent_id in nodes:
+                nodes[post.parent_id]['children'].append(node)
+            else:
+                node['quote'] = parents.get(post.parent_id)
+                roots.append(node)
+
+        return {
+            'roots': roots,
+            'liked': liked,
+            'prev_cursor': self.encode_cursor(posts[0], first_floor) if posts and has_prev else None,
+            'next_cursor': self.encode_cursor(posts[-1], first_floor + len(posts) - 1) if posts and has_next else None,
+        }
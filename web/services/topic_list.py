@@ -0,0 +1,96 @@
+from datetime import datetime
+from sqlalchemy import and_, or_, func
+from sqlalchemy.orm import joinedload
+from web.models import db, Topic
+
+
+class TopicListService:
+    """
+    论坛主题列表的 keyset 分页：
+      版面列表  is_pinned DESC, updated_at DESC, id DESC   索引 ix_topic_board_listing
+      最新动态  created_at DESC, id DESC                    索引 ix_topic_latest
+    游标为排序列取值以 "_" 拼接，任意深度的翻页都只扫描一页数据；
+    作者与版面随列表一次联表加载。
+    """
+    BOARD_PER_PAGE = 20
+    LATEST_PER_PAGE = 10
+
+    @staticmethod
+    def _keyset(columns, values, forward=True):
+        """全部降序排列时，forward 取排在游标之后的行，否则取之前的行。"""
+        op = '<' if forward else '>'
+        clauses = []
+        for i, column in enumerate(columns):
+            equal = [columns[j] == values[j] for j in range(i)]
+            # SQLAlchemy 不允许布尔列直接使用 < / >，用显式运算符（false < true 在 SQLite / PostgreSQL 中均成立）
+            clauses.append(and_(*equal, column.op(op)(values[i])))
+        return or_(*clauses)
+
+    @staticmethod
+    def _listing():
+        return Topic.query.options(joinedload(Topic.user), joinedload(Topic.board))\
+            .filter(Topic.is_deleted == False)
+
+    def _page(self, query, columns, values, per_page, forward):
+        if values is not None:
+            query = query.filter(self._keyset(columns, values, forward))
+        order = [c.desc() if forward else c.asc() for c in columns]
+        rows = query.order_by(*order).limit(per_page + 1).all()
+        more = len(rows) > per_page
+        rows = rows[:per_page]
+        if not forward:
+            rows.reverse()
+        return rows, more
+
+    # ---- 版面 ----
+    @staticmethod
+    def board_cursor(topic):
+        return f'{int(bool(topic.is_pinned))}_{topic.updated_at.isoformat()}_{topic.id}'
+
+    @staticmethod
+    def _parse_board_cursor(cursor):
+        try:
+            pinned, updated_at, topic_id = cursor.split('_')
+            return [bool(int(pinned)), datetime.fromisoformat(updated_at), int(topic_id)]
+        except (AttributeError, ValueError):
+            return None
+
+    def board_page(self, board_id, after=None, before=None, per_page=BOARD_PER_PAGE):
+        """返回 {'topics', 'next_cursor', 'prev_cursor'}。"""
+        columns = [Topic.is_pinned, Topic.updated_at, Topic.id]
+        query = self._listing().filter(Topic.board_id == board_id)
+        before_values = self._parse_board_cursor(before) if before else None
+        if before_values:
+            topics, has_prev = self._page(query, columns, before_values, per_page, forward=False)
+            has_next = True
+        else:
+            after_values = self._parse_board_cursor(after) if after else None
+            topics, has_next = self._page(query, columns, after_values, per_page, forward=True)
+            has_prev = after_values is not None
+        return {
+            'topics': topics,
+            'next_cursor': self.board_cursor(topics[-1]) if topics and has_next else None,
+            'prev_cursor': self.board_cursor(topics[0]) if topics and has_prev else None,
+        }
+
+    # ---- 最新动态 ----
+    @staticmethod
+    def latest_cursor(topic):
+        return f'{topic.created_at.isoformat()}_{topic.id}'
+
+    def latest_page(self, after=None, per_page=LATEST_PER_PAGE):
+        values = None
+        if after:
+            try:
+                created_at, topic_id = after.split('_')
+                values = [datetime.fromisoformat(created_at), int(topic_id)]
+            except ValueError:
+                values = None
+        topics, has_next = self._page(self._listing(), [Topic.created_at, Topic.id], values, per_page, forward=True)
+        return topics, (self.latest_cursor(topics[-1]) if topics and has_next else None)
+
+    @staticmethod
+    def board_topic_counts():
+        """各版面未删除主题数，一次 GROUP BY。"""
+        return dict(db.session.query(Topic.board_id, func.count(Topic.id))
+                    .filter(Topic.is_deleted == False).group_by(Topic.board_id).all())
@@ -0,0 +1,169 @@
+import time
+from datetime import datetime
+from sqlalchemy import bindparam, tuple_, func
+from sqlalchemy.exc import IntegrityError
+from web.models import db, Topic, TopicView
+
+
+class ViewCounterService:
+    """
+    主题浏览计数缓冲到 Redis，浏览主题页不再写数据库：
+      forum:views:hll:<topic_id>   HyperLogLog，按 user_id 粗筛重复浏览（7 天无人访问后过期）
+      forum:views:pending          待落库的首次浏览事件 "user_id:topic_id:unix时间"
+      forum:history:<user_id>      有序集合，浏览历史（分值为时间，最多保留 HISTORY_SIZE 条）
+    flush() 由 celery beat 定期调用（Redis 锁保证同一时刻只有一个 flush），按主键 (user_id, topic_id)
+    忽略冲突插入 TopicView，并按实际插入的行数累加 Topic.views。
+    HyperLogLog 有约 1% 的误判：被误判为"已看过"的首次浏览不会入队，TopicView 与 Topic.views 都会少计这一次。
+    Redis 不可用时退回同步写库。
+    """
+    HLL_KEY_PREFIX = 'forum:views:hll:'
+    PENDING_KEY = 'forum:views:pending'
+    PROCESSING_KEY = 'forum:views:processing'
+    FLUSH_LOCK_KEY = 'forum:views:flush_lock'
+    FLUSH_LOCK_TTL = 300
+    HISTORY_KEY_PREFIX = 'forum:history:'
+    HLL_TTL = 7 * 86400
+    HISTORY_SIZE = 50
+    FLUSH_BATCH = 2000
+
+    def __init__(self, redis_client):
+        self.redis = redis_client
+
+    def record(self, user_id, topic_id):
+        """记录一次浏览；Redis 不可用时同步写库。"""
+        if self.redis:
+            try:
+                now = time.time()
+                history_key = f'{self.HISTORY_KEY_PREFIX}{user_id}'
+                hll_key = f'{self.HLL_KEY_PREFIX}{topic_id}'
+                pipe = self.redis.pipeline()
+                pipe.pfadd(hll_key, user_id)
+                pipe.expire(hll_key, self.HLL_TTL)
+                pipe.zadd(history_key, {topic_id: now})
+                pipe.zremrangebyrank(history_key, 0, -self.HISTORY_SIZE - 1)
+                is_new = pipe.execute()[0]
+                if is_new:
+                    self.redis.rpush(self.PENDING_KEY, f'{user_id}:{topic_id}:{int(now)}')
+                return
+            except Exception as e:
+                print(f"[Views] Redis unavailable, writing view directly: {e}")
+        self._write_direct(user_id, topic_id)
+
+    def _write_direct(self, user_id, topic_id):
+        if not self._insert_new([{'user_id': user_id, 'topic_id': topic_id, 'created_at': datetime.utcnow()}]):
+            return
+        from web.services.hotness import HotnessService
+        topics = Topic.__table__
+        db.session.execute(topics.update().where(topics.c.id == topic_id)
+                           .values(views=func.coalesce(topics.c.views, 0) + 1, updated_at=topics.c.updated_at))
+        HotnessService().bump(topic_id)
+        db.session.commit()
+
+    @staticmethod
+    def _insert_new(rows):
+        """插入 TopicView，主键冲突的行忽略；返回实际插入的 (user_id, topic_id) 列表。"""
+        table = TopicView.__table__
+        dialect = db.engine.dialect.name
+        if dialect in ('sqlite', 'postgresql'):
+            if dialect == 'sqlite':
+                from sqlalchemy.dialects.sqlite import insert
+            else:
+                from sqlalchemy.dialects.postgresql import insert
+            stmt = insert(table).on_conflict_do_nothing().returning(table.c.user_id, table.c.topic_id)
+            return [tuple(r) for r in db.session.execute(stmt, rows)]
+        inserted = []
+        for row in rows:
+            try:
+                with db.session.begin_nested():
+                    db.session.execute(table.insert().values(**row))
+                inserted.append((row['user_id'], row['topic_id']))
+            except IntegrityError:
+                pass
+        return inserted
+
+    def flush(self):
+        """
+        把缓冲的浏览写入数据库，返回新增的 TopicView 行数。
+        先把待处理列表改名为 processing，提交成功后才删除；中途失败时下次从 processing 继续。
+        多进程（beat 与命令行）同时调用时由锁串行化，拿不到锁直接返回。
+        """
+        if not self.redis:
+            return 0
+        if not self.redis.set(self.FLUSH_LOCK_KEY, 1, nx=True, ex=self.FLUSH_LOCK_TTL):
+            return 0
+        try:
+            return self._flush()
+        finally:
+            self.redis.delete(self.FLUSH_LOCK_KEY)
+
+    def _flush(self):
+        if not self.redis.exists(self.PROCESSING_KEY):
+            try:
+                self.redis.rename(self.PENDING_KEY, self.PROCESSING_KEY)
+            except Exception:
+                return 0  # 没有待处理的浏览
+        total = 0
+        while True:
+            raw = self.redis.lrange(self.PROCESSING_KEY, 0, self.FLUSH_BATCH - 1)
+            if not raw:
+                break
+            total += self._apply(raw)
+            self.redis.ltrim(self.PROCESSING_KEY, len(raw), -1)
+        self.redis.delete(self.PROCESSING_KEY)
+        if total:
+            print(f"[Views] Flushed {total} topic views")
+        return total
+
+    def _apply(self, raw):
+        events = {}
+        for item in raw:
+            try:
+                user_id, topic_id, ts = (int(v) for v in item.split(':'))
+            except ValueError:
+                continue
+            events.setdefault((user_id, topic_id), ts)
+        if not events:
+            return 0
+        existing = set(db.session.query(TopicView.user_id, TopicView.topic_id)
+                       .filter(tuple_(TopicView.user_id, TopicView.topic_id).in_(list(events))).all())
+        topic_ids = {t for (_, t) in events}
+        live = {t for (t,) in db.session.query(Topic.id).filter(Topic.id.in_(topic_ids))}
+        rows = [{'user_id': u, 'topic_id': t, 'created_at': datetime.utcfromtimestamp(ts)}
+                for (u, t), ts in events.items() if (u, t) not in existing and t in live]
+        if not rows:
+            return 0
+        inserted = self._insert_new(rows)
+        increments = {}
+        for _, topic_id in inserted:
+            increments[topic_id] = increments.get(topic_id, 0) + 1
+        if not increments:
+            db.session.commit()
+            return 0
+        topics = Topic.__table__
+        db.session.execute(
+            topics.update().where(topics.c.id == bindparam('b_id'))
+            .values(views=func.coalesce(topics.c.views, 0) + bindparam('b_inc'), updated_at=topics.c.updated_at),
+            [{'b_id': t, 'b_inc': n} for t, n in increments.items()]
+        )
+        from web.services.hotness import HotnessService
+        hotness = HotnessService()
+        for topic_id in increments:
+            hotness.bump(topic_id)
+        db.session.commit()
+        return len(inserted)
+
+    def history(self, user_id, limit=HISTORY_SIZE):
+        """浏览历史 [(浏览时间, Topic)]，优先读 Redis，缺失时查 TopicView。"""
+        entries = []
+        if self.redis:
+            try:
+                entries = self.redis.zrevrange(f'{self.HISTORY_KEY_PREFIX}{user_id}', 0, limit - 1, withscores=True)
+            except Exception as e:
+                print(f"[Views] Redis unavailable: {e}")
+        if entries:
+            topics = {t.id: t for t in Topic.query.filter(Topic.id.in_([int(t) for t, _ in entries]),
+                                                          Topic.is_deleted == False)}
+            return [(datetime.utcfromtimestamp(ts), topics[int(t)]) for t, ts in entries if int(t) in topics]
+        return db.session.query(TopicView.created_at, Topic).join(Topic, TopicView.topic_id == Topic.id)\
+            .filter(TopicView.user_id == user_id, Topic.is_deleted == False)\
+            .order_by(TopicView.created_at.desc()).limit(limit).all()
@@ -127,7 +127,12 @@ def grade_exam_task(self, user_id, data):
 
     ids = data['ids']
     user_answers_map = data['user_answers']
-    all_questions = data['all_questions']
+    questions_by_id = {item['id']: item for item in data.get('all_questions') or []}
+    # 消息里缺题时回退到 worker 本地 mmap 的二进制题库
+    bank = None
+    if len(questions_by_id) < len(ids):
+        from utils.question_bank import get_question_bank
+        bank = get_question_bank(getattr(Config, 'QUESTION_BANK_FILE', ''))
 
     total_score = 0
     results = []
@@ -135,7 +140,9 @@ def grade_exam_task(self, user_id, data):
     total_items = len(ids)
 
     for i, q_id in enumerate(ids):
-        q = next((item for item in all_questions if item['id'] == q_id), None)
+        q = questions_by_id.get(q_id)
+        if not q and bank:
+            q = bank.get(q_id)
         if not q: continue
         
         exam_questions.append(q)
@@ -178,7 +185,8 @@ def grade_exam_task(self, user_id, data):
             'user_ans': user_ans,
             'correct_ans': q['answer'],
             'score': score,
-            'full_score': q['score']
+            'full_score': q['score'],
+            'version': q.get('version')
         })
         
         # Emit progress update every 5 items or 20%
@@ -220,3 +228,111 @@ def grade_exam_task(self, user_id, data):
             print(f"Socket emit error: {e}")
 
     return final_result
+
+
+@shared_task
+def reconcile_counters_task():
+    """定期校准 SystemCounter（由 celery beat 调度）。"""
+    from utils.data_manager import DataManager
+    data_manager = DataManager(get_config())
+    return data_manager.reconcile_system_counters()
+
+
+@shared_task
+def refresh_rollups_task():
+    """按水位线增量刷新分析汇总（由 celery beat 调度）。"""
+    from web.services.rollup import RollupService
+    return RollupService().run()
+
+
+@shared_task
+def item_analysis_task():
+    """重算题目项目分析（难度 / 区分度 / 错误选项分布），由 celery beat 每日调度。"""
+    from web.services.item_analysis import ItemAnalysisService
+    return ItemAnalysisService().run()
+
+
+@shared_task
+def refresh_hotness_task():
+    """全量刷新论坛主题热度（时间衰减），由 celery beat 周期调度。"""
+    from web.services.hotness import HotnessService
+    return HotnessService().refresh()
+
+
+@shared_task
+def flush_views_task():
+    """把 Redis 中缓冲的主题浏览批量写入 TopicView / Topic.views，由 celery beat 每分钟调度。"""
+    from web.extensions import cache_redis
+    from web.services.views import ViewCounterService
+    return ViewCounterService(cache_redis).flush()
+
+
+@shared_task
+def fan_out_reply_task(post_id):
+    """为大主题中的新回复写入收件箱通知（参与者多时不在请求内同步扩散）。"""
+    from web.extensions import cache_redis
+    from web.services.inbox import InboxService
+    return InboxService(cache_redis).fan_out(post_id)
+
+
+@shared_task
+def process_image_task(filename):
+    """把上传的图片缩放并转码为 WebP 变体（含缩略图）。"""
+    from web.services.images import ImageService
+    return ImageService(get_config().UPLOAD_FOLDER).process(filename)
+
+
+@shared_task(bind=True)
+def regrade_question_task(self, question_id, version):
+    """标准答案 / 分值修改后重新评分历史作答，分块提交，中断后重新投递即可续跑。"""
+    from utils.data_manager import DataManager
+    from services.grading import GradingService
+    from web.services.regrade import RegradeService
+    Config = get_config()
+    data_manager = DataManager(Config)
+    socket_emitter = get_socket_emitter()
+    room = f'regrade_{question_id}'
+
+    def report(progress):
+        percent = int(progress['done'] * 100 / progress['total']) if progress.get('total') else 100
+        self.update_state(state='PROGRESS', meta=dict(progress, percent=percent))
+        if socket_emitter:
+            try:
+                socket_emitter.emit('regrade_status', dict(progress, question_id=question_id, percent=percent), room=room)
+            except Exception as e:
+                print(f"[Celery] SocketIO emit failed: {e}")
+
+    service = RegradeService(GradingService(Config.DLL_PATH), data_manager.leaderboard)
+    progress = service.run(question_id, version, on_progress=report)
+    report(progress)
+    return progress
+
+
+@shared_task(bind=True)
+def import_questions_task(self, path, fmt, zip_path=None, owner_id=None, default_category=None):
+    """后台批量导入题目，进度通过任务状态（PROGRESS）查询，导入结束后删除临时文件。"""
+    import os
+    import shutil
+    from utils.data_manager import DataManager
+    from web.services.question_import import QuestionImportService
+    Config = get_config()
+    data_manager = DataManager(Config)
+
+    def report(progress):
+        self.update_state(state='PROGRESS', meta=progress)
+
+    try:
+        service = QuestionImportService(data_manager, Config.UPLOAD_FOLDER)
+        return service.run(path, fmt, zip_path=zip_path, owner_id=owner_id,
+                           default_category=default_category, on_progress=report)
+    finally:
+        shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+
+
+@shared_task
+def backup_task(full=None):
+    """夜间备份（由 celery beat 调度）：距上次全量超过间隔时做全量，否则做增量。"""
+    from web.services.backup import BackupService
+    Config = get_config()
+    manifest = BackupService(Config.BACKUP_DIR, Config.UPLOAD_FOLDER).backup(full=full)
+    return {'run_id': manifest['run_id'], 'type': manifest['type']}
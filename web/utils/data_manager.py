@@ -2,11 +2,14 @@ import os
 import json
 import shutil
 from datetime import datetime, timedelta
-from web.models import db, Question, ExamResult, User, UserCategoryStat, UserPermission, StardustHistory
+from web.models import db, Question, ExamResult, ExamAnswer, User, UserCategoryStat, UserDashboard, SystemCounter, UserPermission, StardustHistory
+from web.extensions import cache_redis
+from web.services.leaderboard import LeaderboardService
 
 class DataManager:
     def __init__(self, config):
         self.config = config
+        self.leaderboard = LeaderboardService(cache_redis)
         self._ensure_directories()
         self._check_legacy_db()
 
@@ -41,32 +44,42 @@ class DataManager:
             print(f"[DataManager] 已导出所有题目到 {data_file}")
         except Exception as e:
             print(f"[DataManager] 导出题目失败: {e}")
+        # 同步导出二进制题库，供 C 端 CLI / 批量评分及 worker 端按 id 直接查题
+        bank_file = getattr(self.config, 'QUESTION_BANK_FILE', None)
+        if bank_file:
+            try:
+                from web.utils.question_bank import write_question_bank
+                count = write_question_bank((q.to_dict() for q in questions), bank_file)
+                print(f"[DataManager] 已导出 {count} 道题目到二进制题库 {bank_file}")
+            except Exception as e:
+                print(f"[DataManager] 导出二进制题库失败: {e}")
     def save_all_questions(self, questions):
         # This is hard to map to DB efficiently without IDs.
         # We will avoid using this in the new app.py
         pass
 
     def get_questions_paginated(self, page=1, per_page=10, search=None, category=None):
-        query = Question.query
+        filters = [Question.category == category] if category and category != 'all' else []
+        query = Question.query.filter(*filters)
+        order = [Question.id.desc()]
         if search:
-            search_term = f"%{search}%"
-            query = query.filter(
-                (Question.content.like(search_term)) | 
-                (Question.category.like(search_term))
-            )
-        if category and category != 'all':
-            query = query.filter_by(category=category)
-        
-        return query.order_by(Question.id.desc()).paginate(page=page, per_page=per_page, error_out=False)
+            from web.services.search import SearchService
+            ranked = SearchService().ranked(SearchService.QUESTION, search, filters)
+            if ranked is None:
+                query = query.filter(db.false())
+            else:
+                query = query.join(ranked, ranked.c.doc_id == Question.id)
+                order.insert(0, ranked.c.score.desc())
+
+        return query.order_by(*order).paginate(page=page, per_page=per_page, error_out=False)
 
     def get_system_stats(self):
-        total_questions = Question.query.count()
-        total_exams = ExamResult.query.count()
-        
-        # Calculate average accuracy
-        from sqlalchemy import func
-        total_score_sum = db.session.query(func.sum(ExamResult.total_score)).scalar() or 0
-        total_max_sum = db.session.query(func.sum(ExamResult.max_score)).scalar() or 0
+        """读取 SystemCounter 中的运行计数，O(1)，不再对全表 COUNT / SUM。"""
+        counters = dict(db.session.query(SystemCounter.name, SystemCounter.value).all())
+        if len(counters) < len(SystemCounter.NAMES):
+            counters = self.reconcile_system_counters()
+        total_score_sum = counters.get(SystemCounter.EXAM_SCORE_SUM) or 0
+        total_max_sum = counters.get(SystemCounter.EXAM_MAX_SCORE_SUM) or 0
         
         if total_max_sum > 0:
             avg_accuracy = round((total_score_sum / total_max_sum) * 100, 1)
@@ -74,11 +87,39 @@ class DataManager:
             avg_accuracy = 0
             
         return {
-            'total_questions': total_questions,
-            'total_exams': total_exams,
+            'total_questions': counters.get(SystemCounter.QUESTIONS) or 0,
+            'total_exams': counters.get(SystemCounter.EXAM_RESULTS) or 0,
             'avg_accuracy': avg_accuracy
         }
 
+    def reconcile_system_counters(self):
+        """按全表聚合校准计数（启动时缺失以及定期任务调用），返回校准后的 {name: value}。"""
+        from sqlalchemy import func
+        exams, score_sum, max_sum = db.session.query(
+            func.count(ExamResult.id),
+            func.sum(ExamResult.total_score),
+            func.sum(ExamResult.max_score)
+        ).one()
+        actual = {
+            SystemCounter.QUESTIONS: db.session.query(func.count(Question.id)).scalar() or 0,
+            SystemCounter.EXAM_RESULTS: exams or 0,
+            SystemCounter.EXAM_SCORE_SUM: score_sum or 0,
+            SystemCounter.EXAM_MAX_SCORE_SUM: max_sum or 0
+        }
+        try:
+            for name, value in actual.items():
+                counter = db.session.get(SystemCounter, name)
+                if counter is None:
+                    db.session.add(SystemCounter(name=name, value=value))
+                elif counter.value != value:
+                    print(f"[DataManager] Counter {name} drifted: {counter.value} -> {value}")
+                    counter.value = value
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"[DataManager] Counter reconcile failed: {e}")
+        return actual
+
     def get_categories(self):
         # Use distinct query
         categories = db.session.query(Question.category).distinct().all()
@@ -101,6 +142,127 @@ class DataManager:
                         r.category = '默认题集'
         return [r.to_dict() for r in results]
 
+    @staticmethod
+    def encode_cursor(timestamp, result_id):
+        import base64
+        return base64.urlsafe_b64encode(f"{timestamp}|{result_id}".encode('utf-8')).decode('ascii')
+
+    @staticmethod
+    def decode_cursor(cursor):
+        import base64
+        try:
+            timestamp, result_id = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').split('|', 1)
+            return timestamp, result_id
+        except Exception:
+            return None
+
+    def build_results_query(self, user_id=None, q=None, start_time=None, end_time=None):
+        """
+        历史记录筛选条件全部下推到 SQL：用户、关键字（用户名/时间）、起止日期。
+        timestamp 为 'YYYY-MM-DD HH:MM:SS' 字符串，按字典序比较即按时间比较。
+        """
+        from sqlalchemy import or_
+        query = ExamResult.query
+        if user_id:
+            query = query.filter(ExamResult.user_id == user_id)
+        if q:
+            like = f"%{q}%"
+            query = query.outerjoin(User, ExamResult.user_id == User.id).filter(
+                or_(User.username.ilike(like), ExamResult.timestamp.like(like))
+            )
+        if start_time:
+            query = query.filter(ExamResult.timestamp >= start_time)
+        if end_time:
+            # 仅给出日期时包含当天全部记录
+            if len(end_time) == 10:
+                end_time = end_time + ' 23:59:59'
+            query = query.filter(ExamResult.timestamp <= end_time)
+        return query
+
+    def query_results(self, user_id=None, q=None, start_time=None, end_time=None, cursor=None, per_page=20):
+        """
+        分页读取历史记录摘要（keyset 分页，按 timestamp、id 倒序）。
+        返回 {'items': [摘要字典], 'next_cursor': 下一页游标或 None}。
+        """
+        from sqlalchemy import and_, or_
+        from sqlalchemy.orm import defer, joinedload
+        query = self.build_results_query(user_id=user_id, q=q, start_time=start_time, end_time=end_time)
+        position = self.decode_cursor(cursor) if cursor else None
+        if position:
+            ts, rid = position
+            query = query.filter(or_(
+                ExamResult.timestamp < ts,
+                and_(ExamResult.timestamp == ts, ExamResult.id < rid)
+            ))
+        rows = query.options(defer(ExamResult.details_json), joinedload(ExamResult.user))\
+            .order_by(ExamResult.timestamp.desc(), ExamResult.id.desc())\
+            .limit(per_page + 1).all()
+        next_cursor = None
+        if len(rows) > per_page:
+            rows = rows[:per_page]
+            next_cursor = self.encode_cursor(rows[-1].timestamp, rows[-1].id)
+        return {'items': [r.to_summary_dict() for r in rows], 'next_cursor': next_cursor}
+
+    EXPORT_HEADER = ['用户', '时间', '类别', '得分', '满分', '得分率']
+
+    def iter_export_rows(self, user_id=None, q=None, start_time=None, end_time=None, per_question=False, batch_size=1000):
+        """
+        流式产出历史导出的表格行（首行为表头），筛选条件与历史列表一致。
+        以 yield_per 分批读取（PostgreSQL 下为服务端游标），只取摘要列、不解码 details，
+        内存占用与记录总数无关。
+        per_question 为真时追加逐题得分列：列集合先由一次 DISTINCT 查询确定，
+        每批成绩的作答明细再按 result_id 一次取回。
+        """
+        from itertools import islice
+        from sqlalchemy.orm import aliased
+        base = self.build_results_query(user_id=user_id, q=q, start_time=start_time, end_time=end_time)
+        owner = aliased(User)
+        query = base.outerjoin(owner, ExamResult.user_id == owner.id).with_entities(
+            ExamResult.id, owner.username, ExamResult.timestamp, ExamResult.category,
+            ExamResult.total_score, ExamResult.max_score
+        ).order_by(ExamResult.timestamp.desc(), ExamResult.id.desc())
+
+        question_ids = []
+        if per_question:
+            result_ids = base.with_entities(ExamResult.id).subquery()
+            question_ids = [qid for (qid,) in db.session.query(ExamAnswer.question_id).filter(
+                ExamAnswer.result_id.in_(db.select(result_ids.c.id)),
+                ExamAnswer.question_id.isnot(None)
+            ).distinct().order_by(ExamAnswer.question_id)]
+        yield self.EXPORT_HEADER + [f'第{qid}题' for qid in question_ids]
+
+        column_of = {qid: i for i, qid in enumerate(question_ids)}
+        rows = iter(query.yield_per(batch_size))
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            answers = {}
+            if question_ids:
+                for rid, qid, score, full in db.session.query(
+                    ExamAnswer.result_id, ExamAnswer.question_id, ExamAnswer.score, ExamAnswer.full_score
+                ).filter(ExamAnswer.result_id.in_([r.id for r in batch]), ExamAnswer.question_id.isnot(None)):
+                    cells = answers.setdefault(rid, [''] * len(question_ids))
+                    cells[column_of[qid]] = f'{score or 0}/{full or 0}'
+            for r in batch:
+                score = r.total_score or 0
+                max_s = r.max_score or 0
+                percentage = f"{(score / max_s * 100):.1f}%" if max_s > 0 else "0.0%"
+                row = [r.username or 'Unknown', r.timestamp, r.category or '默认题集', score, max_s, percentage]
+                if question_ids:
+                    row += answers.get(r.id) or [''] * len(question_ids)
+                yield row
+
+    def backfill_result_categories(self):
+        """旧数据兼容：category 为空的记录从 details 中推断一次并落库，列表页无需再解析 details。"""
+        from sqlalchemy import or_
+        rows = ExamResult.query.filter(or_(ExamResult.category.is_(None), ExamResult.category == '')).all()
+        for r in rows:
+            details = r.details
+            cat = details[0].get('category') if details and isinstance(details[0], dict) else None
+            r.category = cat or '默认题集'
+        db.session.commit()
+
     def save_exam_result(self, result_dict, user_id=None, category='默认题集'):
         print(f"[DataManager] Saving exam result: {result_dict['id']} for user: {user_id}")
         # 优先 result_dict['category']，否则用参数
@@ -114,10 +276,18 @@ class DataManager:
             category=cat
         )
         result.details = result_dict['details']
+        answer_rows = ExamAnswer.rows_from_details(result_dict['id'], user_id, result_dict['details'], cat)
         try:
             db.session.add(result)
+            if answer_rows:
+                # 逐题记录与成绩同一事务批量写入
+                db.session.flush()
+                db.session.execute(ExamAnswer.__table__.insert(), answer_rows)
             db.session.commit()
             print(f"[DataManager] Successfully saved result {result_dict['id']}")
+
+            if user_id:
+                self.record_dashboard_result(user_id, result_dict)
             
             # Award Stardust
             if user_id:
@@ -180,40 +350,185 @@ class DataManager:
         r = ExamResult.query.get(result_id)
         return r.to_dict() if r else None
 
+    DELETE_CHUNK_SIZE = 500  # 单条语句的 IN 参数个数，低于 SQLite 的绑定变量上限
+
     def delete_result(self, result_id):
-        r = ExamResult.query.get(result_id)
-        if r:
-            # Rollback stats
-            try:
-                self.rollback_user_stats(r.user_id, r.details)
-            except Exception as e:
-                print(f"Error rolling back stats: {e}")
-            
-            db.session.delete(r)
-            db.session.commit()
+        return self.delete_results([result_id]) > 0
 
-    def rollback_user_stats(self, user_id, results):
+    def delete_results(self, result_ids):
         """
-        Reverse the effect of update_user_stats.
+        批量删除成绩，返回实际删除的条数。
+        按块处理：一次聚合查询得出各 (用户, 类别) 的统计差值，集合式 UPDATE 回退 UserCategoryStat，
+        再用一条 DELETE 删除作答明细与成绩，整个批次一次提交。
+        Core 语句绕过 after_flush 钩子，SystemCounter 在同一事务内手动扣减。
         """
-        category_results = {}
-        for r in results:
-            cat = r.get('category', '默认题集')
-            if cat not in category_results:
-                category_results[cat] = {'score': 0, 'max_score': 0}
-            category_results[cat]['score'] += r.get('score', 0)
-            category_results[cat]['max_score'] += r.get('full_score', 0)
-        
-        for cat, data in category_results.items():
-            stat = UserCategoryStat.query.filter_by(user_id=user_id, category=cat).first()
-            if stat:
-                stat.total_attempts = max(0, (stat.total_attempts or 1) - 1)
-                stat.total_score = max(0, (stat.total_score or 0) - data['score'])
-                stat.total_max_score = max(0, (stat.total_max_score or 0) - data['max_score'])
-        
-        # We don't revoke permissions or stardust automatically as it's complex to track back exactly
-        # But stats should be consistent.
+        from sqlalchemy import func, bindparam, case
+        ids = list(dict.fromkeys(str(rid) for rid in result_ids if rid))
+        if not ids:
+            return 0
+        results = ExamResult.__table__
+        answers = ExamAnswer.__table__
+        stats = UserCategoryStat.__table__
+        deleted = 0
+        users = set()
+        try:
+            for i in range(0, len(ids), self.DELETE_CHUNK_SIZE):
+                chunk = ids[i:i + self.DELETE_CHUNK_SIZE]
+                deltas = {}
+                rows = db.session.query(
+                    ExamResult.user_id,
+                    ExamAnswer.category,
+                    func.count(func.distinct(ExamAnswer.result_id)),
+                    func.sum(ExamAnswer.score),
+                    func.sum(ExamAnswer.full_score)
+                ).join(ExamResult, ExamResult.id == ExamAnswer.result_id)\
+                    .filter(ExamAnswer.result_id.in_(chunk), ExamResult.user_id.isnot(None))\
+                    .group_by(ExamResult.user_id, ExamAnswer.category).all()
+                for user_id, cat, attempts, score, full in rows:
+                    deltas[(user_id, cat or '默认题集')] = [attempts, score or 0, full or 0]
+
+                # 尚无 exam_answer 明细的旧成绩回退到解析 details
+                with_answers = {rid for (rid,) in db.session.query(ExamAnswer.result_id)
+                                .filter(ExamAnswer.result_id.in_(chunk)).distinct()}
+                legacy = [rid for rid in chunk if rid not in with_answers]
+                if legacy:
+                    for r in ExamResult.query.filter(ExamResult.id.in_(legacy), ExamResult.user_id.isnot(None)).all():
+                        per_cat = {}
+                        for d in r.details:
+                            cat = d.get('category', '默认题集')
+                            item = per_cat.setdefault(cat, [0, 0])
+                            item[0] += d.get('score', 0)
+                            item[1] += d.get('full_score', 0)
+                        for cat, (score, full) in per_cat.items():
+                            delta = deltas.setdefault((r.user_id, cat), [0, 0, 0])
+                            delta[0] += 1
+                            delta[1] += score
+                            delta[2] += full
+
+                if deltas:
+                    def decrement(column, param):
+                        value = column - bindparam(param)
+                        return case((value < 0, 0), else_=value)
+                    db.session.execute(
+                        stats.update().where(stats.c.user_id == bindparam('b_user'), stats.c.category == bindparam('b_category'))
+                        .values(total_attempts=decrement(func.coalesce(stats.c.total_attempts, 1), 'b_attempts'),
+                                total_score=decrement(func.coalesce(stats.c.total_score, 0), 'b_score'),
+                                total_max_score=decrement(func.coalesce(stats.c.total_max_score, 0), 'b_max')),
+                        [{'b_user': u, 'b_category': c, 'b_attempts': a, 'b_score': sc, 'b_max': m}
+                         for (u, c), (a, sc, m) in deltas.items()]
+                    )
+
+                count, score_sum, max_sum = db.session.query(
+                    func.count(ExamResult.id), func.sum(ExamResult.total_score), func.sum(ExamResult.max_score)
+                ).filter(ExamResult.id.in_(chunk)).one()
+                chunk_users = {u for (u,) in db.session.query(ExamResult.user_id)
+                               .filter(ExamResult.id.in_(chunk), ExamResult.user_id.isnot(None)).distinct()}
+
+                db.session.execute(answers.delete().where(answers.c.result_id.in_(chunk)))
+                removed = db.session.execute(results.delete().where(results.c.id.in_(chunk))).rowcount
+                SystemCounter.apply(db.session.connection(), {
+                    SystemCounter.EXAM_RESULTS: -(count or 0),
+                    SystemCounter.EXAM_SCORE_SUM: -(score_sum or 0),
+                    SystemCounter.EXAM_MAX_SCORE_SUM: -(max_sum or 0)
+                })
+                deleted += removed
+                users |= chunk_users
+
+            if users:
+                # 看板无法精确回退趋势与错题计数，删除后由下次读取重建
+                UserDashboard.query.filter(UserDashboard.user_id.in_(users)).delete(synchronize_session=False)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"[DataManager] Bulk delete failed: {e}")
+            return 0
+        # 会话中可能仍缓存着已删除的成绩对象
+        db.session.expire_all()
+        for user_id in users:
+            self.leaderboard.update_user(user_id)
+        print(f"[DataManager] Deleted {deleted} exam results")
+        return deleted
+
+    def backfill_question_hashes(self, chunk_size=500):
+        """为已有题目计算 content_hash；按 id 分块，每块一次 executemany UPDATE。"""
+        from sqlalchemy import bindparam
+        table = Question.__table__
+        last_id = 0
+        while True:
+            rows = db.session.query(Question.id, Question.content).filter(Question.id > last_id)\
+                .order_by(Question.id).limit(chunk_size).all()
+            if not rows:
+                break
+            db.session.execute(
+                table.update().where(table.c.id == bindparam('b_id')).values(content_hash=bindparam('b_hash')),
+                [{'b_id': qid, 'b_hash': Question.hash_content(content)} for qid, content in rows]
+            )
+            db.session.commit()
+            last_id = rows[-1].id
+
+    def backfill_forum_counters(self):
+        """按明细表重算 Topic.reply_count / like_count / last_post_at 与 Post.like_count（各一条 UPDATE）。"""
+        from sqlalchemy import select, func
+        from web.models import Topic, Post, TopicLike, PostLike
+        topics = Topic.__table__
+        posts = Post.__table__
+        db.session.execute(topics.update().values(
+            updated_at=topics.c.updated_at,
+            reply_count=select(func.count()).where(posts.c.topic_id == topics.c.id).scalar_subquery(),
+            like_count=select(func.count()).where(TopicLike.__table__.c.topic_id == topics.c.id).scalar_subquery(),
+            last_post_at=select(func.max(posts.c.created_at)).where(posts.c.topic_id == topics.c.id).scalar_subquery(),
+        ))
+        db.session.execute(posts.update().values(
+            like_count=select(func.count()).where(PostLike.__table__.c.post_id == posts.c.id).scalar_subquery()
+        ))
+        db.session.commit()
 
+    def backfill_forum_inbox(self):
+        """为已有回复补写收件箱通知（主题作者与被回复者，标记为已读），各一条 INSERT ... SELECT。"""
+        from sqlalchemy import select, literal, and_
+        from sqlalchemy.orm import aliased
+        from web.models import Topic, Post, ForumNotification
+        table = ForumNotification.__table__
+        columns = ['user_id', 'actor_id', 'topic_id', 'post_id', 'kind', 'is_read', 'created_at']
+        parent = aliased(Post)
+        db.session.execute(table.insert().from_select(columns, select(
+            parent.user_id, Post.user_id, Post.topic_id, Post.id,
+            literal(ForumNotification.KIND_REPLY), literal(True), Post.created_at
+        ).join(parent, Post.parent_id == parent.id).where(parent.user_id != Post.user_id)))
+        replied = select(table.c.post_id).where(table.c.user_id == Topic.user_id)
+        db.session.execute(table.insert().from_select(columns, select(
+            Topic.user_id, Post.user_id, Post.topic_id, Post.id,
+            literal(ForumNotification.KIND_TOPIC), literal(True), Post.created_at
+        ).join(Topic, Post.topic_id == Topic.id).where(and_(Topic.user_id != Post.user_id, Post.id.not_in(replied)))))
+        db.session.commit()
+
+    def backfill_exam_answers(self, chunk_size=500):
+        """
+        把已有 ExamResult.details 拆分写入 exam_answer；按 id 分块，每块提交一次。
+        已有作答行的成绩（中断后重跑）用 NOT EXISTS 逐行跳过，走 ix_exam_answer_result 索引。
+        """
+        done = db.exists().where(ExamAnswer.result_id == ExamResult.id)
+        last_id = ''
+        total = 0
+        while True:
+            rows = db.session.query(ExamResult.id, ExamResult.user_id, ExamResult.category, ExamResult.details_json)\
+                .filter(ExamResult.id > last_id, ~done)\
+                .order_by(ExamResult.id).limit(chunk_size).all()
+            if not rows:
+                break
+            answer_rows = []
+            for rid, uid, cat, details_json in rows:
+                try:
+                    details = json.loads(details_json) if details_json else []
+                except ValueError:
+                    details = []
+                answer_rows.extend(ExamAnswer.rows_from_details(rid, uid, details, cat or '默认题集'))
+            if answer_rows:
+                db.session.execute(ExamAnswer.__table__.insert(), answer_rows)
+            db.session.commit()
+            total += len(answer_rows)
+            last_id = rows[-1][0]
+        print(f"[DataManager] Backfilled {total} exam answers")
 
     def create_user(self, username, password, is_admin=False):
         print(f"[调试] 进入 create_user: username={username}, is_admin={is_admin}")
@@ -231,58 +546,118 @@ class DataManager:
         print(f"[调试] 已 commit 用户: {user.username}")
         return True
 
-    def get_user_dashboard_stats(self, user_id):
-        # 1. Score Trend (Last 7 exams)
-        recent_exams = ExamResult.query.filter_by(user_id=user_id)\
-            .order_by(ExamResult.timestamp.desc())\
-            .limit(7).all()
-        recent_exams.reverse() # Make it chronological
-        
-        trend_labels = [r.timestamp.split(' ')[0] for r in recent_exams]
-        trend_data = [r.total_score for r in recent_exams]
-        
-        # 2. Error Analysis (Top 5 wrong questions from last 20 exams)
-        analyze_exams = ExamResult.query.filter_by(user_id=user_id)\
+    DASHBOARD_TREND_SIZE = 7
+    DASHBOARD_MAX_ERRORS = 100
+
+    @staticmethod
+    def _short_label(content):
+        return (content[:10] + '..') if len(content) > 10 else content
+
+    def _prune_errors(self, errors):
+        # 只保留错误次数最多的若干题，避免单行无限增长
+        if len(errors) <= self.DASHBOARD_MAX_ERRORS:
+            return errors
+        kept = sorted(errors.items(), key=lambda kv: (kv[1]['wrong'], kv[1]['total']), reverse=True)
+        return dict(kept[:self.DASHBOARD_MAX_ERRORS])
+
+    def build_user_dashboard(self, user_id):
+        """从 UserCategoryStat / ExamResult / exam_answer 的索引查询构建看板（冷启动或删除成绩后）。"""
+        from sqlalchemy import func, case
+        from sqlalchemy.orm import load_only
+        attempts, score, max_score = db.session.query(
+            func.sum(UserCategoryStat.total_attempts),
+            func.sum(UserCategoryStat.total_score),
+            func.sum(UserCategoryStat.total_max_score)
+        ).filter(UserCategoryStat.user_id == user_id).one()
+
+        recent = ExamResult.query.options(load_only(ExamResult.id, ExamResult.timestamp, ExamResult.total_score))\
+            .filter_by(user_id=user_id)\
             .order_by(ExamResult.timestamp.desc())\
-            .limit(20).all()
-            
-        question_stats = {} # {short_content: {wrong: 0, total: 0}}
-        
-        for exam in analyze_exams:
-            details = exam.details
-            if not details: continue
-            for q in details:
-                content = q.get('question')
-                if not content: continue
-                
-                # Truncate content
-                short_content = (content[:10] + '..') if len(content) > 10 else content
-                
-                if short_content not in question_stats:
-                    question_stats[short_content] = {'wrong': 0, 'total': 0}
-                
-                question_stats[short_content]['total'] += 1
-                if q.get('score', 0) < q.get('full_score', 0):
-                    question_stats[short_content]['wrong'] += 1
-                    
-        # Calculate error counts
-        error_list = []
-        for content, stats in question_stats.items():
-            if stats['wrong'] > 0:
-                error_list.append({'label': content, 'count': stats['wrong']})
-        
-        # Sort by error count descending
-        error_list.sort(key=lambda x: x['count'], reverse=True)
-        top_errors = error_list[:5]
-        
+            .limit(self.DASHBOARD_TREND_SIZE).all()
+        trend = [{'id': r.id, 'label': (r.timestamp or '').split(' ')[0], 'score': r.total_score}
+                 for r in reversed(recent)]
+
+        wrong = func.sum(case((ExamAnswer.score < ExamAnswer.full_score, 1), else_=0))
+        rows = db.session.query(ExamAnswer.question_id, wrong, func.count(ExamAnswer.id))\
+            .filter(ExamAnswer.user_id == user_id, ExamAnswer.question_id.isnot(None))\
+            .group_by(ExamAnswer.question_id)\
+            .order_by(wrong.desc())\
+            .limit(self.DASHBOARD_MAX_ERRORS).all()
+        contents = dict(db.session.query(Question.id, Question.content)
+                        .filter(Question.id.in_([qid for qid, _, _ in rows])).all()) if rows else {}
+        errors = {
+            str(qid): {'label': self._short_label(contents.get(qid) or f'#{qid}'), 'wrong': int(w or 0), 'total': int(t or 0)}
+            for qid, w, t in rows
+        }
+
+        dash = UserDashboard(user_id=user_id, total_attempts=attempts or 0,
+                             total_score=score or 0, total_max_score=max_score or 0)
+        dash.trend = trend
+        dash.errors = errors
+        return dash
+
+    def record_dashboard_result(self, user_id, result_dict):
+        """评分后增量更新看板；尚无看板行时跳过，由首次读取时构建（已包含本次成绩）。"""
+        try:
+            dash = UserDashboard.query.filter_by(user_id=user_id).with_for_update().first()
+            if dash is None:
+                return
+            details = result_dict.get('details') or []
+            dash.total_attempts = (dash.total_attempts or 0) + len({d.get('category', '默认题集') for d in details})
+            dash.total_score = (dash.total_score or 0) + sum(d.get('score', 0) for d in details)
+            dash.total_max_score = (dash.total_max_score or 0) + sum(d.get('full_score', 0) for d in details)
+
+            trend = dash.trend
+            trend.append({'id': result_dict['id'], 'label': result_dict['timestamp'].split(' ')[0],
+                          'score': result_dict['total_score']})
+            dash.trend = trend[-self.DASHBOARD_TREND_SIZE:]
+
+            errors = dash.errors
+            for d in details:
+                qid = d.get('id')
+                if qid is None:
+                    continue
+                entry = errors.setdefault(str(qid), {'label': self._short_label(d.get('question') or f'#{qid}'),
+                                                     'wrong': 0, 'total': 0})
+                entry['total'] += 1
+                if d.get('score', 0) < d.get('full_score', 0):
+                    entry['wrong'] += 1
+            dash.errors = self._prune_errors(errors)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"[DataManager] Dashboard update failed for user {user_id}: {e}")
+
+    def get_user_dashboard_stats(self, user_id):
+        """首页看板：读取预聚合的一行数据，不再解析考试 details。"""
+        dash = db.session.get(UserDashboard, user_id)
+        if dash is None:
+            dash = self.build_user_dashboard(user_id)
+            try:
+                db.session.add(dash)
+                db.session.commit()
+            except Exception as e:
+                # 并发构建时另一请求已写入，直接使用本次构建结果
+                db.session.rollback()
+                print(f"[DataManager] Dashboard cache write skipped: {e}")
+
+        trend = dash.trend
+        # Top 5 wrong questions
+        top_errors = sorted((e for e in dash.errors.values() if e['wrong'] > 0),
+                            key=lambda e: e['wrong'], reverse=True)[:5]
+        total_max = dash.total_max_score or 0
         return {
             'trend': {
-                'labels': trend_labels,
-                'data': trend_data
+                'labels': [t['label'] for t in trend],
+                'data': [t['score'] for t in trend]
             },
             'errors': {
-                'labels': [x['label'] for x in top_errors],
-                'data': [x['count'] for x in top_errors]
+                'labels': [e['label'] for e in top_errors],
+                'data': [e['wrong'] for e in top_errors]
+            },
+            'summary': {
+                'total_exams': dash.total_attempts or 0,
+                'avg_accuracy': round((dash.total_score or 0) / total_max * 100, 1) if total_max > 0 else 0
             }
         }
 
@@ -319,6 +694,7 @@ class DataManager:
                     self.grant_permission(user_id, cat)
         
         db.session.commit()
+        self.leaderboard.update_user(user_id, category_results.keys())
 
     def grant_permission(self, user_id, category):
         perm = UserPermission.query.filter_by(user_id=user_id, category=category).first()
@@ -338,66 +714,164 @@ class DataManager:
         """
         Get leaderboard data.
         Returns a dict with 'global' and 'categories' keys.
+        优先读取 Redis 物化排行榜；Redis 不可用时退化为 SQL 聚合（按用户 GROUP BY，不再逐用户查询）。
         """
+        categories = self.get_categories()
+        if self.leaderboard.ensure_ready():
+            try:
+                return self.leaderboard.get_leaderboard_data(categories)
+            except Exception as e:
+                print(f"[DataManager] Redis leaderboard read failed, falling back to SQL: {e}")
+
+        from sqlalchemy import func
         # Global Leaderboard (Average Accuracy across all categories)
-        # We can aggregate UserCategoryStat
-        users = User.query.all()
+        global_rows = db.session.query(
+            User,
+            func.sum(UserCategoryStat.total_score),
+            func.sum(UserCategoryStat.total_max_score),
+            func.sum(UserCategoryStat.total_attempts)
+        ).join(UserCategoryStat, UserCategoryStat.user_id == User.id)\
+            .group_by(User.id)\
+            .having(func.sum(UserCategoryStat.total_max_score) > 0).all()
+
         global_leaderboard = []
-        
-        for user in users:
-            stats = UserCategoryStat.query.filter_by(user_id=user.id).all()
-            total_score = sum(s.total_score for s in stats)
-            total_max = sum(s.total_max_score for s in stats)
-            accuracy = (total_score / total_max * 100) if total_max > 0 else 0
-            
-            if total_max > 0: # Only include users who have taken exams
-                global_leaderboard.append({
-                    'user_id': user.id,
-                    'username': user.username,
-                    'stardust': user.stardust,
-                    'level_info': user.level_info,
-                    'accuracy': round(accuracy, 1),
-                    'total_exams': sum(s.total_attempts for s in stats)
-                })
-        
-        global_leaderboard.sort(key=lambda x: x['accuracy'], reverse=True)
-        
+        for user, total_score, total_max, attempts in global_rows:
+            global_leaderboard.append({
+                'user_id': user.id,
+                'username': user.username,
+                'stardust': user.stardust,
+                'level_info': user.level_info,
+                'accuracy': round(total_score / total_max * 100, 1),
+                'total_exams': attempts or 0
+            })
+        global_leaderboard.sort(key=lambda x: (x['accuracy'], x['total_exams']), reverse=True)
+
         # Category Leaderboards
-        categories = self.get_categories()
         category_leaderboards = {}
-        
-        for cat in categories:
-            cat_stats = UserCategoryStat.query.filter_by(category=cat).all()
-            leaderboard = []
-            for stat in cat_stats:
-                if stat.total_max_score > 0:
-                    acc = (stat.total_score / stat.total_max_score * 100)
-                    leaderboard.append({
-                        'user_id': stat.user_id,
-                        'username': stat.user.username,
-                        'stardust': stat.user.stardust,
-                        'level_info': stat.user.level_info,
-                        'accuracy': round(acc, 1),
-                        'attempts': stat.total_attempts
-                    })
-            leaderboard.sort(key=lambda x: x['accuracy'], reverse=True)
-            if leaderboard:
-                category_leaderboards[cat] = leaderboard
-                
+        cat_rows = db.session.query(UserCategoryStat, User)\
+            .join(User, UserCategoryStat.user_id == User.id)\
+            .filter(UserCategoryStat.category.in_(categories), UserCategoryStat.total_max_score > 0).all()
+        for stat, user in cat_rows:
+            category_leaderboards.setdefault(stat.category, []).append({
+                'user_id': user.id,
+                'username': user.username,
+                'stardust': user.stardust,
+                'level_info': user.level_info,
+                'accuracy': round(stat.total_score / stat.total_max_score * 100, 1),
+                'attempts': stat.total_attempts
+            })
+        for leaderboard in category_leaderboards.values():
+            leaderboard.sort(key=lambda x: (x['accuracy'], x['attempts']), reverse=True)
+            del leaderboard[50:]
+
         return {
             'global': global_leaderboard[:10], # Top 10
-            'categories': category_leaderboards
+            'categories': {cat: category_leaderboards[cat] for cat in categories if cat in category_leaderboards}
         }
 
+    def get_user_rank(self, user_id, category=None):
+        """
+        返回用户的全站（或指定类别）排名：{'rank', 'total', 'percentile'}，未参与排名返回 None。
+        percentile 为排名低于该用户的比例（%）。
+        同分同名次；优先 Redis ZCOUNT (O(log n))，否则在 UserCategoryStat 聚合上用 RANK() 窗口函数计算。
+        """
+        if self.leaderboard.ensure_ready():
+            try:
+                return self.leaderboard.get_rank(user_id, category)
+            except Exception as e:
+                print(f"[DataManager] Redis rank lookup failed, falling back to SQL: {e}")
+
+        from sqlalchemy import func
+        if category:
+            base = db.session.query(
+                UserCategoryStat.user_id.label('user_id'),
+                UserCategoryStat.total_score.label('score'),
+                UserCategoryStat.total_max_score.label('max_score'),
+                UserCategoryStat.total_attempts.label('attempts')
+            ).filter(UserCategoryStat.category == category, UserCategoryStat.total_max_score > 0).subquery()
+        else:
+            base = db.session.query(
+                UserCategoryStat.user_id.label('user_id'),
+                func.sum(UserCategoryStat.total_score).label('score'),
+                func.sum(UserCategoryStat.total_max_score).label('max_score'),
+                func.sum(UserCategoryStat.total_attempts).label('attempts')
+            ).group_by(UserCategoryStat.user_id)\
+                .having(func.sum(UserCategoryStat.total_max_score) > 0).subquery()
+        accuracy = func.round(base.c.score * 100.0 / base.c.max_score, 1)
+        ranked = db.session.query(
+            base.c.user_id,
+            func.rank().over(order_by=(accuracy.desc(), base.c.attempts.desc())).label('rank'),
+            func.count().over().label('total')
+        ).subquery()
+        row = db.session.query(ranked.c.rank, ranked.c.total).filter(ranked.c.user_id == user_id).first()
+        if not row:
+            return None
+        rank, total = int(row[0]), int(row[1])
+        return {'rank': rank, 'total': total, 'percentile': round((total - rank) / total * 100, 1)}
+
+    def get_user_category_ranks(self, user_id):
+        """用户参与过的每个类别的排名，{类别: rank_info}。"""
+        categories = [s.category for s in UserCategoryStat.query.filter_by(user_id=user_id).all()
+                      if (s.total_max_score or 0) > 0]
+        ranks = {}
+        for cat in sorted(categories):
+            info = self.get_user_rank(user_id, cat)
+            if info:
+                ranks[cat] = info
+        return ranks
+
+    def data_migrations(self):
+        """一次性数据回填，按顺序执行；由 `flask upgrade-data` 运行，不在进程启动时执行。"""
+        from web.services.search import SearchService
+        return [
+            ('exam_result_category', self.backfill_result_categories),
+            ('exam_answer', self.backfill_exam_answers),
+            ('question_content_hash', self.backfill_question_hashes),
+            ('forum_counters', self.backfill_forum_counters),
+            ('forum_inbox', self.backfill_forum_inbox),
+            ('search_index', SearchService().rebuild),
+            # 题库记录格式升级（v2 增加题目版本），重新导出一次
+            ('question_bank_v2', self.export_questions_to_txt),
+        ]
+
+    def upgrade_data(self):
+        """执行尚未完成的数据回填，返回本次执行的名称列表；任一回填失败时抛出异常，后续回填不再执行。"""
+        from web.utils.schema_upgrade import run_once
+        applied = []
+        for name, func in self.data_migrations():
+            try:
+                if run_once(name, func):
+                    applied.append(name)
+            except Exception:
+                db.session.rollback()
+                raise
+        return applied
+
     def init_db(self, app):
         with app.app_context():
             db.create_all()
+            from web.utils.schema_upgrade import upgrade_schema, is_applied
+            upgrade_schema()
+            try:
+                from web.services.search import SearchService
+                SearchService.ensure_schema()
+            except Exception as e:
+                db.session.rollback()
+                print(f"[DataManager] Search schema setup failed: {e}")
+            pending = [name for name, _ in self.data_migrations() if not is_applied(name)]
+            if pending:
+                print(f"[DataManager] Pending data migrations: {', '.join(pending)}; "
+                      f"run `flask --app web.app upgrade-data`")
+            if SystemCounter.query.count() < len(SystemCounter.NAMES):
+                self.reconcile_system_counters()
             if User.query.filter_by(is_admin=True).count() == 0:
                 admin = User(username='admin', is_admin=True)
                 admin.set_password('admin123')
                 db.session.add(admin)
                 db.session.commit()
                 print("Created default admin user (admin/admin123) because no admin existed.")
+            # 冷启动时从数据库重建 Redis 排行榜
+            self.leaderboard.ensure_ready()
 
     def get_question(self, q_id):
         q = Question.query.get(q_id)
@@ -0,0 +1,288 @@
+"""
+二进制题库 (questions.qbk) 的读写。
+
+文件布局（全部为小端 uint32/int32）：
+
+    header      64 字节，见 HEADER_FORMAT
+    records     每题 40 字节：id, score, version, category_index,
+                content_off, content_len, answer_off, answer_len, image_off, image_len
+    id_index    开放寻址哈希表，槽位存 record_index + 1（0 表示空槽）
+    categories  每个类别 16 字节：name_off, name_len, members_start, members_count
+    cat_index   开放寻址哈希表，槽位存 category_index + 1
+    members     按类别分组的 record_index 数组
+    strings     UTF-8 字符串池，每个字符串以 '\\0' 结尾，C 端可直接当 char* 使用
+
+C 端读取实现见 grader/src/qbank.c，两边的哈希函数必须保持一致。
+"""
+import os
+import mmap
+import struct
+import threading
+
+MAGIC = b'QBNK'
+VERSION = 2
+
+HEADER_FORMAT = '<4s14I'
+HEADER_SIZE = 64
+RECORD_FORMAT = '<iiiI6I'
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+CATEGORY_FORMAT = '<4I'
+CATEGORY_SIZE = struct.calcsize(CATEGORY_FORMAT)
+
+DEFAULT_CATEGORY = '默认题集'
+
+
+def _id_hash(question_id):
+    return (question_id * 2654435761) & 0xFFFFFFFF
+
+
+def _name_hash(name_bytes):
+    # FNV-1a 32 位
+    h = 2166136261
+    for b in name_bytes:
+        h ^= b
+        h = (h * 16777619) & 0xFFFFFFFF
+    return h
+
+
+def _slot_count(n):
+    # 装载因子不超过 0.5，且为 2 的幂，便于按位取模
+    size = 8
+    while size < n * 2:
+        size <<= 1
+    return size
+
+
+def write_question_bank(questions, path):
+    """
+    将题目列表写入二进制题库。questions 为 Question.to_dict() 格式的字典序列。
+    先写临时文件再原子替换，已 mmap 旧文件的读者不受影响。
+    """
+    pool = bytearray()
+    pool_index = {}
+
+    def intern(text):
+        data = (text or '').encode('utf-8')
+        off = pool_index.get(data)
+        if off is None:
+            off = len(pool)
+            pool_index[data] = off
+            pool.extend(data)
+            pool.append(0)
+        return off, len(data)
+
+    records = []
+    category_order = []
+    category_members = {}
+    for q in questions:
+        cat = q.get('category') or DEFAULT_CATEGORY
+        if cat not in category_members:
+            category_members[cat] = []
+            category_order.append(cat)
+        category_members[cat].append(len(records))
+        records.append((int(q['id']), int(q.get('score') or 0), int(q.get('version') or 1), cat,
+                        intern(q.get('content')), intern(q.get('answer')), intern(q.get('image'))))
+
+    cat_pos = {cat: i for i, cat in enumerate(category_order)}
+
+    id_slots = _slot_count(len(records))
+    id_index = [0] * id_slots
+    for i, rec in enumerate(records):
+        slot = _id_hash(rec[0]) & (id_slots - 1)
+        while id_index[slot]:
+            slot = (slot + 1) & (id_slots - 1)
+        id_index[slot] = i + 1
+
+    cat_slots = _slot_count(len(category_order))
+    cat_index = [0] * cat_slots
+    categories = bytearray()
+    members = []
+    for i, cat in enumerate(category_order):
+        name_off, name_len = intern(cat)
+        categories += struct.pack(CATEGORY_FORMAT, name_off, name_len, len(members), len(category_members[cat]))
+        members.extend(category_members[cat])
+        slot = _name_hash(cat.encode('utf-8')) & (cat_slots - 1)
+        while cat_index[slot]:
+            slot = (slot + 1) & (cat_slots - 1)
+        cat_index[slot] = i + 1
+
+    body = bytearray()
+    for qid, score, version, cat, content, answer, image in records:
+        body += struct.pack(RECORD_FORMAT, qid, score, version, cat_pos[cat],
+                            content[0], content[1], answer[0], answer[1], image[0], image[1])
+
+    records_off = HEADER_SIZE
+    id_index_off = records_off + len(body)
+    categories_off = id_index_off + id_slots * 4
+    cat_index_off = categories_off + len(categories)
+    members_off = cat_index_off + cat_slots * 4
+    strings_off = members_off + len(members) * 4
+    file_size = strings_off + len(pool)
+
+    header = struct.pack(HEADER_FORMAT, MAGIC, VERSION, HEADER_SIZE, len(records), len(category_order),
+                         id_slots, cat_slots, records_off, id_index_off, categories_off, cat_index_off,
+                         members_off, strings_off, len(pool), file_size)
+    header = header.ljust(HEADER_SIZE, b'\0')
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(header)
+        f.write(body)
+        f.write(struct.pack(f'<{id_slots}I', *id_index))
+        f.write(categories)
+        f.write(struct.pack(f'<{cat_slots}I', *cat_index))
+        f.write(struct.pack(f'<{len(members)}I', *members))
+        f.write(pool)
+    os.replace(tmp_path, path)
+    return len(records)
+
+
+class QuestionBank:
+    """
+    只读访问 questions.qbk：按 id、按类别查找均为 O(1)，字符串按需解码。
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.mtime = os.fstat(f.fileno()).st_mtime
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, header_size, self.count, self.category_count, self._id_slots, self._cat_slots,
+         self._records_off, self._id_index_off, self._categories_off, self._cat_index_off,
+         self._members_off, self._strings_off, strings_size, file_size) = struct.unpack_from(HEADER_FORMAT, self._mm, 0)
+        if magic != MAGIC or version != VERSION or file_size != len(self._mm):
+            self._mm.close()
+            raise ValueError(f"Invalid question bank file: {path}")
+
+    def close(self):
+        self._mm.close()
+
+    def __len__(self):
+        return self.count
+
+    def _string(self, off, length):
+        start = self._strings_off + off
+        return self._mm[start:start + length].decode('utf-8')
+
+    def _category_name(self, cat_idx):
+        name_off, name_len, _, _ = struct.unpack_from(CATEGORY_FORMAT, self._mm, self._categories_off + cat_idx * CATEGORY_SIZE)
+        return self._string(name_off, name_len)
+
+    def _record(self, idx):
+        (qid, score, version, cat_idx, content_off, content_len, answer_off, answer_len,
+         image_off, image_len) = struct.unpack_from(RECORD_FORMAT, self._mm, self._records_off + idx * RECORD_SIZE)
+        return {
+            'id': qid,
+            'content': self._string(content_off, content_len),
+            'answer': self._string(answer_off, answer_len),
+            'score': score,
+            'version': version,
+            'image': self._string(image_off, image_len) or None,
+            'category': self._category_name(cat_idx),
+        }
+
+    def get(self, question_id):
+        mask = self._id_slots - 1
+        slot = _id_hash(int(question_id)) & mask
+        for _ in range(self._id_slots):
+            entry = struct.unpack_from('<I', self._mm, self._id_index_off + slot * 4)[0]
+            if not entry:
+                return None
+            qid = struct.unpack_from('<i', self._mm, self._records_off + (entry - 1) * RECORD_SIZE)[0]
+            if qid == question_id:
+                return self._record(entry - 1)
+            slot = (slot + 1) & mask
+        return None
+
+    def by_category(self, category):
+        name = category.encode('utf-8')
+        mask = self._cat_slots - 1
+        slot = _name_hash(name) & mask
+        for _ in range(self._cat_slots):
+            entry = struct.unpack_from('<I', self._mm, self._cat_index_off + slot * 4)[0]
+            if not entry:
+                return []
+            name_off, name_len, start, count = struct.unpack_from(
+                CATEGORY_FORMAT, self._mm, self._categories_off + (entry - 1) * CATEGORY_SIZE)
+            if self._mm[self._strings_off + name_off:self._strings_off + name_off + name_len] == name:
+                idxs = struct.unpack_from(f'<{count}I', self._mm, self._members_off + start * 4)
+                return [self._record(i) for i in idxs]
+            slot = (slot + 1) & mask
+        return []
+
+    def categories(self):
+        return [self._category_name(i) for i in range(self.category_count)]
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self._record(i)
+
+
+_bank_lock = threading.Lock()
+_bank_cache = {}
+
+
+def get_question_bank(path):
+    """
+    进程内缓存的题库句柄，文件被重新导出（mtime 变化）后自动重新映射。
+    文件不存在或损坏时返回 None。
+    """
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        return None
+    with _bank_lock:
+        bank = _bank_cache.get(path)
+        if bank is None or bank.mtime != mtime:
+            try:
+                bank = QuestionBank(path)
+            except (OSError, ValueError) as e:
+                print(f"[QuestionBank] Failed to open {path}: {e}")
+                return None
+            # 旧句柄不显式关闭：其他线程可能仍在读取，最后一个引用释放后由 GC 解除映射
+            _bank_cache[path] = bank
+        return bank
+
+
+def iter_questions_txt(path):
+    """
+    解析旧版管道分隔格式：题目|答案|分值|图片文件名|类别，题目中的换行以 [NEWLINE] 表示。
+    逐行产出 (行号, 字典, 错误信息)，行格式错误时字典为 None；未填类别时 category 为 None，由调用方决定默认类别。
+    """
+    with open(path, encoding='utf-8') as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.rstrip('\r\n')
+            if not line.strip():
+                continue
+            parts = line.split('|')
+            if len(parts) < 3:
+                yield line_no, None, '缺少分隔符'
+                continue
+            try:
+                score = int(parts[2])
+            except ValueError:
+                yield line_no, None, f"分值格式错误: {parts[2]}"
+                continue
+            yield line_no, {
+                'content': parts[0].replace('[NEWLINE]', '\n'),
+                'answer': parts[1],
+                'score': score,
+                'image': parts[3] if len(parts) > 3 and parts[3] else None,
+                'category': parts[4] if len(parts) > 4 and parts[4] else None,
+            }, None
+
+
+if __name__ == '__main__':
+    # 供纯 CLI 环境使用：python question_bank.py questions.txt questions.qbk
+    import sys
+    if len(sys.argv) != 3:
+        print("Usage: python question_bank.py <questions.txt> <questions.qbk>")
+        sys.exit(1)
+    rows = []
+    for line_no, row, error in iter_questions_txt(sys.argv[1]):
+        if error:
+            print(f"Line {line_no}: {error}")
+            continue
+        row['id'] = len(rows) + 1
+        rows.append(row)
+    count = write_question_bank(rows, sys.argv[2])
+    print(f"Wrote {count} questions to {sys.argv[2]}")
@@ -160,14 +160,14 @@ class GradingQueue:
         # Copied from original file
         ids = data['ids']
         user_answers_map = data['user_answers'] 
-        all_questions = data['all_questions']
+        questions_by_id = {item['id']: item for item in data['all_questions']}
         
         total_score = 0
         results = []
         exam_questions = []
 
         for i, q_id in enumerate(ids):
-            q = next((item for item in all_questions if item['id'] == q_id), None)
+            q = questions_by_id.get(q_id)
             if not q: continue
             
             exam_questions.append(q)
@@ -203,7 +203,8 @@ class GradingQueue:
                 'user_ans': user_ans,
                 'correct_ans': q['answer'],
                 'score': score,
-                'full_score': q['score']
+                'full_score': q['score'],
+                'version': q.get('version')
             })
             
         max_score = sum(q['score'] for q in exam_questions)
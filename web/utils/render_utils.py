@@ -1,5 +1,35 @@
+import hashlib
+
+# 渲染器版本：升级 markdown2 或修改渲染选项时递增，已缓存的 HTML 会在下次读取时重新渲染
+RENDERER_ID = 'markdown2-1'
+RENDER_MODES = ('html', 'markdown')
+
+
+def normalize_mode(mode, default='html'):
+    return mode if mode in RENDER_MODES else default
+
+
 def render_content(raw, mode):
     if mode == 'markdown':
         import markdown2
         return markdown2.markdown(raw or '')
     return raw or ''
+
+
+def render_key(raw, mode):
+    """缓存键：渲染器版本 + 模式 + 原文的 SHA-256，原文或模式变化后自然失效。"""
+    return hashlib.sha256(f'{RENDERER_ID}\x1f{mode}\x1f{raw or ""}'.encode('utf-8')).hexdigest()
+
+
+def render_cached(obj, raw, mode):
+    """
+    读取 obj.content_html 缓存，键不匹配时重新渲染并写回（由调用方提交）。
+    html 模式原样输出，不占用缓存列。
+    """
+    if mode != 'markdown':
+        return raw or ''
+    key = render_key(raw, mode)
+    if obj.content_html_key != key or obj.content_html is None:
+        obj.content_html = render_content(raw, mode)
+        obj.content_html_key = key
+    return obj.content_html
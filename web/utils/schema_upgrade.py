@@ -0,0 +1,69 @@
+"""
+轻量级结构升级：项目未使用 Alembic 迁移目录，db.create_all() 只会创建缺失的表，
+不会给已有表补列或补索引。这里在启动时对照模型补齐新增的列和索引，
+并提供一次性数据回填的登记机制（以 SystemSetting 记录已执行的回填）。
+数据回填耗时且不应由每个进程在启动时并发执行，统一由 `flask upgrade-data` 显式运行。
+"""
+from sqlalchemy import inspect, text
+from web.models import db, SystemSetting
+
+
+def _column_default_sql(column, dialect):
+    default = column.default
+    if default is None or not getattr(default, 'is_scalar', False):
+        return ''
+    value = default.arg
+    if isinstance(value, bool):
+        return ' DEFAULT ' + (('TRUE' if value else 'FALSE') if dialect.name == 'postgresql' else ('1' if value else '0'))
+    if isinstance(value, (int, float)):
+        return f' DEFAULT {value}'
+    if isinstance(value, str):
+        return " DEFAULT '" + value.replace("'", "''") + "'"
+    return ''
+
+
+def upgrade_schema():
+    """
+    为已有表补齐模型中新增的列（均按可空列添加）和索引。
+    每条语句单独执行：多进程同时启动时重复的 ALTER 会失败，但不影响其余列和索引。
+    """
+    engine = db.engine
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing_cols = {c['name'] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_cols:
+                continue
+            col_type = column.type.compile(dialect=engine.dialect)
+            default_sql = _column_default_sql(column, engine.dialect)
+            try:
+                with engine.begin() as conn:
+                    conn.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {col_type}{default_sql}'))
+                print(f"[Schema] Added column {table.name}.{column.name}")
+            except Exception as e:
+                print(f"[Schema] Failed to add column {table.name}.{column.name}: {e}")
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                index.create(bind=engine, checkfirst=True)
+            except Exception as e:
+                print(f"[Schema] Failed to create index {index.name}: {e}")
+
+
+def is_applied(name):
+    """一次性回填是否已执行。"""
+    return db.session.get(SystemSetting, f'migration:{name}') is not None
+
+
+def run_once(name, func):
+    """执行一次性回填；以 SystemSetting('migration:<name>') 标记完成，避免每次启动重复执行。"""
+    if is_applied(name):
+        return False
+    func()
+    db.session.add(SystemSetting(key=f'migration:{name}', value='done'))
+    db.session.commit()
+    print(f"[Schema] Applied data migration {name}")
+    return True
@@ -0,0 +1,107 @@
+"""
+搜索分词：与 text_analyzer（C 分析器）相同的词典和正向最大匹配思路，纯 Python 实现，
+不依赖动态库是否编译、也不会因词典缺失退出进程。
+  - 中文连续片段：按 text_analyzer/dict/Chinese 下的词典切词
+  - 其他字母数字片段：转小写后按词切分
+  - 中英文停用词均被丢弃
+索引与查询使用不同的切法（见 index_tokens / query_tokens），保证查询串只要是原文的子串就能命中。
+"""
+import html
+import os
+import re
+import threading
+
+CJK = '\u3400-\u4dbf\u4e00-\u9fff'
+_RUN_RE = re.compile(rf'[{CJK}]+|[^\W_{CJK}]+')
+_TAG_RE = re.compile(r'<[^>]+>')
+_CJK_WORD_RE = re.compile(rf'^[{CJK}]+$')
+
+
+class Segmenter:
+    WORD_DICTS = ('dict.txt', 'IT.txt', 'idiom.txt')  # 与 analyzer.c 的 load_main_dicts_once 一致，缺失的文件跳过
+    STOP_WORDS = (os.path.join('Chinese', 'stop_words_cn.txt'), os.path.join('English', 'stop_words_en.txt'))
+
+    _instances = {}
+    _lock = threading.Lock()
+
+    def __init__(self, dict_dir):
+        self.words = set()
+        self.stop_words = set()
+        for name in self.WORD_DICTS:
+            for word in self._read(os.path.join(dict_dir, 'Chinese', name)):
+                if len(word) > 1 and _CJK_WORD_RE.match(word):
+                    self.words.add(word)
+        for name in self.STOP_WORDS:
+            self.stop_words.update(w.lower() for w in self._read(os.path.join(dict_dir, name)))
+        self.max_len = max((len(w) for w in self.words), default=1)
+        print(f"[Search] Loaded {len(self.words)} dictionary words from {dict_dir}")
+
+    @classmethod
+    def get(cls, dict_dir=None):
+        """按词典目录缓存的单例，词典只在进程内加载一次。"""
+        if dict_dir is None:
+            from config import Config
+            dict_dir = Config.ANALYZER_DICT_DIR
+        instance = cls._instances.get(dict_dir)
+        if instance is None:
+            with cls._lock:
+                instance = cls._instances.get(dict_dir)
+                if instance is None:
+                    instance = cls._instances[dict_dir] = cls(dict_dir)
+        return instance
+
+    @staticmethod
+    def _read(path):
+        """词典每行 "词 频次" 或仅 "词"。"""
+        if not os.path.exists(path):
+            return []
+        with open(path, encoding='utf-8', errors='ignore') as f:
+            return [line.split()[0] for line in f if line.split()]
+
+    @staticmethod
+    def plain_text(text):
+        """去掉 HTML 标签与实体，用于题目 / 主题正文。"""
+        return html.unescape(_TAG_RE.sub(' ', text or ''))
+
+    def _runs(self, text):
+        for match in _RUN_RE.finditer(text.lower()):
+            run = match.group()
+            yield run, '\u3400' <= run[0] <= '\u9fff'
+
+    def index_tokens(self, text):
+        """
+        索引切分：中文每个位置输出单字以及所有以该字开头的词典词（类似搜索引擎模式），
+        这样无论查询按什么边界切分，只要是原文子串就一定全部命中。
+        """
+        tokens = []
+        for run, is_cjk in self._runs(text):
+            if not is_cjk:
+                if run not in self.stop_words:
+                    tokens.append(run)
+                continue
+            for i, char in enumerate(run):
+                if char not in self.stop_words:
+                    tokens.append(char)
+                for length in range(2, min(self.max_len, len(run) - i) + 1):
+                    word = run[i:i + length]
+                    if word in self.words and word not in self.stop_words:
+                        tokens.append(word)
+        return tokens
+
+    def query_tokens(self, text):
+        """查询切分：正向最大匹配，未登录的字按单字输出；去重并保持顺序。"""
+        tokens = []
+        for run, is_cjk in self._runs(text):
+            if not is_cjk:
+                tokens.append(run)
+                continue
+            i = 0
+            while i < len(run):
+                for length in range(min(self.max_len, len(run) - i), 1, -1):
+                    if run[i:i + length] in self.words:
+                        break
+                else:
+                    length = 1
+                tokens.append(run[i:i + length])
+                i += length
+        return list(dict.fromkeys(t for t in tokens if t not in self.stop_words))